@@ -0,0 +1,249 @@
+"""
+In-memory stand-in for the EC2 and AutoScaling APIs Fleeting uses.
+
+Both connections share one FakeAWS backend, which counts every call,
+including deletes made through the group and launch configuration
+objects it hands out, and can sleep for a while on each call to mimic
+the round trip to Amazon. Only the behaviour Fleeting relies on is
+modelled: tag and state filters, paging of AutoScaling descriptions,
+and ResourceInUse errors when deleting things that are still in use.
+"""
+
+import time
+import datetime
+import itertools
+from threading import Lock
+from collections import Counter
+
+from boto.exception import BotoServerError, EC2ResponseError
+from boto.resultset import ResultSet
+
+# AutoScaling describes at most this many groups or configs per call.
+PAGE_SIZE = 50
+
+ERROR_BODY = ('<ErrorResponse><Error><Code>%s</Code>'
+              '<Message>%s</Message></Error></ErrorResponse>')
+EC2_ERROR_BODY = ('<Response><Errors><Error><Code>%s</Code>'
+                  '<Message>%s</Message></Error></Errors></Response>')
+
+def _as_list(value):
+    if isinstance(value, basestring):
+        return [value]
+    return list(value)
+
+def _page(items, names, next_token):
+    if names:
+        items = [item for item in items if item.name in names]
+    start = int(next_token or 0)
+    results = ResultSet()
+    results.extend(items[start:start + PAGE_SIZE])
+    if start + PAGE_SIZE < len(items):
+        results.next_token = str(start + PAGE_SIZE)
+    return results
+
+class FakeInstance(object):
+    def __init__(self, instance_id, state, tags, launch_time):
+        self.id = instance_id
+        self.state = state
+        self.tags = tags
+        self.launch_time = launch_time
+        self.public_dns_name = ''
+        if state == 'running':
+            self.public_dns_name = 'ec2-%s.compute-1.amazonaws.com' % (
+                instance_id[2:]
+            )
+
+class FakeReservation(object):
+    def __init__(self, instance):
+        self.instances = [instance]
+
+class FakeGroupInstance(object):
+    def __init__(self, instance_id):
+        self.instance_id = instance_id
+
+class FakeGroup(object):
+    def __init__(self, connection, name, launch_config_name, min_size,
+                 tags):
+        self.connection = connection
+        self.name = name
+        self.launch_config_name = launch_config_name
+        self.min_size = min_size
+        self.max_size = min_size
+        self.tags = tags
+        self.instances = []
+
+    def delete(self):
+        self.connection.delete_auto_scaling_group(self.name)
+
+    def shutdown_instances(self):
+        self.min_size = self.max_size = 0
+        self.connection.update_auto_scaling_group(self)
+
+class FakeLaunchConfig(object):
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+
+    def delete(self):
+        self.connection.delete_launch_configuration(self.name)
+
+class FakeAWS(object):
+    def __init__(self, latency=0.0, latencies=None):
+        self.latency = latency
+        self.latencies = latencies or {}
+        self.lock = Lock()
+        self.calls = Counter()
+        self.instances = {}
+        self.groups = {}
+        self.launch_configs = {}
+        self.ids = itertools.count(1)
+        self.ec2 = FakeEC2Connection(self)
+        self.autoscale = FakeAutoScaleConnection(self)
+
+    def call(self, method):
+        with self.lock:
+            self.calls[method] += 1
+        # Sleeping outside the lock lets concurrent callers overlap, as
+        # they would against the real thing.
+        delay = self.latencies.get(method, self.latency)
+        if delay:
+            time.sleep(delay)
+
+    def reset_calls(self):
+        with self.lock:
+            calls, self.calls = self.calls, Counter()
+        return calls
+
+    def launch(self, tags, state='pending', group=None, launch_time=None):
+        if launch_time is None:
+            launch_time = datetime.datetime.utcnow()
+        inst = FakeInstance('i-%08x' % next(self.ids), state, dict(tags),
+                            launch_time.strftime('%Y-%m-%dT%H:%M:%S.000Z'))
+        self.instances[inst.id] = inst
+        if group is not None:
+            group.instances.append(FakeGroupInstance(inst.id))
+        return inst
+
+    def add_group(self, name, launch_config_name, tags, min_size=1,
+                  instance_state='pending'):
+        self.launch_configs[launch_config_name] = FakeLaunchConfig(
+            self.autoscale, launch_config_name
+        )
+        group = FakeGroup(self.autoscale, name, launch_config_name, min_size,
+                          dict(tags))
+        self.groups[name] = group
+        for i in range(min_size):
+            self.launch(tags, instance_state, group)
+        return group
+
+    def terminate(self, group):
+        for member in group.instances:
+            self.instances[member.instance_id].state = 'terminated'
+            self.instances[member.instance_id].public_dns_name = ''
+        group.instances = []
+
+class FakeEC2Connection(object):
+    def __init__(self, aws):
+        self.aws = aws
+
+    def get_all_instances(self, instance_ids=None, filters=None):
+        self.aws.call('get_all_instances')
+        filters = filters or {}
+        if instance_ids is not None:
+            missing = [i for i in instance_ids if i not in self.aws.instances]
+            if missing:
+                code = 'InvalidInstanceID.NotFound'
+                raise EC2ResponseError(400, 'Bad Request', EC2_ERROR_BODY % (
+                    code, 'The instance ID %s does not exist' % missing[0]
+                ))
+            instances = [self.aws.instances[i] for i in instance_ids]
+        else:
+            instances = sorted(self.aws.instances.values(),
+                               key=lambda inst: inst.id)
+        if 'tag-key' in filters:
+            keys = _as_list(filters['tag-key'])
+            instances = [inst for inst in instances
+                         if any(key in inst.tags for key in keys)]
+        if 'instance-state-name' in filters:
+            states = _as_list(filters['instance-state-name'])
+            instances = [inst for inst in instances if inst.state in states]
+        return [FakeReservation(inst) for inst in instances]
+
+    def create_tags(self, resource_ids, tags):
+        self.aws.call('create_tags')
+        for resource_id in resource_ids:
+            self.aws.instances[resource_id].tags.update(tags)
+        return True
+
+class FakeAutoScaleConnection(object):
+    def __init__(self, aws):
+        self.aws = aws
+
+    def _raise_in_use(self, message):
+        raise BotoServerError(400, 'Bad Request',
+                              ERROR_BODY % ('ResourceInUse', message))
+
+    def get_all_groups(self, names=None, max_records=None, next_token=None):
+        self.aws.call('get_all_groups')
+        return _page(sorted(self.aws.groups.values(), key=lambda g: g.name),
+                     names, next_token)
+
+    def get_all_launch_configurations(self, names=None, max_records=None,
+                                      next_token=None):
+        self.aws.call('get_all_launch_configurations')
+        return _page(sorted(self.aws.launch_configs.values(),
+                            key=lambda lc: lc.name),
+                     names, next_token)
+
+    def create_launch_configuration(self, launch_config):
+        self.aws.call('create_launch_configuration')
+        self.aws.launch_configs[launch_config.name] = FakeLaunchConfig(
+            self, launch_config.name
+        )
+
+    def create_auto_scaling_group(self, as_group):
+        self.aws.call('create_auto_scaling_group')
+        group = FakeGroup(self, as_group.name, as_group.launch_config_name,
+                          as_group.min_size, {})
+        self.aws.groups[group.name] = group
+        # Instances are launched with the group's propagated tags.
+        tags = dict((tag.key, tag.value) for tag in as_group.tags or []
+                    if tag.propagate_at_launch)
+        for i in range(group.min_size):
+            self.aws.launch(tags, group=group)
+
+    def create_or_update_tags(self, tags):
+        self.aws.call('create_or_update_tags')
+        for tag in tags:
+            self.aws.groups[tag.resource_id].tags[tag.key] = tag.value
+
+    def create_scheduled_group_action(self, as_group, name, time=None,
+                                      desired_capacity=None, min_size=None,
+                                      max_size=None, **kwargs):
+        self.aws.call('create_scheduled_group_action')
+
+    def put_notification_configuration(self, autoscale_group, topic,
+                                       notification_types):
+        self.aws.call('put_notification_configuration')
+
+    def update_auto_scaling_group(self, group):
+        self.aws.call('update_auto_scaling_group')
+        if group.min_size == 0:
+            self.aws.terminate(group)
+
+    def delete_auto_scaling_group(self, name):
+        self.aws.call('delete_auto_scaling_group')
+        group = self.aws.groups[name]
+        if group.instances:
+            self._raise_in_use('You cannot delete an AutoScalingGroup while '
+                               'there are instances still in the group.')
+        del self.aws.groups[name]
+
+    def delete_launch_configuration(self, name):
+        self.aws.call('delete_launch_configuration')
+        if any(group.launch_config_name == name
+               for group in self.aws.groups.values()):
+            self._raise_in_use('Cannot delete launch configuration %s '
+                               'because it is attached to an '
+                               'AutoScalingGroup.' % name)
+        del self.aws.launch_configs[name]
@@ -0,0 +1,200 @@
+"""
+Benchmarks of fleet-wide operations against the in-memory AWS stand-in
+in benchmarks.fakeaws, at several fleet sizes. Each scenario reports its
+wall time and the number of AWS calls it made, and can be compared
+against the baselines saved in benchmarks/baselines.json.
+
+Run it with `python manage.py bench`, adding `--save` to record new
+baselines, or with `python -m benchmarks.fleet` to compare against the
+baselines with the default settings.
+"""
+
+import os
+import gc
+import json
+import time
+import logging
+from contextlib import contextmanager
+
+import fleeting
+from fleeting import project, metrics
+from fleeting.tempcache import DictTempCache
+
+from .fakeaws import FakeAWS
+
+SIZES = [10, 100, 1000]
+DEFAULT_LATENCY = 0.01
+REPEAT = 3
+PROJECT = 'openbadges'
+# Every this many live instances, one is still pending and one
+# terminated instance has left its group behind for cleanup.
+PENDING_EVERY = 10
+LEFTOVER_EVERY = 10
+DESTROYS = 10
+# Wall time regressions smaller than this are considered noise.
+MIN_REGRESSION = 0.005
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'baselines.json')
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+def seed_fleet(aws, proj, size):
+    for i in range(size):
+        slug = 'branch%d' % i
+        info = dict(slug=slug, git_user='user%d' % i, git_branch='master',
+                    lifetime=86400.0)
+        tags = {proj.tag_name: json.dumps(info)}
+        if i % PENDING_EVERY:
+            tags[proj.ready_tag_name] = 'http://branch%d.example.org/' % i
+        aws.add_group(proj._get_autoscale_group_name(slug),
+                      proj._get_launch_config_name(slug), tags,
+                      instance_state='running' if i % PENDING_EVERY
+                                     else 'pending')
+    for i in range(max(size // LEFTOVER_EVERY, 1)):
+        slug = 'gone%d' % i
+        info = dict(slug=slug, git_user='user%d' % i, git_branch='master',
+                    lifetime=86400.0)
+        group = aws.add_group(proj._get_autoscale_group_name(slug),
+                              proj._get_launch_config_name(slug),
+                              {proj.tag_name: json.dumps(info)},
+                              instance_state='running')
+        group.min_size = group.max_size = 0
+        aws.terminate(group)
+
+@contextmanager
+def installed(aws):
+    saved = (project._ec2_conn, project._ec2_autoscale_conn, project.cache,
+             metrics.store)
+    project._ec2_conn = aws.ec2
+    project._ec2_autoscale_conn = aws.autoscale
+    project.cache = DictTempCache(project.DEFAULT_CACHE_TTL)
+    metrics.store = metrics.LocalMetrics()
+    try:
+        yield
+    finally:
+        (project._ec2_conn, project._ec2_autoscale_conn, project.cache,
+         metrics.store) = saved
+
+def sweep(proj):
+    project.sweep_inventory()
+
+def get_instances(proj):
+    proj.get_instances()
+
+def cleanup_instances(proj):
+    proj.cleanup_instances(logger=logger)
+
+def destroy_instances(proj):
+    for i in range(DESTROYS):
+        proj.destroy_instance('branch%d' % i)
+
+def render_list(proj):
+    rv = fleeting.app.test_client().get('/%s/list' % proj.id)
+    if rv.status_code != 200:
+        raise AssertionError('/%s/list returned %s' % (proj.id, rv.status))
+
+# Each scenario has a name, an untimed setup step and the timed step.
+SCENARIOS = [
+    ('get_instances', None, get_instances),
+    ('get_instances_snapshot', sweep, get_instances),
+    ('cleanup_instances', None, cleanup_instances),
+    ('destroy_instance_x%d' % DESTROYS, None, destroy_instances),
+    ('list', sweep, render_list),
+]
+
+def bench(setup, step, size, latency, repeat):
+    proj = project.get_project(PROJECT)
+    best = None
+    # The first run warms up things like compiled templates and isn't
+    # counted.
+    for i in range(repeat + 1):
+        aws = FakeAWS(latency=latency)
+        seed_fleet(aws, proj, size)
+        with installed(aws):
+            if setup:
+                setup(proj)
+            aws.reset_calls()
+            # As with timeit, collections are kept out of the timings.
+            gc.disable()
+            try:
+                start = time.time()
+                step(proj)
+                elapsed = time.time() - start
+            finally:
+                gc.enable()
+        if i == 0:
+            continue
+        if best is None or elapsed < best:
+            best = elapsed
+    return dict(seconds=best, calls=sum(aws.calls.values()),
+                methods=dict(aws.calls))
+
+def load_baselines(filename=BASELINES):
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f)
+
+def save_baselines(results, latency, filename=BASELINES):
+    with open(filename, 'w') as f:
+        json.dump(dict(latency=latency, results=results), f, indent=2,
+                  sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+
+def compare(result, baseline, tolerance, same_latency=True):
+    # Call counts are deterministic, so any increase is a regression;
+    # wall time is only compared when run at the baseline's latency.
+    notes = []
+    regressed = False
+    if result['calls'] > baseline['calls']:
+        regressed = True
+    if result['calls'] != baseline['calls']:
+        notes.append('calls %d -> %d' % (baseline['calls'], result['calls']))
+    if same_latency and baseline['seconds']:
+        change = result['seconds'] / baseline['seconds'] - 1
+        notes.append('%+d%%' % (change * 100))
+        if (change > tolerance and
+            result['seconds'] - baseline['seconds'] > MIN_REGRESSION):
+            regressed = True
+    if regressed:
+        notes.append('REGRESSION')
+    return regressed, ', '.join(notes)
+
+def run(sizes=SIZES, latency=DEFAULT_LATENCY, repeat=REPEAT, baselines=None,
+        tolerance=0.5, out=None):
+    results = {}
+    regressions = []
+    if baselines:
+        same_latency = baselines['latency'] == latency
+        if out and not same_latency:
+            out.write('Baselines were taken at %gs latency, so only call '
+                      'counts are compared.\n' % baselines['latency'])
+    if out:
+        out.write('%-26s %9s %10s %6s\n' % ('scenario', 'instances', 'ms',
+                                            'calls'))
+    for name, setup, step in SCENARIOS:
+        results[name] = {}
+        for size in sizes:
+            result = bench(setup, step, size, latency, repeat)
+            results[name][str(size)] = result
+            note = ''
+            baseline = (baselines or {}).get('results', {}).get(
+                name, {}
+            ).get(str(size))
+            if baseline:
+                regressed, note = compare(result, baseline, tolerance,
+                                          same_latency)
+                if regressed:
+                    regressions.append((name, size))
+            if out:
+                out.write('%-26s %9d %10.1f %6d  %s\n' % (
+                    name, size, result['seconds'] * 1000, result['calls'],
+                    note
+                ))
+    return results, regressions
+
+if __name__ == '__main__':
+    import sys
+
+    run(baselines=load_baselines(), out=sys.stdout)
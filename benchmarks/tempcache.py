@@ -0,0 +1,81 @@
+"""
+Microbenchmark comparing DictTempCache against the original
+implementation, which scanned and deep-copied every entry on each
+operation.
+
+Run it with `python -m benchmarks.tempcache`.
+"""
+
+import time
+from copy import deepcopy
+from threading import Lock
+
+from fleeting.tempcache import DictTempCache
+
+ENTRY_COUNTS = [1000, 10000]
+PROJECTS = 20
+FINDS = 200
+
+class LegacyDictTempCache(object):
+    def __init__(self, ttl):
+        self.__cache = {}
+        self.ttl = ttl
+        self.lock = Lock()
+
+    def __cleanup(self):
+        now = time.time()
+        for key in self.__cache.keys():
+            if now >= self.__cache[key]['expiry']:
+                del self.__cache[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.__cleanup()
+            self.__cache[key] = dict(value=deepcopy(value),
+                                     expiry=time.time() + self.ttl)
+
+    def find(self, prefix):
+        with self.lock:
+            self.__cleanup()
+            return [deepcopy(self.__cache[key]['value'])
+                    for key in self.__cache
+                    if key.startswith(prefix)]
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+def bench(cache_class, entries):
+    cache = cache_class(3600)
+    keys = ['fleeting:project%d:slug%d' % (i % PROJECTS, i)
+            for i in range(entries)]
+
+    def fill():
+        for key in keys:
+            cache[key] = dict(slug=key, state='pending', lifetime=86400.0)
+
+    def find():
+        for i in range(FINDS):
+            cache.find('fleeting:project%d:' % (i % PROJECTS))
+
+    return timed(fill), timed(find)
+
+def run(entry_counts=ENTRY_COUNTS, out=None):
+    results = []
+    for entries in entry_counts:
+        legacy = bench(LegacyDictTempCache, entries)
+        current = bench(DictTempCache, entries)
+        results.append((entries, legacy, current))
+        if out:
+            out.write('%6d entries: set %8.3fs -> %7.3fs, '
+                      '%d finds %8.3fs -> %7.3fs\n' % (
+                entries, legacy[0], current[0], FINDS,
+                legacy[1], current[1]
+            ))
+    return results
+
+if __name__ == '__main__':
+    import sys
+
+    run(out=sys.stdout)
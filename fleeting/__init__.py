@@ -1,16 +1,28 @@
 import os
+import hmac
 import time
 import json
-from threading import Thread
+import hashlib
 from functools import wraps
+from timeit import default_timer
 
 import browserid
-import httplib2
 from flask import Flask, Blueprint, abort, g, render_template, request, \
-                  session, flash, redirect, escape
+                  session, flash, redirect, escape, make_response, url_for
+from werkzeug.security import safe_str_cmp
 from .csrf import enable_csrf, csrf_exempt
 
-from .project import Project, get_project_map
+from . import jobs, httpclient, github, events, timings, metrics, \
+              profiling
+
+from .project import Project, get_project, get_projects
+from .prober import readiness_prober
+
+# Seconds to wait after an SNS termination notification before cleaning up.
+CLEANUP_DELAY = 15
+
+# How many of the most recent boot timings to list individually.
+RECENT_TIMINGS = 20
 
 app = Flask(__name__)
 
@@ -32,10 +44,46 @@ def requires_login(f):
         return f(*args, **kwargs)
     return wrapper
 
+@app.before_request
+def start_request_timer():
+    g.request_started = default_timer()
+
+@app.after_request
+def record_request_time(response):
+    if request.endpoint and hasattr(g, 'request_started'):
+        metrics.observe('fleeting_request_seconds',
+                        default_timer() - g.request_started,
+                        endpoint=request.endpoint,
+                        method=request.method,
+                        status=response.status_code)
+    return response
+
+@app.before_request
+def start_profiling():
+    if profiling.should_profile(request.headers.get(profiling.HEADER),
+                                app.secret_key):
+        g.profile = profiling.RequestProfile().start()
+
+@app.after_request
+def record_profiled_status(response):
+    g.profile_status = response.status_code
+    return response
+
+# Unlike after_request handlers, this also runs when the view raised, so
+# the profiler is never left enabled.
+@app.teardown_request
+def finish_profiling(exc):
+    profile = getattr(g, 'profile', None)
+    if profile is not None:
+        g.profile = None
+        stem = profile.stop(request.endpoint, request.method, request.path,
+                            getattr(g, 'profile_status', 500))
+        app.logger.info('profiled %s %s to %s.' % (request.method,
+                                                   request.path, stem))
+
 @app.after_request
 def add_csp_headers(response):
-    policy = "default-src 'self' https://login.persona.org " \
-             "https://api.github.com"
+    policy = "default-src 'self' https://login.persona.org"
     response.headers['Content-Security-Policy'] = policy
     response.headers['X-Content-Security-Policy'] = policy
     return response
@@ -43,12 +91,12 @@ def add_csp_headers(response):
 project_bp = Blueprint('project', __name__, url_prefix='/<project>')
 instance_bp = Blueprint('instance', __name__,
                         url_prefix='/<project>/<instance>')
+api_bp = Blueprint('api', __name__, url_prefix='/api/v1/<project>')
 
 def pull_project(endpoint, values):
-    pname = values.pop('project', None)
-    if pname not in get_project_map():
+    g.project = get_project(values.pop('project', None))
+    if g.project is None:
         abort(404)
-    g.project = Project(pname)
 
 def pull_project_instance(endpoint, values):
     pull_project(endpoint, values)
@@ -59,6 +107,7 @@ def pull_project_instance(endpoint, values):
     g.project_instance = inst
 
 project_bp.url_value_preprocessor(pull_project)
+api_bp.url_value_preprocessor(pull_project)
 instance_bp.url_value_preprocessor(pull_project_instance)
 
 @project_bp.route('/create', methods=['POST'])
@@ -68,39 +117,105 @@ def create_instance():
     user = request.form['user']
     branch = request.form['branch']
     slug = "%s.%s-%s" % (user, branch, str(int(time.time())))
+    ready_callback = url_for('project.ready_callback',
+                             project=g.project.id,
+                             slug=slug,
+                             signature=get_ready_signature(g.project.id, slug),
+                             _external=True)
     app.logger.info('attempting to create instance %s/%s on behalf of '
                     '%s.' % (g.project.id, slug, session['email']))
-    result = g.project.create_instance(
+    job_id = jobs.enqueue('create_instance', g.project.id, dict(
         slug=slug,
         git_user=user,
         git_branch=branch,
         key_name=os.environ['AWS_KEY_NAME'],
         notify_topic=os.environ.get('AWS_NOTIFY_TOPIC'),
-        security_groups=[os.environ['AWS_SECURITY_GROUP']]
-    )
-    if result == 'INVALID_GIT_INFO':
-        flash('The git user and/or branch is invalid.', 'error')
-    elif result == 'DONE':
-        flash('The instance <strong>%s</strong> was created, and will '
-              'appear shortly.' % escape(slug), 'success')
-    else:
-        flash('An unknown error occurred. Sorry!', 'error')
-    return redirect('/%s/' % g.project.id)
+        security_groups=[os.environ['AWS_SECURITY_GROUP']],
+        ready_callback=ready_callback
+    ))
+    flash('The instance <strong>%s</strong> is being created, and will '
+          'appear shortly. You can <a href="jobs/%s">follow its '
+          'progress</a>.' % (escape(slug), job_id), 'success')
+    response = redirect('/%s/' % g.project.id)
+    response.headers['X-Job-Id'] = job_id
+    return response
+
+@project_bp.route('/jobs/<job_id>')
+def view_job(job_id):
+    job = jobs.get_job(job_id)
+    if job is None or job['project'] != g.project.id:
+        abort(404)
+    # Params may hold AWS settings, so only the slug is shown, for the
+    # jobs that have one.
+    job['slug'] = job.pop('params').get('slug')
+    return (json.dumps(job), 200, {
+        'Content-Type': 'application/json'
+    })
+
+def github_json(get_names, *args):
+    try:
+        names = get_names(*args)
+    except Exception, e:
+        app.logger.warn('fetching github data failed: %s' % e)
+        abort(502)
+    return (json.dumps(dict(names=names)), 200, {
+        'Content-Type': 'application/json'
+    })
+
+@project_bp.route('/github/forks')
+@requires_login
+def github_forks():
+    return github_json(github.get_forks, g.project.meta['repo'])
+
+@project_bp.route('/github/branches/<user>')
+@requires_login
+def github_branches(user):
+    return github_json(github.get_branches, user, g.project.meta['repo'])
 
 @instance_bp.route('/log')
 @requires_login
 def view_instance_log():
     return (g.project.get_instance_log(g.project_instance), 200, {
-        'Content-Type': 'text/plain'
+        'Content-Type': 'text/plain; charset=utf-8'
     })
 
 @instance_bp.route('/live-log')
 @requires_login
 def view_instance_authserver_log():
-    return (g.project.get_instance_authserver_log(g.project_instance), 200, {
-        'Content-Type': 'text/plain'
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        abort(400)
+    # Clients poll for more with the offset they've reached, rather than
+    # tying up the sync gunicorn worker with a long-lived stream.
+    content = g.project.get_instance_authserver_log(g.project_instance,
+                                                    offset)
+    return (content, 200, {
+        'Content-Type': 'text/plain',
+        'X-Log-Offset': str(offset + len(content))
     })
 
+def get_ready_signature(project_id, slug):
+    return hmac.new(str(app.secret_key), 'ready:%s:%s' % (project_id, slug),
+                    hashlib.sha1).hexdigest()
+
+@csrf_exempt
+@project_bp.route('/ready-callback', methods=['POST'])
+def ready_callback():
+    # Instances call this from their bootstrap script once their
+    # ready-url responds, using the signed url they were created with.
+    slug = request.args.get('slug', '')
+    if not safe_str_cmp(str(request.args.get('signature', '')),
+                        get_ready_signature(g.project.id, slug)):
+        abort(403)
+    inst = g.project.get_instance(slug)
+    if inst is None:
+        abort(404)
+    url = g.project.mark_ready(slug, inst)
+    app.logger.info('instance %s/%s reported itself ready.' % (g.project.id,
+                                                               slug))
+    return api_response(dict(slug=slug, url=url))
+
 @project_bp.route('/destroy', methods=['POST'])
 @requires_login
 def destroy_instance():
@@ -114,15 +229,83 @@ def destroy_instance():
           'info')
     return redirect('/%s/' % g.project.id)
 
-def render_project_template(name):
-    instances = g.project.get_instances()
+def track_configuring_instances(proj, instances):
     for inst in instances:
         if inst['state'] == 'running' and 'url' not in inst:
-            Thread(target=g.project.get_instance_status,
-                   kwargs={'slug': inst['slug']}).run()
-    return render_template(name,
-                           project=g.project,
-                           instances=instances)
+            readiness_prober.track(proj, inst['slug'],
+                                   callback=inst.get('ready_callback', False))
+
+def get_project_page_etag(name, version):
+    # Pages also depend on who is logged in and their CSRF token, and
+    # pending flash messages must not be swallowed by a 304.
+    if session.get('_flashes'):
+        return None
+    if version is None:
+        return None
+    return hashlib.sha1(json.dumps([
+        name,
+        version,
+        session.get('email'),
+        session.get('_csrf_token')
+    ])).hexdigest()[:16]
+
+def render_project_template(name):
+    instances_version = g.project.get_instances_version()
+    etag = get_project_page_etag(name, instances_version)
+    if etag is not None and request.if_none_match.contains(etag):
+        return ('', 304, {'ETag': '"%s"' % etag})
+    instances = g.project.get_instances()
+    track_configuring_instances(g.project, instances)
+    version = events.remember(g.project, events.get_rows(instances),
+                              instances_version)
+    response = make_response(render_template(name,
+                                             project=g.project,
+                                             instances=instances,
+                                             instances_version=version))
+    if etag is not None:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@project_bp.route('/events')
+def project_events():
+    # Each connection reports what changed since the version the client
+    # last saw and then closes; the browser reconnects after RETRY_MS.
+    # Holding the stream open would tie up a sync gunicorn worker, so
+    # reconnects from clients that are up to date are answered from the
+    # inventory version without listing instances.
+    version = (request.headers.get('Last-Event-ID') or
+               request.args.get('version', ''))
+    headers = {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache'
+    }
+    body = ['retry: %d\n\n' % events.RETRY_MS]
+    instances_version = g.project.get_instances_version()
+    if version and events.lookup_version(g.project,
+                                         instances_version) == version:
+        return (''.join(body), 200, headers)
+    instances = g.project.get_instances()
+    track_configuring_instances(g.project, instances)
+    rows = events.get_rows(instances)
+    current = events.get_version(rows)
+    events.remember(g.project, rows, instances_version)
+    if version != current:
+        old = events.recall(g.project, version)
+        if old is None:
+            body.append(events.format_event('reset', {}, current))
+        else:
+            changes = events.diff(old, rows)
+            for i, (name, row) in enumerate(changes):
+                data = dict(slug=row['slug'])
+                if name != 'remove':
+                    data['html'] = render_template('project-row.html',
+                                                   project=g.project,
+                                                   inst=row)
+                last = i == len(changes) - 1
+                body.append(events.format_event(name, data,
+                                                current if last else None))
+    return (''.join(body), 200, headers)
 
 @project_bp.route('/list')
 def project_list():
@@ -130,10 +313,79 @@ def project_list():
 
 @project_bp.route('/')
 def project_index():
+    if 'email' in session:
+        github.prefetch_forks(g.project.meta['repo'])
     return render_project_template('project.html')
 
+@project_bp.route('/timings')
+def project_timings():
+    records = g.project.get_timings()
+    return render_template('timings.html',
+                           project=g.project,
+                           summary=timings.summarize(records),
+                           records=records[::-1][:RECENT_TIMINGS])
+
+def api_response(obj):
+    return (json.dumps(obj), 200, {
+        'Content-Type': 'application/json'
+    })
+
+def get_api_fields():
+    if not request.args.get('fields'):
+        return events.API_FIELDS
+    fields = request.args['fields'].split(',')
+    if not set(fields).issubset(events.API_FIELDS):
+        abort(400)
+    if 'slug' not in fields:
+        fields.insert(0, 'slug')
+    return fields
+
+def select_fields(record, fields):
+    return dict((field, record[field]) for field in fields)
+
+def get_api_records():
+    return events.get_rows(g.project.get_instances(), events.API_FIELDS)
+
+def get_api_record(slug):
+    records = get_api_records()
+    if slug not in records:
+        abort(404)
+    return records[slug]
+
+@api_bp.route('/instances')
+def api_instances():
+    fields = get_api_fields()
+    records = get_api_records()
+    version = events.remember(g.project, records)
+    since = request.args.get('since')
+    old = events.recall(g.project, since) if since else None
+    if old is None:
+        return api_response(dict(version=version, instances=[
+            select_fields(records[slug], fields) for slug in sorted(records)
+        ]))
+    changes = events.diff(old, records)
+    return api_response(dict(
+        version=version,
+        since=since,
+        changed=[select_fields(record, fields)
+                 for name, record in changes if name != 'remove'],
+        removed=[record['slug'] for name, record in changes
+                 if name == 'remove']
+    ))
+
+@api_bp.route('/instances/<slug>')
+def api_instance(slug):
+    return api_response(select_fields(get_api_record(slug),
+                                      get_api_fields()))
+
+@api_bp.route('/instances/<slug>/ready')
+def api_instance_ready(slug):
+    return api_response(select_fields(get_api_record(slug),
+                                      ['slug', 'ready', 'url']))
+
 app.register_blueprint(project_bp)
 app.register_blueprint(instance_bp)
+app.register_blueprint(api_bp)
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -149,39 +401,30 @@ def logout():
         del session['email']
     return 'logged out'
 
-def delayed(func, seconds):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        app.logger.info('waiting %d seconds to execute %s' % (seconds,
-                                                              func.__name__))
-        time.sleep(seconds)
-        wrapper.wrapped(*args, **kwargs)
-    wrapper.wrapped = func
-    return wrapper
-
 @csrf_exempt
 @app.route('/update', methods=['POST'])
 def update():
     info = json.loads(request.data)
     if 'SubscribeURL' in info:
-        http = httplib2.Http(timeout=3,
-                             disable_ssl_certificate_validation=True)
-        res, content = http.request(info['SubscribeURL'])
+        res, content = httpclient.request(info['SubscribeURL'],
+                                          validate_certificates=False)
         app.logger.info('subscribed at %s.' % info['SubscribeURL'])
         return 'subscribed'
     msg = json.loads(info['Message'])
     if ('AutoScalingGroupName' in msg and
         msg.get('Event') == 'autoscaling:EC2_INSTANCE_TERMINATE'):
         groupname = msg['AutoScalingGroupName']
-        for name in get_project_map():
-            project = Project(name)
+        for project in get_projects():
             if groupname.startswith(project.autoscale_group_name_prefix):
-                app.logger.info('scheduling cleanup for %s' % name)
-                Thread(target=delayed(project.cleanup_instances, 15),
-                       kwargs=dict(logger=app.logger)).run()
+                app.logger.info('scheduling cleanup for %s' % project.id)
+                jobs.enqueue_later('cleanup_instances', project.id, {},
+                                   CLEANUP_DELAY)
     return 'updated'
 
+@app.route('/metrics')
+def view_metrics():
+    return (metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE})
+
 @app.route('/')
 def index():
-    projects = [Project(name) for name in get_project_map()]
-    return render_template('index.html', projects=projects)
+    return render_template('index.html', projects=get_projects())
@@ -0,0 +1,76 @@
+import json
+import hashlib
+
+from . import project
+
+ROW_FIELDS = ['slug', 'state', 'url', 'git_user', 'git_branch',
+              'git_branch_url']
+API_FIELDS = ['slug', 'state', 'ready', 'url', 'git_user', 'git_branch',
+              'git_branch_url', 'launch_time']
+STATE_TTL = 600
+RETRY_MS = 15000
+
+def get_rows(instances, fields=ROW_FIELDS):
+    rows = {}
+    for inst in instances:
+        info = dict(inst, ready='url' in inst)
+        rows[inst['slug']] = dict((field, info.get(field))
+                                  for field in fields)
+    return rows
+
+def get_version(rows):
+    return hashlib.sha1(json.dumps(rows, sort_keys=True)).hexdigest()[:16]
+
+def _get_state_key(proj, version):
+    return 'fleeting-events:%s:%s' % (proj.tag_name, version)
+
+def _get_alias_key(proj, instances_version):
+    return 'fleeting-events-alias:%s:%s' % (proj.tag_name, instances_version)
+
+def remember(proj, rows, instances_version=None):
+    version = get_version(rows)
+    project.cache.set(_get_state_key(proj, version), dict(
+        version=version,
+        rows=rows
+    ), ttl=STATE_TTL)
+    if instances_version is not None:
+        # Lets an unchanged client be answered from the cheap version
+        # alone, without building the rows again.
+        project.cache.set(_get_alias_key(proj, instances_version), dict(
+            instances_version=instances_version,
+            version=version
+        ), ttl=STATE_TTL)
+    return version
+
+def lookup_version(proj, instances_version):
+    if instances_version is None:
+        return None
+    for entry in project.cache.find(_get_alias_key(proj, instances_version)):
+        if entry['instances_version'] == instances_version:
+            return entry['version']
+    return None
+
+def recall(proj, version):
+    for entry in project.cache.find(_get_state_key(proj, version)):
+        if entry['version'] == version:
+            return entry['rows']
+    return None
+
+def diff(old, new):
+    changes = []
+    for slug in sorted(new):
+        if slug not in old:
+            changes.append(('add', new[slug]))
+        elif old[slug] != new[slug]:
+            changes.append(('change', new[slug]))
+    for slug in sorted(old):
+        if slug not in new:
+            changes.append(('remove', old[slug]))
+    return changes
+
+def format_event(name, data, id=None):
+    lines = ['event: %s' % name]
+    if id is not None:
+        lines.append('id: %s' % id)
+    lines.append('data: %s' % json.dumps(data))
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from threading import Lock, Thread
+from multiprocessing.pool import ThreadPool
+
+from . import project, httpclient
+
+API_ROOT = 'https://api.github.com'
+PER_PAGE = 100
+FRESH_TTL = 600
+RETENTION = 86400
+FETCH_CONCURRENCY = 4
+NAME_RE = re.compile(r'^[A-Za-z0-9_.-]+$')
+LAST_PAGE_RE = re.compile(r'[?&]page=(\d+)>; rel="last"')
+
+pool = None
+pool_lock = Lock()
+refreshing = set()
+refreshing_lock = Lock()
+
+class GithubError(Exception):
+    pass
+
+def get_pool():
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ThreadPool(FETCH_CONCURRENCY)
+    return pool
+
+def get_page(path, page):
+    headers = {'Accept': 'application/vnd.github.v3+json'}
+    if os.environ.get('GITHUB_TOKEN'):
+        headers['Authorization'] = 'token %s' % os.environ['GITHUB_TOKEN']
+    res, content = httpclient.request('%s%s?per_page=%d&page=%d' % (
+        API_ROOT, path, PER_PAGE, page
+    ), headers=headers)
+    if res.status == 404:
+        return res, []
+    if res.status != 200:
+        raise GithubError('%s returned status %d' % (path, res.status))
+    return res, json.loads(content)
+
+def get_all_pages(path):
+    # The first page's Link header says how many pages there are, so the
+    # rest can be fetched in parallel rather than by following each
+    # rel="next" in turn.
+    res, results = get_page(path, 1)
+    match = LAST_PAGE_RE.search(res.get('link') or '')
+    if match:
+        pages = range(2, int(match.group(1)) + 1)
+        for _, page in get_pool().map(lambda i: get_page(path, i), pages):
+            results.extend(page)
+    return results
+
+def _get_cache_key(path):
+    return 'fleeting-github:%s' % hashlib.sha1(path).hexdigest()
+
+def _get_cached(path):
+    for entry in project.cache.find(_get_cache_key(path)):
+        if entry['path'] == path:
+            return entry
+    return None
+
+def refresh(path, get_name):
+    names = [get_name(item) for item in get_all_pages(path)]
+    project.cache.set(_get_cache_key(path), dict(
+        path=path,
+        names=names,
+        fresh_until=time.time() + FRESH_TTL
+    ), ttl=RETENTION)
+    return names
+
+def _refresh_in_background(path, get_name):
+    try:
+        refresh(path, get_name)
+    except Exception:
+        logging.exception('refreshing github path %s failed' % path)
+    finally:
+        with refreshing_lock:
+            refreshing.discard(path)
+
+def schedule_refresh(path, get_name):
+    with refreshing_lock:
+        if path in refreshing:
+            return
+        refreshing.add(path)
+    # Refreshes get their own thread, since they wait on the page pool.
+    thread = Thread(target=_refresh_in_background, args=(path, get_name))
+    thread.daemon = True
+    thread.start()
+
+def get_names(path, get_name):
+    entry = _get_cached(path)
+    if entry is None:
+        return refresh(path, get_name)
+    if entry['fresh_until'] <= time.time():
+        schedule_refresh(path, get_name)
+    return entry['names']
+
+def prefetch_names(path, get_name):
+    entry = _get_cached(path)
+    if entry is None or entry['fresh_until'] <= time.time():
+        schedule_refresh(path, get_name)
+
+def get_forks_path(repo):
+    return '/repos/%s/forks' % repo
+
+def get_fork_owner(fork):
+    return fork['owner']['login']
+
+def get_branch_name(branch):
+    return branch['name']
+
+def get_forks(repo):
+    return get_names(get_forks_path(repo), get_fork_owner)
+
+def prefetch_forks(repo):
+    prefetch_names(get_forks_path(repo), get_fork_owner)
+
+def get_branches(user, repo):
+    if not NAME_RE.match(user):
+        return []
+    path = '/repos/%s/%s/branches' % (user, repo.split('/')[1])
+    return get_names(path, get_branch_name)
@@ -0,0 +1,108 @@
+import time
+from urlparse import urlparse
+from threading import Lock, BoundedSemaphore
+
+import httplib2
+
+from . import metrics
+
+DEFAULT_TIMEOUT = 3
+DEFAULT_MAX_PER_HOST = 4
+IDLE_TIMEOUT = 60
+
+class HostPool(object):
+    def __init__(self, max_connections):
+        self.semaphore = BoundedSemaphore(max_connections)
+        self.idle = []
+        self.users = 0
+
+def close_http(http):
+    for conn in http.connections.values():
+        conn.close()
+
+class HttpClient(object):
+    """
+    Thread-safe outbound HTTP client that keeps connections alive.
+
+    httplib2.Http objects hold on to their connections but aren't
+    thread-safe, so each host gets a pool of them. A caller checks one
+    out for the duration of a request. The number of concurrent requests
+    to each host is capped, and idle connections are closed after a
+    while. Certificates are validated unless a caller opts out.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT,
+                 max_per_host=DEFAULT_MAX_PER_HOST):
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+        self.lock = Lock()
+        self.pools = {}
+
+    def _checkout(self, pool, credentials, timeout, validate_certificates):
+        with self.lock:
+            http = pool.idle.pop()[1] if pool.idle else None
+        # Hits reuse a kept-alive connection, saving a handshake.
+        metrics.inc('fleeting_http_pool_checkouts_total',
+                    result='miss' if http is None else 'hit')
+        if http is not None:
+            return http
+        http = httplib2.Http(
+            timeout=timeout,
+            disable_ssl_certificate_validation=not validate_certificates
+        )
+        if credentials:
+            http.add_credentials(*credentials)
+        return http
+
+    def _prune(self, now):
+        for key, pool in self.pools.items():
+            while pool.idle and now - pool.idle[0][0] >= IDLE_TIMEOUT:
+                close_http(pool.idle.pop(0)[1])
+            if not pool.idle and not pool.users:
+                del self.pools[key]
+
+    def request(self, url, method='GET', headers=None, credentials=None,
+                timeout=None, body=None, validate_certificates=True):
+        if timeout is None:
+            timeout = self.timeout
+        key = (urlparse(url)[:2], credentials, timeout, validate_certificates)
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = self.pools[key] = HostPool(self.max_per_host)
+            pool.users += 1
+        started = time.time()
+        pool.semaphore.acquire()
+        http = None
+        outcome = 'error'
+        try:
+            http = self._checkout(pool, credentials, timeout,
+                                  validate_certificates)
+            kwargs = dict(method=method, headers=headers or {})
+            if body is not None:
+                kwargs['body'] = body
+            response = http.request(url, **kwargs)
+            outcome = 'ok'
+        except Exception:
+            if http is not None:
+                close_http(http)
+            http = None
+            raise
+        finally:
+            pool.semaphore.release()
+            with self.lock:
+                pool.users -= 1
+                now = time.time()
+                if http is not None:
+                    pool.idle.append((now, http))
+                self._prune(now)
+            metrics.inc('fleeting_http_requests_total', method=method,
+                        outcome=outcome)
+            metrics.observe('fleeting_http_request_seconds', now - started,
+                            method=method)
+        return response
+
+client = HttpClient()
+
+def request(url, **kwargs):
+    return client.request(url, **kwargs)
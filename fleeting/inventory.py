@@ -0,0 +1,71 @@
+import time
+import json
+
+TAG_PREFIX = 'fleeting:'
+LIVE_STATES = ['pending', 'running']
+SNAPSHOT_KEY = 'fleeting-inventory'
+DEFAULT_POLL_INTERVAL = 30
+
+# A snapshot is trusted for this many poll intervals; after that,
+# readers assume the poller has died and go back to asking EC2 directly.
+STALE_INTERVALS = 3
+
+def describe_instance(inst):
+    return dict(
+        id=inst.id,
+        state=inst.state,
+        launch_time=inst.launch_time,
+        public_dns_name=inst.public_dns_name,
+        tags=dict((name, value) for name, value in inst.tags.items()
+                  if name.startswith(TAG_PREFIX))
+    )
+
+def sweep(ec2, tag_names):
+    instances = dict((tag_name, []) for tag_name in tag_names)
+    if not tag_names:
+        return instances
+    reservations = ec2.get_all_instances(filters={
+        'tag-key': tag_names,
+        'instance-state-name': LIVE_STATES
+    })
+    for res in reservations:
+        for inst in res.instances:
+            info = describe_instance(inst)
+            for tag_name in tag_names:
+                if tag_name in info['tags']:
+                    instances[tag_name].append(info)
+    return instances
+
+def _load_snapshot(cache):
+    items = cache.find(SNAPSHOT_KEY)
+    if not items:
+        return None
+    item = items[0]
+    return dict(
+        version=int(item['version']),
+        timestamp=float(item['timestamp']),
+        expires=float(item['expires']),
+        instances=json.loads(item['instances'])
+    )
+
+def read_snapshot(cache):
+    snapshot = _load_snapshot(cache)
+    if snapshot is None or time.time() >= snapshot['expires']:
+        return None
+    return snapshot
+
+def publish_snapshot(cache, instances, interval=DEFAULT_POLL_INTERVAL):
+    now = time.time()
+    version = 1
+    previous = _load_snapshot(cache)
+    if previous:
+        version = previous['version']
+        if previous['instances'] != instances:
+            version += 1
+    cache[SNAPSHOT_KEY] = dict(
+        version=version,
+        timestamp=now,
+        expires=now + interval * STALE_INTERVALS,
+        instances=json.dumps(instances)
+    )
+    return version
@@ -0,0 +1,245 @@
+import json
+import time
+import logging
+from copy import deepcopy
+from uuid import uuid4
+from threading import Lock
+from Queue import Queue, Empty
+
+import redis
+
+from . import project
+from .utils import PeriodicTask
+
+JOB_TTL = 24 * 3600
+POP_TIMEOUT = 5
+DEFAULT_CONCURRENCY = 2
+SCHEDULER_INTERVAL = 1
+WARM_POOL_INTERVAL = 300
+
+class LocalJobQueue(object):
+    def __init__(self, ttl=JOB_TTL):
+        self.ttl = ttl
+        self.jobs = {}
+        self.queue = Queue()
+        self.lock = Lock()
+
+    def save(self, job):
+        now = time.time()
+        with self.lock:
+            for job_id in self.jobs.keys():
+                if now - self.jobs[job_id]['created'] >= self.ttl:
+                    del self.jobs[job_id]
+            self.jobs[job['id']] = deepcopy(job)
+
+    def get(self, job_id):
+        with self.lock:
+            return deepcopy(self.jobs.get(job_id))
+
+    def push(self, job):
+        self.save(job)
+        self.queue.put(job['id'])
+
+    def pop(self, timeout=POP_TIMEOUT):
+        try:
+            return self.get(self.queue.get(timeout=timeout))
+        except Empty:
+            return None
+
+class RedisJobQueue(object):
+    def __init__(self, url='redis://localhost:6379', ttl=JOB_TTL,
+                 prefix='fleeting-job'):
+        self.ttl = ttl
+        self.prefix = prefix
+        self.queue_key = '%s-queue' % prefix
+        self.redis = redis.from_url(url)
+
+    def _key(self, job_id):
+        return '%s:%s' % (self.prefix, job_id)
+
+    def save(self, job):
+        self.redis.set(self._key(job['id']), json.dumps(job), ex=self.ttl)
+
+    def get(self, job_id):
+        value = self.redis.get(self._key(job_id))
+        if value is not None:
+            return json.loads(value)
+
+    def push(self, job):
+        self.save(job)
+        self.redis.lpush(self.queue_key, job['id'])
+
+    def pop(self, timeout=POP_TIMEOUT):
+        item = self.redis.brpop(self.queue_key, timeout=timeout)
+        if item is not None:
+            return self.get(item[1])
+
+class LocalSchedule(object):
+    def __init__(self):
+        self.due = {}
+        self.lock = Lock()
+
+    def add(self, member, when):
+        with self.lock:
+            if member not in self.due or when > self.due[member]:
+                self.due[member] = when
+
+    def pop_due(self, now):
+        with self.lock:
+            members = [member for member, when in self.due.items()
+                       if when <= now]
+            for member in members:
+                del self.due[member]
+        return members
+
+class RedisSchedule(object):
+    def __init__(self, url='redis://localhost:6379',
+                 key='fleeting-schedule'):
+        self.key = key
+        self.redis = redis.from_url(url)
+
+    def add(self, member, when):
+        current = self.redis.zscore(self.key, member)
+        if current is None or when > current:
+            self.redis.zadd(self.key, member, when)
+
+    def pop_due(self, now):
+        # Only the process whose ZREM succeeds gets to run a member.
+        return [member for member
+                in self.redis.zrangebyscore(self.key, '-inf', now)
+                if self.redis.zrem(self.key, member)]
+
+def _get_project(job):
+    proj = project.get_project(job['project'])
+    if proj is None:
+        raise ValueError('project %s does not exist' % job['project'])
+    return proj
+
+def get_warm_pool_params(params):
+    return dict(
+        key_name=params['key_name'],
+        security_groups=params['security_groups'],
+        notify_topic=params.get('notify_topic')
+    )
+
+def create_instance(job, on_step, logger=logging):
+    proj = _get_project(job)
+    result = proj.create_instance(on_step=on_step, **job['params'])
+    if proj.warm_pool_size:
+        enqueue_later('fill_warm_pool', proj.id,
+                      get_warm_pool_params(job['params']), 0)
+    return result
+
+def cleanup_instances(job, on_step, logger=logging):
+    return _get_project(job).cleanup_instances(logger=logger)
+
+def fill_warm_pool(job, on_step, logger=logging):
+    return _get_project(job).fill_warm_pool(logger=logger, **job['params'])
+
+HANDLERS = {
+    'create_instance': create_instance,
+    'cleanup_instances': cleanup_instances,
+    'fill_warm_pool': fill_warm_pool
+}
+
+job_queue = LocalJobQueue()
+workers = []
+workers_lock = Lock()
+schedule = LocalSchedule()
+scheduler = None
+
+def new_job(kind, project_id, params):
+    return dict(
+        id=uuid4().hex,
+        kind=kind,
+        project=project_id,
+        params=params,
+        state='queued',
+        steps=[],
+        result=None,
+        error=None,
+        created=time.time(),
+        finished=None
+    )
+
+def _finish_step(job, status, now):
+    if job['steps'] and job['steps'][-1]['status'] == 'running':
+        step = job['steps'][-1]
+        step['status'] = status
+        step['finished'] = now
+        step['duration'] = now - step['started']
+
+def run_job(job, queue, logger=logging):
+    def on_step(name):
+        now = time.time()
+        _finish_step(job, 'done', now)
+        job['steps'].append(dict(name=name, status='running', started=now))
+        queue.save(job)
+
+    job['state'] = 'running'
+    queue.save(job)
+    try:
+        job['result'] = HANDLERS[job['kind']](job, on_step, logger)
+        job['state'] = 'done'
+    except Exception, e:
+        logger.exception('job %s (%s) failed' % (job['id'], job['kind']))
+        job['state'] = 'failed'
+        job['error'] = str(e)
+    job['finished'] = time.time()
+    _finish_step(job, 'done' if job['state'] == 'done' else 'failed',
+                 job['finished'])
+    queue.save(job)
+    return job
+
+def work(logger=logging):
+    job = job_queue.pop()
+    if job is not None:
+        run_job(job, job_queue, logger)
+
+def start_workers(concurrency=DEFAULT_CONCURRENCY, logger=logging):
+    with workers_lock:
+        while len(workers) < concurrency:
+            workers.append(PeriodicTask(work, 0, kwargs=dict(logger=logger),
+                                        logger=logger).start())
+
+def enqueue(kind, project_id, params):
+    job = new_job(kind, project_id, params)
+    job_queue.push(job)
+    if not workers:
+        start_workers()
+    return job['id']
+
+def get_job(job_id):
+    return job_queue.get(job_id)
+
+def enqueue_due_jobs(now=None):
+    members = schedule.pop_due(now or time.time())
+    for member in members:
+        kind, project_id, params = json.loads(member)
+        enqueue(kind, project_id, params)
+    return len(members)
+
+def start_scheduler(logger=logging):
+    global scheduler
+    with workers_lock:
+        if scheduler is None:
+            scheduler = PeriodicTask(enqueue_due_jobs, SCHEDULER_INTERVAL,
+                                     logger=logger).start()
+
+def enqueue_later(kind, project_id, params, delay):
+    """
+    Enqueue a job after the given number of seconds. Jobs with the same
+    kind, project and params that are already waiting are coalesced into
+    the latest one, so each request waits at least the full delay.
+    """
+
+    member = json.dumps([kind, project_id, params], sort_keys=True)
+    schedule.add(member, time.time() + delay)
+    if scheduler is None:
+        start_scheduler()
+
+def schedule_warm_pool_fills(**params):
+    for proj in project.get_projects():
+        if proj.warm_pool_size:
+            enqueue_later('fill_warm_pool', proj.id,
+                          get_warm_pool_params(params), 0)
@@ -0,0 +1,190 @@
+import re
+import time
+from threading import Lock
+
+import redis
+
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+FLUSH_INTERVAL = 5
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+LE_RE = re.compile(r',?le="([^"]+)"')
+
+DESCRIPTIONS = dict(
+    fleeting_aws_calls_total=(
+        'counter', 'Requests made to the EC2 and AutoScaling APIs.'
+    ),
+    fleeting_aws_call_seconds=(
+        'histogram', 'Time taken by EC2 and AutoScaling API requests.'
+    ),
+    fleeting_http_requests_total=(
+        'counter', 'Outbound HTTP requests, such as readiness probes.'
+    ),
+    fleeting_http_request_seconds=(
+        'histogram', 'Time taken by outbound HTTP requests.'
+    ),
+    fleeting_http_pool_checkouts_total=(
+        'counter', 'Outbound HTTP connections checked out, by whether an '
+                   'idle one was reused.'
+    ),
+    fleeting_cache_lookups_total=(
+        'counter', 'Cache lookups by key namespace and whether they hit.'
+    ),
+    fleeting_request_seconds=(
+        'histogram', 'Time taken to handle requests, by endpoint.'
+    )
+)
+
+def _escape(value):
+    return (unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+def _sample(name, labels):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join(
+        '%s="%s"' % (key, _escape(value))
+        for key, value in sorted(labels.items())
+    ))
+
+class LocalMetrics(object):
+    """
+    In-process counters and histograms.
+
+    Samples are kept as a flat mapping from their exposition-format name,
+    labels included, to their value. Histograms are stored as the
+    cumulative buckets, sum and count Prometheus expects.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.samples = {}
+
+    def _add(self, increments):
+        with self.lock:
+            for sample, amount in increments:
+                self.samples[sample] = self.samples.get(sample, 0) + amount
+
+    def inc(self, name, amount=1, **labels):
+        self._add([(_sample(name, labels), amount)])
+
+    def observe(self, name, seconds, **labels):
+        increments = [(_sample(name + '_sum', labels), seconds),
+                      (_sample(name + '_count', labels), 1)]
+        for bound in BUCKETS + ['+Inf']:
+            if bound == '+Inf' or seconds <= bound:
+                increments.append((_sample(name + '_bucket', dict(
+                    labels, le=bound
+                )), 1))
+        self._add(increments)
+
+    def drain(self):
+        with self.lock:
+            samples, self.samples = self.samples, {}
+        return samples
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.samples)
+
+class RedisMetrics(LocalMetrics):
+    """
+    Metrics shared by every process through a redis hash.
+
+    Each process buffers its samples and adds them to the hash in one
+    round trip per flush, so /metrics reports the same totals no matter
+    which worker serves it.
+    """
+
+    def __init__(self, url='redis://localhost:6379', key='fleeting-metrics'):
+        LocalMetrics.__init__(self)
+        self.key = key
+        self.redis = redis.from_url(url)
+
+    def flush(self):
+        samples = self.drain()
+        if samples:
+            pipe = self.redis.pipeline(transaction=False)
+            for sample, amount in samples.items():
+                pipe.hincrbyfloat(self.key, sample, amount)
+            pipe.execute()
+
+    def snapshot(self):
+        self.flush()
+        return dict((sample, float(value)) for sample, value
+                    in self.redis.hgetall(self.key).items())
+
+store = LocalMetrics()
+
+def inc(name, amount=1, **labels):
+    store.inc(name, amount, **labels)
+
+def observe(name, seconds, **labels):
+    store.observe(name, seconds, **labels)
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+def _sort_key(sample):
+    # Buckets are listed in increasing order of their upper bound.
+    match = LE_RE.search(sample)
+    if match is None:
+        return (sample, 0)
+    return (LE_RE.sub('', sample), float(match.group(1)))
+
+def _get_family(sample):
+    name = sample.split('{')[0]
+    for suffix in ['_bucket', '_sum', '_count']:
+        if name.endswith(suffix) and name[:-len(suffix)] in DESCRIPTIONS:
+            return name[:-len(suffix)]
+    return name
+
+def render(samples=None):
+    if samples is None:
+        samples = store.snapshot()
+    families = {}
+    for sample, value in samples.items():
+        families.setdefault(_get_family(sample), []).append((sample, value))
+    lines = []
+    for family in sorted(families):
+        if family in DESCRIPTIONS:
+            kind, description = DESCRIPTIONS[family]
+            lines.append('# HELP %s %s' % (family, description))
+            lines.append('# TYPE %s %s' % (family, kind))
+        for sample, value in sorted(families[family],
+                                    key=lambda item: _sort_key(item[0])):
+            lines.append('%s %s' % (sample, _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+def instrument_connection(conn, service):
+    """
+    Counts and times every request a boto connection makes, by API action,
+    and returns the connection.
+
+    This is done in make_request rather than around the connection's
+    methods because the groups, instances and launch configurations boto
+    returns make their own calls, like delete(), through the connection.
+    """
+
+    make_request = conn.make_request
+
+    def instrumented_make_request(action, *args, **kwargs):
+        start = time.time()
+        outcome = 'error'
+        try:
+            response = make_request(action, *args, **kwargs)
+            # boto caches the body, so reading it here times the download
+            # without getting in the way of the caller reading it again.
+            response.read()
+            if response.status < 400:
+                outcome = 'ok'
+            return response
+        finally:
+            inc('fleeting_aws_calls_total', service=service, action=action,
+                outcome=outcome)
+            observe('fleeting_aws_call_seconds', time.time() - start,
+                    service=service, action=action)
+
+    conn.make_request = instrumented_make_request
+    return conn
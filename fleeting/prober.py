@@ -0,0 +1,131 @@
+import json
+import time
+import logging
+from threading import Lock
+from multiprocessing.pool import ThreadPool
+
+from . import project, inventory
+from .utils import PeriodicTask
+
+DEFAULT_CONCURRENCY = 8
+TICK_INTERVAL = 1
+MIN_DELAY = 5
+MAX_DELAY = 120
+MAX_TRACKING_TIME = 2 * 3600
+
+class ReadinessProber(object):
+    """
+    Probes the ready-url of configuring instances in the background.
+
+    Instances are tracked either when a page notices them or when they
+    show up in the inventory snapshot without a ready tag. Each one is
+    re-probed with exponential backoff until it becomes ready, disappears,
+    or has been tracked for too long. Ready results are published to the
+    cache right away, while the corresponding ready tags are written to
+    EC2 together at the end of each round.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, logger=logging):
+        self.concurrency = concurrency
+        self.logger = logger
+        self.lock = Lock()
+        self.tracked = {}
+        self.ready_tags = {}
+        self.snapshot_version = None
+        self.pool = None
+        self.task = None
+
+    def start(self):
+        with self.lock:
+            if self.task is None:
+                self.pool = ThreadPool(self.concurrency)
+                self.task = PeriodicTask(self.tick, TICK_INTERVAL,
+                                         logger=self.logger).start()
+
+    def track(self, proj, slug, callback=False):
+        now = time.time()
+        # Instances that report their own readiness are only probed
+        # occasionally, in case the report never arrives.
+        delay = MAX_DELAY if callback else MIN_DELAY
+        with self.lock:
+            if (proj.id, slug) not in self.tracked:
+                self.tracked[(proj.id, slug)] = dict(
+                    project=proj,
+                    slug=slug,
+                    since=now,
+                    next_probe=now + delay if callback else now,
+                    delay=delay
+                )
+        self.start()
+
+    def discover(self):
+        snapshot = inventory.read_snapshot(project.cache)
+        if not snapshot or snapshot['version'] == self.snapshot_version:
+            return
+        self.snapshot_version = snapshot['version']
+        for proj in project.get_projects():
+            for desc in snapshot['instances'].get(proj.tag_name, []):
+                if (desc['state'] == 'running' and
+                    proj.ready_tag_name not in desc['tags']):
+                    info = json.loads(desc['tags'][proj.tag_name])
+                    if not info.get('warm'):
+                        self.track(proj, info['slug'],
+                                   callback=info.get('ready_callback', False))
+
+    def probe(self, entry):
+        proj = entry['project']
+        try:
+            inst = proj.get_instance(entry['slug'])
+            if inst is None:
+                return 'NOT_FOUND'
+            if proj.ready_tag_name in inst.tags:
+                proj.set_ready_url(entry['slug'],
+                                   inst.tags[proj.ready_tag_name])
+                return 'READY'
+            state, info = proj.check_ready_url(inst)
+            if state == 'READY':
+                proj.set_ready_url(entry['slug'], info)
+                proj.record_timings(inst)
+                with self.lock:
+                    self.ready_tags[inst.id] = (proj.ready_tag_name, info)
+            return state
+        except Exception:
+            self.logger.exception('probing %s/%s failed' % (proj.id,
+                                                            entry['slug']))
+            return 'ERROR'
+
+    def flush_ready_tags(self):
+        with self.lock:
+            ready_tags, self.ready_tags = self.ready_tags, {}
+        if not ready_tags:
+            return
+        # EC2 applies one set of tags to every resource in a CreateTags
+        # call, and each ready url is unique to its instance.
+        ec2 = project.connect_ec2()
+        for instance_id, (tag_name, url) in ready_tags.items():
+            try:
+                ec2.create_tags([instance_id], {tag_name: url})
+            except Exception:
+                self.logger.exception('tagging %s failed' % instance_id)
+
+    def tick(self):
+        self.discover()
+        now = time.time()
+        with self.lock:
+            due = [entry for entry in self.tracked.values()
+                   if entry['next_probe'] <= now]
+        if due:
+            states = self.pool.map(self.probe, due)
+            now = time.time()
+            with self.lock:
+                for entry, state in zip(due, states):
+                    key = (entry['project'].id, entry['slug'])
+                    if (state in ['READY', 'NOT_FOUND'] or
+                        now - entry['since'] > MAX_TRACKING_TIME):
+                        del self.tracked[key]
+                    else:
+                        entry['delay'] = min(entry['delay'] * 2, MAX_DELAY)
+                        entry['next_probe'] = now + entry['delay']
+        self.flush_ready_tags()
+
+readiness_prober = ReadinessProber()
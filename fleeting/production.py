@@ -1,6 +1,7 @@
 import os
 
-from . import app, utils, project, tempcache
+from . import app, utils, project, tempcache, inventory, prober, jobs, \
+              httpclient, metrics, profiling
 
 REQUIRED_KEYS = [
     'SECRET_KEY',
@@ -36,6 +37,39 @@ def init():
             project.DEFAULT_CACHE_TTL,
             url=redis_url
         )
+        jobs.job_queue = jobs.RedisJobQueue(url=redis_url)
+        jobs.schedule = jobs.RedisSchedule(url=redis_url)
+        metrics.store = metrics.RedisMetrics(url=redis_url)
+        utils.PeriodicTask(metrics.store.flush, metrics.FLUSH_INTERVAL,
+                           logger=app.logger).start()
+    httpclient.client = httpclient.HttpClient(
+        max_per_host=int(os.environ.get('HTTP_MAX_PER_HOST',
+                                        httpclient.DEFAULT_MAX_PER_HOST))
+    )
+    jobs.start_workers(
+        concurrency=int(os.environ.get('JOB_WORKERS',
+                                       jobs.DEFAULT_CONCURRENCY)),
+        logger=app.logger
+    )
+    jobs.start_scheduler(logger=app.logger)
+    interval = int(os.environ.get('INVENTORY_POLL_INTERVAL',
+                                  inventory.DEFAULT_POLL_INTERVAL))
+    utils.PeriodicTask(project.sweep_inventory, interval,
+                       kwargs=dict(interval=interval),
+                       logger=app.logger).start()
+    utils.PeriodicTask(jobs.schedule_warm_pool_fills,
+                       jobs.WARM_POOL_INTERVAL,
+                       kwargs=dict(
+                           key_name=os.environ['AWS_KEY_NAME'],
+                           security_groups=[os.environ['AWS_SECURITY_GROUP']],
+                           notify_topic=os.environ.get('AWS_NOTIFY_TOPIC')
+                       ),
+                       logger=app.logger).start()
+    project.claim_key = os.environ['SECRET_KEY']
+    profiling.directory = os.environ.get('PROFILE_DIR')
+    profiling.sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    prober.readiness_prober.logger = app.logger
+    prober.readiness_prober.start()
     utils.force_preferred_url_scheme(
         app,
         originating_scheme_header=os.environ.get('ORIGINATING_SCHEME_HEADER')
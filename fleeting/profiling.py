@@ -0,0 +1,142 @@
+import os
+import re
+import gc
+import hmac
+import json
+import time
+import random
+import pstats
+import hashlib
+import cProfile
+import resource
+from collections import Counter
+
+from werkzeug.security import safe_str_cmp
+
+HEADER = 'X-Fleeting-Profile'
+HEADER_LIFETIME = 3600
+TOP_TYPES = 10
+UNSAFE_CHARS_RE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+# Where dumps are written; profiling is off while this is None.
+directory = None
+# Fraction of requests to profile without being asked to.
+sample_rate = 0.0
+
+def _sign(secret, expiry):
+    return hmac.new(str(secret), 'profile:%d' % expiry,
+                    hashlib.sha1).hexdigest()
+
+def make_header_value(secret, now=None):
+    expiry = int((now or time.time()) + HEADER_LIFETIME)
+    return '%d:%s' % (expiry, _sign(secret, expiry))
+
+def is_authorized(value, secret, now=None):
+    try:
+        expiry, signature = value.split(':', 1)
+        expiry = int(expiry)
+    except (AttributeError, ValueError):
+        return False
+    if expiry < (now or time.time()):
+        return False
+    return safe_str_cmp(str(signature), _sign(secret, expiry))
+
+def should_profile(header_value, secret):
+    if directory is None:
+        return False
+    if header_value is not None:
+        return is_authorized(header_value, secret)
+    return random.random() < sample_rate
+
+def count_types():
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+class RequestProfile(object):
+    """
+    Profiles a single request with cProfile.
+
+    Python 2 has no tracemalloc, so memory is approximated by the growth
+    in peak RSS and in the number of live objects of each type. CPU time
+    is for the whole process, so it includes other threads' work.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.types = count_types()
+        self.maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.cpu = get_cpu_time()
+        self.started = time.time()
+        self.profile.enable()
+        return self
+
+    def stop(self, endpoint, method, path, status):
+        self.profile.disable()
+        wall = time.time() - self.started
+        cpu = get_cpu_time() - self.cpu
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        growth = count_types()
+        growth.subtract(self.types)
+        stem = os.path.join(directory, '%s-%s-%dms' % (
+            time.strftime('%Y%m%d%H%M%S', time.gmtime(self.started)),
+            UNSAFE_CHARS_RE.sub('_', endpoint or 'unknown'),
+            wall * 1000
+        ))
+        self.profile.dump_stats(stem + '.prof')
+        with open(stem + '.json', 'w') as f:
+            json.dump(dict(
+                endpoint=endpoint,
+                method=method,
+                path=path,
+                status=status,
+                started=self.started,
+                wall_ms=int(wall * 1000),
+                cpu_ms=int(cpu * 1000),
+                maxrss_growth_kb=maxrss - self.maxrss,
+                object_growth=[[name, count] for name, count
+                               in growth.most_common(TOP_TYPES)
+                               if count > 0]
+            ), f)
+        return stem
+
+def load_dumps(path, endpoint=None):
+    dumps = []
+    for filename in sorted(os.listdir(path)):
+        if not filename.endswith('.json'):
+            continue
+        stem = os.path.join(path, filename[:-len('.json')])
+        with open(stem + '.json') as f:
+            info = json.load(f)
+        if endpoint is None or info['endpoint'] == endpoint:
+            info['profile'] = stem + '.prof'
+            dumps.append(info)
+    return dumps
+
+def summarize(dumps):
+    endpoints = {}
+    for info in dumps:
+        endpoints.setdefault(info['endpoint'], []).append(info)
+    summary = []
+    for endpoint, infos in sorted(endpoints.items()):
+        walls = sorted(info['wall_ms'] for info in infos)
+        summary.append(dict(
+            endpoint=endpoint,
+            count=len(infos),
+            median_wall_ms=walls[(len(walls) - 1) // 2],
+            max_wall_ms=walls[-1],
+            max_cpu_ms=max(info['cpu_ms'] for info in infos),
+            max_maxrss_growth_kb=max(info['maxrss_growth_kb']
+                                     for info in infos)
+        ))
+    return summary
+
+def merge_stats(dumps, stream=None):
+    stats = pstats.Stats(dumps[0]['profile'], stream=stream)
+    for info in dumps[1:]:
+        stats.add(info['profile'])
+    return stats
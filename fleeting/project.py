@@ -1,65 +1,197 @@
 import os
 import re
 import json
+import time
+import hmac
+import hashlib
+import calendar
 import datetime
 import logging
+from threading import Lock
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import boto
 from boto.ec2.autoscale import LaunchConfiguration
 from boto.ec2.autoscale import AutoScalingGroup
 from boto.ec2.autoscale import AutoScaleConnection
-import httplib2
 from jinja2 import Template
 
+from . import inventory, httpclient, timings, metrics
 from .utils import path
 from .tempcache import DictTempCache
 
 AUTHSERVER_PORT = 9312
 AUTHSERVER_CREDS = "fleeting:fleeting"
 AUTHSERVER_LOGFILE = "log.txt"
+CLAIM_HEADER = "X-Fleeting-Claim"
+BAKE_STATUS_FILE = "baked"
 BOOTSTRAP_TEMPLATE = open(path('templates', 'bootstrap.sh')).read()
+COMPILED_BOOTSTRAP_TEMPLATE = Template(BOOTSTRAP_TEMPLATE)
+TEMPLATE_CONTEXT = dict(
+    AUTHSERVER_PORT=AUTHSERVER_PORT,
+    AUTHSERVER_CREDS=AUTHSERVER_CREDS,
+    AUTHSERVER_LOGFILE=AUTHSERVER_LOGFILE,
+    CLAIM_HEADER=CLAIM_HEADER,
+    BAKE_STATUS_FILE=BAKE_STATUS_FILE,
+    PHASES_FILE=timings.PHASES_FILE
+)
+MAX_CACHED_USER_DATA = 64
+READY_CALLBACK_PLACEHOLDER = '# fleeting-ready-callback'
 
 DEFAULT_LIFETIME = datetime.timedelta(hours=24)
 DEFAULT_CACHE_TTL = 3600
+AUTOSCALE_NAMES_PER_CALL = 50
+CLEANUP_CONCURRENCY = 4
+VALID_URL_TTL = 600
+MISSING_URL_TTL = 60
+URL_CHECK_RETENTION = 86400
+CONSOLE_UPDATE_INTERVAL = 300
+CONSOLE_RECHECK_INTERVAL = 60
+CONSOLE_LOCK_STRIPES = 16
+WARM_POOL_LIFETIME = datetime.timedelta(hours=24)
+BRANCH_STEPS_MARKER = re.compile(r'^#\s*fleeting-branch-steps[ \t]*$',
+                                 re.MULTILINE)
+WARM_WAIT_SCRIPT = '''
+# Wait for fleeting to claim this warm instance for a branch.
+while [ ! -f "$FLEETING_OUTPUT_DIR/branch-steps" ]; do sleep 2; done
+. "$FLEETING_OUTPUT_DIR/branch-steps"
+'''
+READY_POLL_INTERVAL = 5
+READY_CALLBACK_TEMPLATE = Template('''
+# Tells fleeting as soon as the project responds, rather than waiting
+# for the instance to be probed.
+(
+  until [ "`curl -s -o /dev/null -w '%{http_code}' '{{READY_URL}}'`" = 200 ]
+  do
+    sleep {{READY_POLL_INTERVAL}}
+  done
+  for attempt in 1 2 3 4 5; do
+    curl -s -f -X POST '{{READY_CALLBACK_URL}}' && break
+    sleep {{READY_POLL_INTERVAL}}
+  done
+) > /dev/null 2>&1 &
+''')
+BAKE_TIMEOUT = 3600
+BAKE_POLL_INTERVAL = 15
+BAKED_IMAGE_TTL = 600
+INDEX_TOMBSTONE_TTL = inventory.DEFAULT_POLL_INTERVAL
 
 cache = DictTempCache(DEFAULT_CACHE_TTL)
+# Signs the secrets warm instances must be claimed with.
+claim_key = None
+_console_locks = [Lock() for i in range(CONSOLE_LOCK_STRIPES)]
 _ec2_conn = None
 _ec2_autoscale_conn = None
 
 def connect_ec2():
     global _ec2_conn
     if not _ec2_conn:
-        _ec2_conn = boto.connect_ec2()
+        _ec2_conn = metrics.instrument_connection(boto.connect_ec2(),
+                                                  'ec2')
     return _ec2_conn
 
 def connect_ec2_autoscale():
     global _ec2_autoscale_conn
     if not _ec2_autoscale_conn:
-        _ec2_autoscale_conn = AutoScaleConnection()
+        _ec2_autoscale_conn = metrics.instrument_connection(
+            AutoScaleConnection(),
+            'autoscaling'
+        )
     return _ec2_autoscale_conn
 
+def _get_snapshot_version():
+    snapshot = inventory.read_snapshot(cache)
+    if snapshot:
+        return snapshot['version']
+
+def get_all_autoscale_pages(method, names):
+    results = []
+    calls = 0
+    for i in range(0, len(names), AUTOSCALE_NAMES_PER_CALL):
+        kwargs = dict(names=names[i:i + AUTOSCALE_NAMES_PER_CALL])
+        while True:
+            page = method(**kwargs)
+            calls += 1
+            results.extend(page)
+            kwargs['next_token'] = getattr(page, 'next_token', None)
+            if not kwargs['next_token']:
+                break
+    return results, calls
+
+def _get_url_check(url):
+    # URLs built from form input may be unicode.
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    key = 'fleeting-urlcheck:%s' % digest
+    for entry in cache.find(key):
+        if entry['url'] == url:
+            return key, entry
+    return key, None
+
 def does_url_404(url):
-    http = httplib2.Http(timeout=3,
-                         disable_ssl_certificate_validation=True)
-    res, content = http.request(url, method='HEAD')
-    if res.status == 404:
-        return True
-    return False
+    # Results are shared through the cache. Once an entry goes stale it's
+    # revalidated with If-None-Match, so an unchanged page costs GitHub
+    # a 304 rather than a full response.
+    key, entry = _get_url_check(url)
+    now = time.time()
+    if entry and entry['fresh_until'] > now:
+        return entry['missing']
+    headers = {}
+    if entry and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    res, content = httpclient.request(url, method='HEAD', headers=headers,
+                                      validate_certificates=False)
+    if res.status == 304 and entry:
+        missing = entry['missing']
+    elif res.status == 404 or res.status < 400:
+        missing = res.status == 404
+    else:
+        return False
+    cache.set(key, dict(
+        url=url,
+        missing=missing,
+        etag=res.get('etag') or (entry and entry['etag']),
+        fresh_until=now + (MISSING_URL_TTL if missing else VALID_URL_TTL)
+    ), ttl=URL_CHECK_RETENTION)
+    return missing
+
+def parse_ec2_timestamp(value):
+    try:
+        return calendar.timegm(time.strptime(value.split('.')[0],
+                                             '%Y-%m-%dT%H:%M:%S'))
+    except Exception:
+        return None
+
+def _get_console_output(instance_id):
+    for entry in cache.find('fleeting-console:%s' % instance_id):
+        if entry['id'] == instance_id and entry['fresh_until'] > time.time():
+            return entry['output']
+    return None
 
 class Project(object):
-    def __init__(self, project_id):
-        pmap = get_project_map()
+    def __init__(self, project_id, script_path=None):
+        if script_path is None:
+            script_path = get_project_map()[project_id]
         self.id = project_id
-        self.script_path = pmap[project_id]
+        self.script_path = script_path
         self.script_template = open(self.script_path, 'r').read()
+        self.compiled_script_template = Template(self.script_template)
+        self._user_data = OrderedDict()
+        self._user_data_lock = Lock()
         self.meta = {}
         self.tag_name = 'fleeting:%s' % project_id
         self.ready_tag_name = '%s:ready' % self.tag_name
+        self.bake_tag_name = '%s:bake' % self.tag_name
         self.autoscale_group_name_prefix = 'fleeting_autoscale_%s' % self.id
         for line in self.script_template.splitlines():
             match = re.search(r'fleeting-meta:([a-z0-9\-]+)\s*=(.*)', line)
             if match:
                 self.meta[match.group(1)] = match.group(2).strip()
+        self.warm_pool_size = 0
+        self.bakeable = False
+        if BRANCH_STEPS_MARKER.search(self.script_template):
+            self.warm_pool_size = int(self.meta.get('warm-pool', 0))
+            self.bakeable = self.meta.get('bake') == 'yes'
 
     def _set_cache_entry(self, slug, value):
         cache['%s:%s' % (self.tag_name, slug)] = value
@@ -70,6 +202,14 @@ class Project(object):
     def _get_autoscale_group_name(self, slug):
         return '%s_%s' % (self.autoscale_group_name_prefix, slug)
 
+    def _get_group_slug(self, slug):
+        # Claimed warm instances stay in the group they were launched in.
+        entry = self._lookup_index_entry(slug)
+        if entry is None:
+            self._rebuild_instance_index()
+            entry = self._lookup_index_entry(slug)
+        return (entry or {}).get('group') or slug
+
     def _get_instance_ready_url(self, hostname):
         return self.meta['ready-url'].replace('localhost', hostname)
 
@@ -82,117 +222,353 @@ class Project(object):
 
     def cleanup_instances(self, logger=logging):
         logger.info('cleaning up project %s' % self.id)
-        s = {'deleted': 0, 'errors': 0}
+        s = {'deleted': 0, 'errors': 0, 'api_calls': 1}
+        started = time.time()
         ec2 = connect_ec2()
         conn = connect_ec2_autoscale()
         reservations = ec2.get_all_instances(filters={
             'tag-key': self.tag_name,
             'instance-state-name': ['terminated']
         })
+        infos = [json.loads(res.instances[0].tags[self.tag_name])
+                 for res in reservations]
+        slugs = sorted(set(info.get('group', info['slug']) for info in infos))
+
+        groups, calls = get_all_autoscale_pages(
+            conn.get_all_groups,
+            [self._get_autoscale_group_name(slug) for slug in slugs]
+        )
+        s['api_calls'] += calls
+        launch_configs, calls = get_all_autoscale_pages(
+            conn.get_all_launch_configurations,
+            [self._get_launch_config_name(slug) for slug in slugs]
+        )
+        s['api_calls'] += calls
+        s['lookup_time'] = time.time() - started
 
         def try_deleting(obj):
             try:
                 obj.delete()
-                s['deleted'] += 1
+                return True
             except Exception, e:
-                s['errors'] += 1
+                return False
 
-        for res in reservations:
-            slug = json.loads(res.instances[0].tags[self.tag_name])['slug']
-            ag_name = self._get_autoscale_group_name(slug)
-            ag = conn.get_all_groups(names=[ag_name])
-            if ag and ag[0].min_size == 0 and not ag[0].instances:
-                try_deleting(ag[0])
-            lc_name = self._get_launch_config_name(slug)
-            lc = conn.get_all_launch_configurations(names=[lc_name])
-            if lc:
-                try_deleting(lc[0])
-        logger.info('%d deleted, %d errors in %s' % (
-            s['deleted'], s['errors'], self.id
+        # Launch configs can't be deleted while a group still uses them,
+        # so all the groups go first.
+        pool = ThreadPool(CLEANUP_CONCURRENCY)
+        try:
+            for objs in [[ag for ag in groups
+                          if ag.min_size == 0 and not ag.instances],
+                         launch_configs]:
+                for success in pool.map(try_deleting, objs):
+                    s['deleted' if success else 'errors'] += 1
+                s['api_calls'] += len(objs)
+        finally:
+            pool.close()
+            pool.join()
+        s['delete_time'] = time.time() - started - s['lookup_time']
+        logger.info('%d deleted, %d errors in %s (%d api calls, %.2fs '
+                    'lookup, %.2fs delete)' % (
+            s['deleted'], s['errors'], self.id, s['api_calls'],
+            s['lookup_time'], s['delete_time']
         ))
-        return (s['deleted'], s['errors'])
+        return s
 
-    def get_instances(self):
+    def _get_snapshot_instances(self):
+        snapshot = inventory.read_snapshot(cache)
+        if snapshot:
+            return snapshot['instances'].get(self.tag_name)
+
+    def _get_live_instances(self):
+        descs = self._get_snapshot_instances()
+        if descs is not None:
+            return descs
         ec2 = connect_ec2()
         reservations = ec2.get_all_instances(filters={
             'tag-key': self.tag_name,
-            'instance-state-name': ['pending', 'running']
+            'instance-state-name': inventory.LIVE_STATES
         })
+        return [inventory.describe_instance(res.instances[0])
+                for res in reservations]
+
+    def get_instances_version(self):
+        # Fingerprints everything get_instances() reads, without asking
+        # EC2. Returns None when there's no inventory snapshot to go by.
+        descs = self._get_snapshot_instances()
+        if descs is None:
+            return None
+        entries = (cache.find('%s:' % self.tag_name) +
+                   cache.find('fleeting-ready:%s:' % self.tag_name))
+        return hashlib.sha1(json.dumps([
+            descs,
+            sorted(json.dumps(entry, sort_keys=True) for entry in entries)
+        ], sort_keys=True)).hexdigest()[:16]
+
+    def get_instances(self):
         instances = {}
-        for res in reservations:
-            inst = res.instances[0]
-            info = json.loads(inst.tags[self.tag_name])
-            info['launch_time'] = inst.launch_time
-            info['state'] = inst.state
-            if self.ready_tag_name in inst.tags:
-                info['url'] = inst.tags[self.ready_tag_name]
+        for desc in self._get_live_instances():
+            info = json.loads(desc['tags'][self.tag_name])
+            if info.get('warm'):
+                continue
+            info['launch_time'] = desc['launch_time']
+            info['state'] = desc['state']
+            if self.ready_tag_name in desc['tags']:
+                info['url'] = desc['tags'][self.ready_tag_name]
             instances[info['slug']] = info
         for item in cache.find('%s:' % self.tag_name):
+            if item.get('warm'):
+                continue
             if (item['state'] == 'pending' and
                 item['slug'] not in instances):
-                instances[item['slug']] = item
+                instances[item['slug']] = dict(item)
             elif (item['state'] == 'terminated' and
                   item['slug'] in instances):
                 del instances[item['slug']]
+        for item in cache.find('fleeting-ready:%s:' % self.tag_name):
+            if item['slug'] in instances:
+                instances[item['slug']].setdefault('url', item['url'])
         for info in instances.values():
             info['git_branch_url'] = self._get_github_url(info['git_user'],
                                                           info['git_branch'])
         return instances.values()
 
-    def _ping_ready_url(self, inst):
+    def check_ready_url(self, inst):
         state = 'INSTANCE:%s' % inst.state
         info = None
 
         if inst.state == 'running' and inst.public_dns_name:
             url = self._get_instance_ready_url(inst.public_dns_name)
-            http = httplib2.Http(timeout=3)
             try:
-                res, content = http.request(url)
+                res, content = httpclient.request(url)
                 if res.status == 200:
                     state = 'READY'
                     info = url
-                    inst.add_tag(self.ready_tag_name, url)
                 else:
                     raise Exception('status %d' % res.status)
             except Exception, e:
                 info = str(e)
         return (state, info)
 
-    def get_instance(self, slug):
-        ec2 = connect_ec2()
-        reservations = ec2.get_all_instances(filters={
-            'tag-key': self.tag_name,
-            'instance-state-name': ['pending', 'running']
-        })
+    def _ping_ready_url(self, inst):
+        state, info = self.check_ready_url(inst)
+        if state == 'READY':
+            inst.add_tag(self.ready_tag_name, info)
+            self.record_timings(inst)
+        return (state, info)
+
+    def mark_ready(self, slug, inst):
+        url = self._get_instance_ready_url(inst.public_dns_name)
+        if self.ready_tag_name not in inst.tags:
+            inst.add_tag(self.ready_tag_name, url)
+        self.set_ready_url(slug, url)
+        self.record_timings(inst)
+        return url
+
+    def _get_timings_key(self, instance_id):
+        return 'fleeting-timings:%s:%s' % (self.tag_name, instance_id)
+
+    def record_timings(self, inst, ready=None):
+        # Meant to be called when an instance is first seen ready. The
+        # phase markers written by the bootstrap script are fetched from
+        # its authserver and kept after the instance is gone.
+        key = self._get_timings_key(inst.id)
+        for entry in cache.find(key):
+            if entry['instance_id'] == inst.id:
+                return entry
+        start = parse_ec2_timestamp(inst.launch_time)
+        if start is None:
+            return None
+        if ready is None:
+            ready = int(time.time())
+        try:
+            res, content = self._request_authserver_file(inst,
+                                                         timings.PHASES_FILE)
+            if res.status != 200:
+                raise Exception('status %d' % res.status)
+        except Exception, e:
+            content = ''
+        markers = timings.parse_markers(content)
+        info = json.loads(inst.tags[self.tag_name])
+        first = 'boot'
+        if 'group' in info:
+            # Claimed warm instances were booted long before anyone asked
+            # for them, so they're timed from the claim onwards.
+            branch = [m for m in markers if m[1] == 'branch']
+            if not branch:
+                return None
+            markers = markers[markers.index(branch[0]) + 1:]
+            start, first = branch[0]
+        record = dict(
+            slug=info['slug'],
+            instance_id=inst.id,
+            start=start,
+            ready=ready,
+            phases=timings.get_phases(start, markers, ready, first)
+        )
+        cache.set(key, record, ttl=timings.RETENTION)
+        return record
+
+    def get_timings(self):
+        return sorted(cache.find('fleeting-timings:%s:' % self.tag_name),
+                      key=lambda record: record['start'])
+
+    def set_ready_url(self, slug, url):
+        cache['fleeting-ready:%s:%s' % (self.tag_name, slug)] = dict(
+            slug=slug,
+            url=url
+        )
+
+    def _get_index_key(self, slug):
+        return 'fleeting-index:%s:%s' % (self.tag_name, slug)
+
+    def _index_instance(self, slug, instance_id, group=None, ttl=None):
+        entry = dict(
+            slug=slug,
+            instance_id=instance_id,
+            group=group or slug
+        )
+        if not instance_id:
+            # Tombstones only hold until the inventory changes.
+            entry['snapshot_version'] = _get_snapshot_version()
+        cache.set(self._get_index_key(slug), entry, ttl=ttl)
+
+    def _lookup_index_entry(self, slug):
+        for item in cache.find(self._get_index_key(slug)):
+            if item['slug'] == slug:
+                return item
+
+    def _lookup_instance_id(self, slug):
+        entry = self._lookup_index_entry(slug)
+        if entry is not None:
+            return entry['instance_id']
+
+    def _rebuild_instance_index(self):
+        ids = {}
+        groups = {}
         instances = {}
+        descs = self._get_snapshot_instances()
+        if descs is not None:
+            for desc in descs:
+                info = json.loads(desc['tags'][self.tag_name])
+                ids[info['slug']] = desc['id']
+                groups[info['slug']] = info.get('group')
+        else:
+            reservations = connect_ec2().get_all_instances(filters={
+                'tag-key': self.tag_name,
+                'instance-state-name': inventory.LIVE_STATES
+            })
+            for res in reservations:
+                inst = res.instances[0]
+                info = json.loads(inst.tags[self.tag_name])
+                ids[info['slug']] = inst.id
+                groups[info['slug']] = info.get('group')
+                instances[info['slug']] = inst
+        for slug, instance_id in ids.items():
+            self._index_instance(slug, instance_id, groups[slug])
+        return ids, instances
+
+    def _get_live_instance(self, instance_id):
+        try:
+            reservations = connect_ec2().get_all_instances(
+                instance_ids=[instance_id]
+            )
+        except boto.exception.EC2ResponseError:
+            reservations = []
         for res in reservations:
-            inst = res.instances[0]
-            info = json.loads(inst.tags[self.tag_name])
-            if info['slug'] == slug:
+            if res.instances[0].state in inventory.LIVE_STATES:
+                return res.instances[0]
+
+    def get_instance(self, slug):
+        entry = self._lookup_index_entry(slug) or {}
+        instance_id = entry.get('instance_id')
+        if instance_id == '':
+            # An empty id marks an instance we know to be gone, unless it
+            # may have turned up in the inventory since.
+            if entry.get('snapshot_version') == _get_snapshot_version():
+                return None
+            instance_id = None
+        stale_id = None
+        if instance_id:
+            inst = self._get_live_instance(instance_id)
+            if inst is not None:
                 return inst
+            # AutoScaling may have replaced the instance, giving the slug
+            # a new id, so look again before giving up on it.
+            stale_id = instance_id
+        if instance_id is None or stale_id:
+            ids, instances = self._rebuild_instance_index()
+            if slug in instances:
+                return instances[slug]
+            instance_id = ids.get(slug)
+        inst = None
+        if instance_id and instance_id != stale_id:
+            inst = self._get_live_instance(instance_id)
+        if inst is None:
+            self._index_instance(slug, '', entry.get('group'),
+                                 ttl=INDEX_TOMBSTONE_TTL)
+        return inst
+
+    def _request_authserver_file(self, inst, filename, headers=None):
+        url = "http://%s:%d/%s" % (inst.public_dns_name,
+                                   AUTHSERVER_PORT,
+                                   filename)
+        return httpclient.request(
+            url,
+            headers=headers,
+            credentials=tuple(AUTHSERVER_CREDS.split(':')),
+            timeout=5
+        )
 
-    def get_instance_authserver_log(self, inst):
+    def get_instance_authserver_log(self, inst, offset=0):
         if inst.state == 'running' and inst.public_dns_name:
-            user, passwd = AUTHSERVER_CREDS.split(':')
-            url = "http://%s:%d/%s" % (inst.public_dns_name,
-                                       AUTHSERVER_PORT,
-                                       AUTHSERVER_LOGFILE)
-            http = httplib2.Http(timeout=5)
-            http.add_credentials(user, passwd)
+            headers = {}
+            if offset:
+                headers['Range'] = 'bytes=%d-' % offset
             try:
-                res, content = http.request(url)
-                if res.status == 200:
+                res, content = self._request_authserver_file(
+                    inst,
+                    AUTHSERVER_LOGFILE,
+                    headers=headers
+                )
+                if res.status == 206:
                     return content
+                if res.status == 200:
+                    return content[offset:]
             except Exception, e:
                 pass
         return ""
 
     def get_instance_log(self, inst):
-        return inst.get_console_output().output or ""
+        # EC2 only updates console output every few minutes, so it's
+        # cached until an update is plausible given the timestamp EC2
+        # reports. Concurrent viewers of an instance share one fetch.
+        output = _get_console_output(inst.id)
+        if output is not None:
+            return output
+        with _console_locks[hash(inst.id) % CONSOLE_LOCK_STRIPES]:
+            output = _get_console_output(inst.id)
+            if output is not None:
+                return output
+            console = inst.get_console_output()
+            # Consoles can emit any bytes, but cached values must be
+            # representable as JSON.
+            output = (console.output or "").decode('utf-8', 'replace')
+            now = time.time()
+            reported = parse_ec2_timestamp(console.timestamp)
+            if reported is None:
+                reported = now
+            cache.set('fleeting-console:%s' % inst.id, dict(
+                id=inst.id,
+                output=output,
+                timestamp=console.timestamp,
+                fresh_until=max(reported + CONSOLE_UPDATE_INTERVAL,
+                                now + CONSOLE_RECHECK_INTERVAL)
+            ))
+            return output
 
     def get_instance_status(self, slug):
         conn = connect_ec2_autoscale()
-        ag_name = self._get_autoscale_group_name(slug)
+        ag_name = self._get_autoscale_group_name(self._get_group_slug(slug))
         ag = conn.get_all_groups(names=[ag_name])
         if not ag:
             return ('NOT_FOUND', None)
@@ -211,14 +587,16 @@ class Project(object):
         return self._ping_ready_url(inst)
 
     def destroy_instance(self, slug):
+        group_slug = self._get_group_slug(slug)
         self._set_cache_entry(slug, dict(
             slug=slug,
             state='terminated'
         ))
+        self._index_instance(slug, '', group_slug)
         found = False
 
         conn = connect_ec2_autoscale()
-        ag_name = self._get_autoscale_group_name(slug)
+        ag_name = self._get_autoscale_group_name(group_slug)
         ag = conn.get_all_groups(names=[ag_name])
         if ag:
             try:
@@ -230,7 +608,7 @@ class Project(object):
                     return 'SHUTDOWN_IN_PROGRESS'
                 return 'ERROR:%s' % e.code
 
-        lc_name = self._get_launch_config_name(slug)
+        lc_name = self._get_launch_config_name(group_slug)
         lc = conn.get_all_launch_configurations(names=[lc_name])
         if lc:
             try:
@@ -244,17 +622,288 @@ class Project(object):
         return 'NOT_FOUND'
 
     def render_user_data(self, **kwargs):
-        kwargs.update(dict(globals()))
-        sp = Template(self.script_template).render(**kwargs)
-        kwargs['STARTPROJECT_SCRIPT'] = sp
-        return Template(BOOTSTRAP_TEMPLATE).render(**kwargs)
+        # The ready callback differs for every instance, so it's filled in
+        # after the memoized rendering of everything else.
+        callback = self._render_ready_callback(
+            kwargs.pop('READY_CALLBACK_URL', None)
+        )
+        key = tuple(sorted(kwargs.items()))
+        with self._user_data_lock:
+            user_data = self._user_data.pop(key, None)
+            if user_data is not None:
+                # Re-inserting keeps the most recently used entries last.
+                self._user_data[key] = user_data
+        if user_data is None:
+            kwargs.update(TEMPLATE_CONTEXT)
+            kwargs['READY_CALLBACK_SCRIPT'] = READY_CALLBACK_PLACEHOLDER
+            sp = self._render_script(**kwargs)
+            if kwargs.get('BAKED'):
+                # The image already has everything above the branch steps.
+                sp = BRANCH_STEPS_MARKER.split(sp, 1)[1]
+            kwargs['STARTPROJECT_SCRIPT'] = sp
+            user_data = COMPILED_BOOTSTRAP_TEMPLATE.render(**kwargs)
+            with self._user_data_lock:
+                self._user_data[key] = user_data
+                while len(self._user_data) > MAX_CACHED_USER_DATA:
+                    self._user_data.popitem(last=False)
+        # The callback comes after the project script, which could
+        # conceivably contain the placeholder too.
+        head, sep, tail = user_data.rpartition(READY_CALLBACK_PLACEHOLDER)
+        return head + callback + tail
+
+    def _render_script(self, **kwargs):
+        script = self.compiled_script_template.render(**kwargs)
+        return BRANCH_STEPS_MARKER.sub(
+            lambda match: match.group(0) + '\nfleeting_phase branch',
+            script,
+            1
+        )
+
+    def _split_script(self, **kwargs):
+        kwargs.update(TEMPLATE_CONTEXT)
+        return BRANCH_STEPS_MARKER.split(self._render_script(**kwargs), 1)
+
+    def render_warm_user_data(self, claim_secret, baked=False):
+        generic = ''
+        if not baked:
+            generic = self._split_script(GIT_USER='', GIT_BRANCH='')[0]
+        return COMPILED_BOOTSTRAP_TEMPLATE.render(
+            STARTPROJECT_SCRIPT=generic + WARM_WAIT_SCRIPT,
+            BAKED=baked,
+            CLAIM_SECRET=claim_secret,
+            **TEMPLATE_CONTEXT
+        )
+
+    def render_bake_user_data(self):
+        return COMPILED_BOOTSTRAP_TEMPLATE.render(
+            STARTPROJECT_SCRIPT=self._split_script(GIT_USER='',
+                                                   GIT_BRANCH='')[0],
+            BAKING=True,
+            **TEMPLATE_CONTEXT
+        )
+
+    def get_bake_version(self):
+        return hashlib.sha1(self.render_bake_user_data()).hexdigest()[:16]
+
+    def _get_bake_key(self, version):
+        return 'fleeting-bake:%s:%s' % (self.tag_name, version)
+
+    def get_baked_image_id(self):
+        # Images are tagged with the version of the steps baked into them,
+        # so changing those steps (or the bootstrap script) means the old
+        # image is no longer found.
+        if not self.bakeable:
+            return None
+        version = self.get_bake_version()
+        key = self._get_bake_key(version)
+        for entry in cache.find(key):
+            if entry['version'] == version:
+                return entry['image_id']
+        images = connect_ec2().get_all_images(owners=['self'], filters={
+            'tag:%s' % self.bake_tag_name: version,
+            'state': 'available'
+        })
+        image_id = images[0].id if images else None
+        cache.set(key, dict(
+            version=version,
+            image_id=image_id
+        ), ttl=BAKED_IMAGE_TTL)
+        return image_id
+
+    def _get_bake_status(self, inst):
+        inst.update()
+        if inst.state != 'running' or not inst.public_dns_name:
+            return None
+        try:
+            res, content = self._request_authserver_file(inst,
+                                                         BAKE_STATUS_FILE)
+        except Exception, e:
+            return None
+        if res.status == 200:
+            return content.strip()
+
+    def _wait_for(self, check, deadline):
+        while True:
+            result = check()
+            if result is not None or time.time() >= deadline:
+                return result
+            time.sleep(BAKE_POLL_INTERVAL)
+
+    def bake_image(self, key_name, security_groups, logger=logging):
+        if not self.bakeable:
+            return ('NOT_BAKEABLE', None)
+        version = self.get_bake_version()
+        deadline = time.time() + BAKE_TIMEOUT
+        ec2 = connect_ec2()
+        res = ec2.run_instances(
+            self.meta['image-id'],
+            key_name=key_name,
+            instance_type=self.meta['instance-type'],
+            security_groups=security_groups,
+            user_data=self.render_bake_user_data()
+        )
+        inst = res.instances[0]
+        try:
+            inst.add_tag('Name', 'fleeting bake %s %s' % (self.id, version))
+            logger.info('baking %s %s on %s' % (self.id, version, inst.id))
+            status = self._wait_for(lambda: self._get_bake_status(inst),
+                                    deadline)
+            if status is None:
+                return ('TIMEOUT', None)
+            if status != '0':
+                return ('BAKE_FAILED', status)
+            image_id = ec2.create_image(
+                inst.id,
+                'fleeting_%s_%s' % (self.id, version),
+                description='fleeting %s bootstrap' % self.id
+            )
+            ec2.create_tags([image_id], {self.bake_tag_name: version})
+            state = self._wait_for(
+                lambda: ec2.get_image(image_id).state == 'available' or None,
+                deadline
+            )
+            if state is None:
+                return ('TIMEOUT', image_id)
+        finally:
+            inst.terminate()
+        for image in ec2.get_all_images(owners=['self'], filters={
+            'tag-key': self.bake_tag_name
+        }):
+            if image.tags.get(self.bake_tag_name) != version:
+                logger.info('deregistering stale image %s' % image.id)
+                image.deregister()
+        cache.set(self._get_bake_key(version), dict(
+            version=version,
+            image_id=image_id
+        ), ttl=BAKED_IMAGE_TTL)
+        return ('DONE', image_id)
+
+    def _render_ready_callback(self, url):
+        if not url:
+            return ''
+        return READY_CALLBACK_TEMPLATE.render(
+            READY_URL=self.meta['ready-url'],
+            READY_CALLBACK_URL=url,
+            READY_POLL_INTERVAL=READY_POLL_INTERVAL
+        )
+
+    def render_branch_steps(self, git_user, git_branch, ready_callback=None):
+        return (self._render_ready_callback(ready_callback) +
+                self._split_script(GIT_USER=git_user,
+                                   GIT_BRANCH=git_branch)[1])
+
+    def _get_warm_slugs(self):
+        slugs = set()
+        for desc in self._get_live_instances():
+            info = json.loads(desc['tags'][self.tag_name])
+            if info.get('warm'):
+                slugs.add(info['slug'])
+        for item in cache.find('%s:' % self.tag_name):
+            if item.get('warm') and item['state'] == 'pending':
+                slugs.add(item['slug'])
+            elif item.get('warm') and item['state'] == 'claimed':
+                # The snapshot may not have caught up with the claim yet.
+                slugs.discard(item['slug'])
+        return slugs
+
+    def _get_claim_secret(self, slug):
+        # Derived rather than stored, so restarts don't strand the pool.
+        return hmac.new(str(claim_key), 'claim:%s:%s' % (self.id, slug),
+                        hashlib.sha1).hexdigest()
+
+    def _claim_warm_instance(self, git_user, git_branch, ready_callback=None):
+        candidates = []
+        for desc in self._get_live_instances():
+            info = json.loads(desc['tags'][self.tag_name])
+            if (info.get('warm') and desc['state'] == 'running' and
+                desc['public_dns_name']):
+                candidates.append((desc['launch_time'], desc, info))
+        if not candidates:
+            return None
+        steps = self.render_branch_steps(git_user, git_branch, ready_callback)
+        # Older instances are more likely to have finished warming up.
+        for launch_time, desc, info in sorted(candidates):
+            url = "http://%s:%d/branch-steps" % (desc['public_dns_name'],
+                                                 AUTHSERVER_PORT)
+            try:
+                res, content = httpclient.request(
+                    url,
+                    method='PUT',
+                    body=steps,
+                    headers={
+                        CLAIM_HEADER: self._get_claim_secret(info['slug'])
+                    },
+                    credentials=tuple(AUTHSERVER_CREDS.split(':')),
+                    timeout=5
+                )
+            except Exception, e:
+                continue
+            if res.status == 201:
+                return desc, info['slug']
+        return None
+
+    def _adopt_warm_instance(self, desc, group_slug, info, lifetime):
+        conn = connect_ec2_autoscale()
+        ag_name = self._get_autoscale_group_name(group_slug)
+        info['group'] = group_slug
+        value = json.dumps(info)
+        connect_ec2().create_tags([desc['id']], {self.tag_name: value})
+        conn.create_or_update_tags([boto.ec2.autoscale.tag.Tag(
+            conn,
+            self.tag_name,
+            value,
+            propagate_at_launch=True,
+            resource_id=ag_name
+        )])
+        conn.create_scheduled_group_action(
+            ag_name,
+            '%s_shutdown-action' % ag_name,
+            datetime.datetime.utcnow() + lifetime,
+            desired_capacity=0,
+            min_size=0,
+            max_size=0
+        )
+        self._index_instance(info['slug'], desc['id'], group_slug)
+        self._set_cache_entry(group_slug, dict(
+            slug=group_slug,
+            warm=True,
+            state='claimed'
+        ))
+
+    def fill_warm_pool(self, key_name, security_groups, notify_topic=None,
+                       logger=logging):
+        missing = self.warm_pool_size - len(self._get_warm_slugs())
+        if missing <= 0:
+            return 0
+        logger.info('adding %d warm instance(s) to %s' % (missing, self.id))
+        image_id = self.get_baked_image_id()
+        for i in range(missing):
+            slug = 'warm-%d-%d' % (time.time(), i)
+            # Anyone who can reach the authserver knows its credentials,
+            # so claims also need a secret only this instance is told.
+            user_data = self.render_warm_user_data(
+                self._get_claim_secret(slug),
+                baked=bool(image_id)
+            )
+            self._create_group(slug, dict(
+                slug=slug,
+                warm=True,
+                lifetime=WARM_POOL_LIFETIME.total_seconds()
+            ), user_data, key_name, security_groups, notify_topic,
+               WARM_POOL_LIFETIME, image_id=image_id)
+        return missing
 
     def create_instance(self, slug, git_user, git_branch, key_name,
                         security_groups, notify_topic=None,
-                        lifetime=DEFAULT_LIFETIME):
+                        lifetime=DEFAULT_LIFETIME, on_step=None,
+                        ready_callback=None):
+        on_step = on_step or (lambda name: None)
+
+        on_step('validate_git_info')
         if does_url_404(self._get_github_url(git_user, git_branch)):
             return 'INVALID_GIT_INFO'
 
+        on_step('check_existing_instance')
         conn = connect_ec2_autoscale()
         ag_name = self._get_autoscale_group_name(slug)
 
@@ -262,27 +911,60 @@ class Project(object):
         if ag and (ag[0].instances or ag[0].min_size == 1):
             return 'INSTANCE_ALREADY_EXISTS'
 
+        on_step('cleanup_instances')
         self.cleanup_instances()
 
+        info = dict(
+            slug=slug,
+            git_user=git_user,
+            git_branch=git_branch,
+            lifetime=lifetime.total_seconds()
+        )
+        template_vars = dict(GIT_USER=git_user, GIT_BRANCH=git_branch)
+        if ready_callback:
+            # The prober holds off on instances that report themselves.
+            info['ready_callback'] = True
+            template_vars['READY_CALLBACK_URL'] = ready_callback
+        if self.warm_pool_size:
+            on_step('claim_warm_instance')
+            claimed = self._claim_warm_instance(git_user, git_branch,
+                                                ready_callback)
+            if claimed:
+                self._adopt_warm_instance(claimed[0], claimed[1], info,
+                                          lifetime)
+                info['state'] = 'pending'
+                self._set_cache_entry(slug, info)
+                return 'DONE'
+
+        image_id = None
+        if self.bakeable:
+            on_step('find_baked_image')
+            image_id = self.get_baked_image_id()
+            if image_id:
+                template_vars['BAKED'] = True
+
+        self._create_group(slug, info, self.render_user_data(**template_vars),
+                           key_name, security_groups, notify_topic, lifetime,
+                           on_step, image_id)
+        return 'DONE'
+
+    def _create_group(self, slug, info, user_data, key_name, security_groups,
+                      notify_topic, lifetime, on_step=None, image_id=None):
+        on_step = on_step or (lambda name: None)
+        conn = connect_ec2_autoscale()
+        ag_name = self._get_autoscale_group_name(slug)
+
+        on_step('create_launch_configuration')
         lc = LaunchConfiguration(
             name=self._get_launch_config_name(slug),
-            image_id=self.meta['image-id'],
+            image_id=image_id or self.meta['image-id'],
             key_name=key_name,
             instance_type=self.meta['instance-type'],
             security_groups=security_groups,
-            user_data=self.render_user_data(
-                GIT_USER=git_user,
-                GIT_BRANCH=git_branch
-            )
+            user_data=user_data
         )
         conn.create_launch_configuration(lc)
 
-        info = dict(
-            slug=slug,
-            git_user=git_user,
-            git_branch=git_branch,
-            lifetime=lifetime.total_seconds()
-        )
         ag_shutdown_name = '%s_shutdown-action' % ag_name
         ag_tag = boto.ec2.autoscale.tag.Tag(
             conn,
@@ -305,7 +987,9 @@ class Project(object):
             max_size=1,
             connection=conn
         )
+        on_step('create_auto_scaling_group')
         conn.create_auto_scaling_group(ag)
+        on_step('create_scheduled_group_action')
         conn.create_scheduled_group_action(
             ag_name,
             ag_shutdown_name,
@@ -315,6 +999,7 @@ class Project(object):
             max_size=0
         )
         if notify_topic:
+            on_step('put_notification_configuration')
             conn.put_notification_configuration(
                 ag,
                 notify_topic,
@@ -322,13 +1007,74 @@ class Project(object):
             )
         info['state'] = 'pending'
         self._set_cache_entry(slug, info)
-        return 'DONE'
 
-def get_project_map():
+def _list_project_scripts(projects_dir):
     pmap = {}
-    projects_dir = path('projects')
     for filename in os.listdir(projects_dir):
         if not filename.startswith('.'):
             abspath = os.path.join(projects_dir, filename)
             pmap[os.path.splitext(filename)[0]] = abspath
     return pmap
+
+class ProjectRegistry(object):
+    """
+    Process-wide store of parsed projects. Each script is parsed once and
+    only re-read when its modification time changes; the directory listing
+    is likewise only refreshed when the directory itself changes.
+    """
+
+    def __init__(self, projects_dir):
+        self.projects_dir = projects_dir
+        self.lock = Lock()
+        self._dir_mtime = None
+        self._pmap = {}
+        self._projects = {}
+
+    def get_project_map(self):
+        mtime = os.stat(self.projects_dir).st_mtime
+        with self.lock:
+            if mtime != self._dir_mtime:
+                self._pmap = _list_project_scripts(self.projects_dir)
+                self._dir_mtime = mtime
+            return dict(self._pmap)
+
+    def get(self, project_id):
+        script_path = self.get_project_map().get(project_id)
+        if script_path is None:
+            return None
+        try:
+            mtime = os.stat(script_path).st_mtime
+        except OSError:
+            return None
+        with self.lock:
+            entry = self._projects.get(project_id)
+            if entry is None or entry[0] != mtime:
+                entry = (mtime, Project(project_id, script_path))
+                self._projects[project_id] = entry
+            return entry[1]
+
+    def get_all(self):
+        projects = [self.get(project_id)
+                    for project_id in sorted(self.get_project_map())]
+        return [proj for proj in projects if proj is not None]
+
+registry = ProjectRegistry(path('projects'))
+
+def get_project_map():
+    return registry.get_project_map()
+
+def get_project(project_id):
+    return registry.get(project_id)
+
+def get_projects():
+    return registry.get_all()
+
+def sweep_inventory(interval=inventory.DEFAULT_POLL_INTERVAL):
+    # When several processes share a cache, whoever polls first wins and
+    # the rest skip this round.
+    snapshot = inventory.read_snapshot(cache)
+    if snapshot and time.time() - snapshot['timestamp'] < interval * 0.9:
+        return snapshot['version']
+    tag_names = [proj.tag_name for proj in get_projects()]
+    instances = inventory.sweep(connect_ec2(), tag_names)
+    return inventory.publish_snapshot(cache, instances, interval)
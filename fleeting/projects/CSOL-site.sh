@@ -7,11 +7,6 @@
 # fleeting-meta:ready-url     = http://localhost:3000/
 
 export DEBIAN_FRONTEND=noninteractive
-export COOKIE_SECRET="TESTING"
-
-# Needed by node-gyp. For more info, see:
-# https://github.com/TooTallNate/node-gyp/issues/21#issuecomment-17494117
-export HOME=/home/ubuntu
 
 # Taken from:
 # https://github.com/joyent/node/wiki/Installing-Node.js-via-package-manager
@@ -22,6 +17,14 @@ add-apt-repository -y ppa:chris-lea/node.js
 apt-get -q -y update
 apt-get -q -y install nodejs git mysql-server
 
+# fleeting-branch-steps
+
+export COOKIE_SECRET="TESTING"
+
+# Needed by node-gyp. For more info, see:
+# https://github.com/TooTallNate/node-gyp/issues/21#issuecomment-17494117
+export HOME=/home/ubuntu
+
 git clone --recursive -b {{GIT_BRANCH}} \
   git://github.com/{{GIT_USER}}/CSOL-site.git
 
@@ -29,5 +32,7 @@ cd CSOL-site
 
 mysql -e 'create database if not exists csol;'
 
+fleeting_phase install
 npm install --production
+fleeting_phase start
 node app.js
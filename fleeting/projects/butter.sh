@@ -7,11 +7,6 @@
 # fleeting-meta:ready-url     = http://localhost:8888/
 
 export DEBIAN_FRONTEND=noninteractive
-export hostname="http://`ec2metadata --public-hostname`:8888"
-
-# Needed by node-gyp. For more info, see:
-# https://github.com/TooTallNate/node-gyp/issues/21#issuecomment-17494117
-export HOME=/home/ubuntu
 
 # Taken from:
 # https://github.com/joyent/node/wiki/Installing-Node.js-via-package-manager
@@ -22,10 +17,20 @@ add-apt-repository -y ppa:chris-lea/node.js
 apt-get -q -y update
 apt-get -q -y install nodejs git mysql-server
 
+# fleeting-branch-steps
+
+export hostname="http://`ec2metadata --public-hostname`:8888"
+
+# Needed by node-gyp. For more info, see:
+# https://github.com/TooTallNate/node-gyp/issues/21#issuecomment-17494117
+export HOME=/home/ubuntu
+
 git clone --recursive -b {{GIT_BRANCH}} \
   git://github.com/{{GIT_USER}}/butter.git
 
 cd butter
 
+fleeting_phase install
 npm install --production
+fleeting_phase start
 npm start
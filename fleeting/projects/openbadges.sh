@@ -7,11 +7,6 @@
 # fleeting-meta:ready-url     = http://localhost:8888/
 
 export DEBIAN_FRONTEND=noninteractive
-export PUBLIC_HOSTNAME=`ec2metadata --public-hostname`
-
-# Needed by node-gyp. For more info, see:
-# https://github.com/TooTallNate/node-gyp/issues/21#issuecomment-17494117
-export HOME=/home/ubuntu
 
 # Taken from:
 # https://github.com/joyent/node/wiki/Installing-Node.js-via-package-manager
@@ -22,6 +17,14 @@ add-apt-repository -y ppa:chris-lea/node.js
 apt-get -q -y update
 apt-get -q -y install nodejs git mysql-server
 
+# fleeting-branch-steps
+
+export PUBLIC_HOSTNAME=`ec2metadata --public-hostname`
+
+# Needed by node-gyp. For more info, see:
+# https://github.com/TooTallNate/node-gyp/issues/21#issuecomment-17494117
+export HOME=/home/ubuntu
+
 git clone --recursive -b {{GIT_BRANCH}} \
   git://github.com/{{GIT_USER}}/openbadges.git
 
@@ -42,6 +45,8 @@ mysql -uroot -e "grant all on openbadges.* to 'badgemaker'@'localhost' \
 mysql -uroot -e "grant all on test_openbadges.* to 'badgemaker'@'localhost' \
   identified by 'secret'"
 
+fleeting_phase install
 npm install --production
+fleeting_phase start
 make start-issuer
 npm start
@@ -6,34 +6,16 @@ var Github = (function() {
   var typeaheadMatcher = $.fn.typeahead.Constructor.prototype.matcher;
   var ghFork = '[data-github-fork]';
   var ghBranch = '[data-github-branch]';
-  var getNextGithubPagePath = function(linkHeader) {
-    var NEXT_REGEXP = /<https:\/\/api.github.com\/([^>]*)>;\srel="next"/;
-    var match = linkHeader.match(NEXT_REGEXP);
-
-    return match ? '/' + match[1] : null;
-  };
-  var collectGithubPages = function(path, cb, finalResult) {
-    if (!finalResult)
-      finalResult = [];
-    var req = $.getJSON('https://api.github.com' + path, function(result) {
-      finalResult = finalResult.concat(result);
-      var linkHeader = req.getResponseHeader('Link');
-      if (linkHeader) {
-        var nextUrl = getNextGithubPagePath(linkHeader);
-        if (nextUrl)
-          return collectGithubPages(nextUrl, cb, finalResult);
-      }
-      return cb(finalResult);
-    });
-  };
+  // Fork and branch lists are fetched and cached by fleeting itself,
+  // relative to the project page.
   var getGithubJSON = function(path, cb) {
-    var key = 'project:github:' + path;
+    var key = 'project:github:' + location.pathname + path;
     var value = lscache.get(key);
     if (value)
       return cb(value);
-    collectGithubPages(path, function(value) {
-      lscache.set(key, value, EXPIRY);
-      cb(value);
+    $.getJSON('github/' + path, function(result) {
+      lscache.set(key, result.names, EXPIRY);
+      cb(result.names);
     });
   };
 
@@ -42,18 +24,10 @@ var Github = (function() {
 
     if ($this.data('typeahead')) return;
 
-    var repoHome = $(this).attr("data-github-fork");
-    var repoName = repoHome.split('/')[1];
-
-    $this.attr("data-github-repo-name", repoName);
     $this.attr("autocomplete", "off").typeahead({
       matcher: typeaheadMatcher,
       source: function(query, process) {
-        getGithubJSON('/repos/' + repoHome + '/forks', function(forks) {
-          process(forks.map(function(fork) {
-            return fork.owner.login;
-          }));
-        });
+        getGithubJSON('forks', process);
       }      
     });
   });
@@ -67,8 +41,6 @@ var Github = (function() {
 
     if (!fork) return;
 
-    var repoName = fork.$element.attr("data-github-repo-name");
-
     $this.attr("autocomplete", "off").typeahead({
       matcher: typeaheadMatcher,
       source: function(query, process) {
@@ -76,12 +48,8 @@ var Github = (function() {
 
         fork.source(username, function(matches) {
           if (matches.indexOf(username) != -1) {
-            var path = '/repos/' + username + '/' + repoName + '/branches';
-            getGithubJSON(path, function(branches) {
-              process(branches.map(function(branch) {
-                return branch.name;
-              }));
-            });
+            getGithubJSON('branches/' + encodeURIComponent(username),
+                          process);
           } else
             process([]);
         });
@@ -91,9 +59,7 @@ var Github = (function() {
 
   return {
     _testing: {
-      getGithubJSON: getGithubJSON,
-      getNextGithubPagePath: getNextGithubPagePath,
-      collectGithubPages: collectGithubPages
+      getGithubJSON: getGithubJSON
     }
   };
 })();
@@ -1,11 +1,72 @@
 "use strict";
 
-$(window).on('load', function() {
-  $('[data-refresh-url]').each(function() {
-    var $this = $(this);
-    var url = $this.attr('data-refresh-url');
-    var interval = parseInt($this.attr('data-refresh-seconds')) * 1000;
+var Refresh = (function() {
+  var findRow = function($container, slug) {
+    return $container.find('tr[data-slug]').filter(function() {
+      return $(this).attr('data-slug') === slug;
+    });
+  };
 
-    setInterval(function() { $this.load(url); }, interval);
+  // Sends If-None-Match with the last ETag seen for the url, so an
+  // unchanged list comes back as an empty 304.
+  var refreshFragment = function($container, url) {
+    return $.ajax({
+      url: url,
+      ifModified: true,
+      success: function(html, status) {
+        if (status != 'notmodified')
+          $container.html(html);
+      }
+    });
+  };
+
+  // Patches the instance table in place from add, change and remove
+  // events, falling back to reloading the whole fragment when the table
+  // doesn't match what the server expects.
+  var listenForEvents = function($container, url, eventsUrl, version) {
+    var source = new EventSource(eventsUrl + '?version=' +
+                                 encodeURIComponent(version));
+    var reload = function() { $container.load(url); };
+    var upsert = function(e) {
+      var row = JSON.parse(e.data);
+      var $table = $container.find('table');
+      var $old = findRow($container, row.slug);
+
+      if (!$table.length) return reload();
+      if ($old.length)
+        $old.replaceWith(row.html);
+      else
+        $table.append(row.html);
+    };
+
+    source.addEventListener('add', upsert, false);
+    source.addEventListener('change', upsert, false);
+    source.addEventListener('remove', function(e) {
+      findRow($container, JSON.parse(e.data).slug).remove();
+      if (!$container.find('tr[data-slug]').length) reload();
+    }, false);
+    source.addEventListener('reset', reload, false);
+    return source;
+  };
+
+  $(window).on('load', function() {
+    $('[data-refresh-url]').each(function() {
+      var $this = $(this);
+      var url = $this.attr('data-refresh-url');
+      var interval = parseInt($this.attr('data-refresh-seconds')) * 1000;
+      var eventsUrl = $this.attr('data-events-url');
+
+      if (eventsUrl && window.EventSource)
+        return listenForEvents($this, url, eventsUrl,
+                               $this.attr('data-events-version'));
+      setInterval(function() { refreshFragment($this, url); }, interval);
+    });
   });
-});
+
+  return {
+    _testing: {
+      listenForEvents: listenForEvents,
+      refreshFragment: refreshFragment
+    }
+  };
+})();
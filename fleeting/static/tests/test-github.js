@@ -1,17 +1,34 @@
 (function() {
-  module("github");
+  module("github", {
+    setup: function() {
+      lscache.flush();
+      this.server = sinon.fakeServer.create();
+    },
+    teardown: function() {
+      this.server.restore();
+      lscache.flush();
+    }
+  });
 
-  test("getNextGithubPagePath() return path when one exists", function() {
-    var linkHeader = '<https://api.github.com/repositories/1726649/' +
-      'forks?page=2>; rel="next", <https://api.github.com/repositories/' +
-      '1726649/forks?page=4>; rel="last"';
-    equal(Github._testing.getNextGithubPagePath(linkHeader),
-          '/repositories/1726649/forks?page=2');
+  test("getGithubJSON() fetches names from fleeting", function() {
+    var cb = sinon.spy();
+    this.server.respondWith("GET", "github/forks", [
+      200, {"Content-Type": "application/json"}, '{"names": ["toolness"]}'
+    ]);
+    Github._testing.getGithubJSON('forks', cb);
+    this.server.respond();
+    ok(cb.calledWith(["toolness"]), "callback receives names");
   });
 
-  test("getNextGithubPagePath() returns null if no path", function() {
-    var linkHeader = '<https://api.github.com/repositories/1726649/' +
-      'forks?page=2>; rel="prev"';
-    equal(Github._testing.getNextGithubPagePath(linkHeader), null);
+  test("getGithubJSON() caches names in localStorage", function() {
+    var cb = sinon.spy();
+    this.server.respondWith("GET", "github/forks", [
+      200, {"Content-Type": "application/json"}, '{"names": ["toolness"]}'
+    ]);
+    Github._testing.getGithubJSON('forks', function() {});
+    this.server.respond();
+    Github._testing.getGithubJSON('forks', cb);
+    equal(this.server.requests.length, 1, "only one request is made");
+    ok(cb.calledWith(["toolness"]), "callback receives cached names");
   });
 })();
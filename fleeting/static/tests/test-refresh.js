@@ -0,0 +1,84 @@
+(function() {
+  var FakeEventSource = function(url) {
+    this.url = url;
+    this.listeners = {};
+  };
+
+  FakeEventSource.prototype = {
+    addEventListener: function(name, cb) {
+      this.listeners[name] = cb;
+    },
+    emit: function(name, data) {
+      this.listeners[name]({data: JSON.stringify(data)});
+    }
+  };
+
+  module("refresh", {
+    setup: function() {
+      this.realEventSource = window.EventSource;
+      window.EventSource = FakeEventSource;
+      this.$container = $('<div><table><tr><th>Name</th></tr>' +
+                          '<tr data-slug="a"><td>a</td></tr></table></div>')
+        .appendTo('#qunit-fixture');
+      this.load = sinon.stub(this.$container, 'load');
+      this.source = Refresh._testing.listenForEvents(this.$container, 'list',
+                                                     'events', 'v1');
+    },
+    teardown: function() {
+      window.EventSource = this.realEventSource;
+    }
+  });
+
+  test("connects with the rendered version", function() {
+    equal(this.source.url, 'events?version=v1');
+  });
+
+  test("add and change events patch rows in place", function() {
+    this.source.emit('add', {slug: 'b', html: '<tr data-slug="b"></tr>'});
+    this.source.emit('change', {slug: 'a',
+                                html: '<tr data-slug="a" class="x"></tr>'});
+    equal(this.$container.find('tr[data-slug]').length, 2);
+    ok(this.$container.find('tr[data-slug="a"]').hasClass('x'));
+    ok(!this.load.called, "fragment is not reloaded");
+  });
+
+  test("removing the last row reloads the fragment", function() {
+    this.source.emit('remove', {slug: 'a'});
+    equal(this.$container.find('tr[data-slug]').length, 0);
+    ok(this.load.calledWith('list'));
+  });
+
+  test("reset events reload the fragment", function() {
+    this.source.emit('reset', {});
+    ok(this.load.calledWith('list'));
+  });
+
+  module("refresh polling", {
+    setup: function() {
+      this.server = sinon.fakeServer.create();
+      this.$container = $('<div>old</div>').appendTo('#qunit-fixture');
+    },
+    teardown: function() {
+      this.server.restore();
+    }
+  });
+
+  test("refreshFragment() revalidates with If-None-Match", function() {
+    var server = this.server;
+    var requests = 0;
+    server.respondWith("GET", "etag-list", function(xhr) {
+      requests++;
+      if (xhr.requestHeaders['If-None-Match'] == '"v1"')
+        return xhr.respond(304, {}, '');
+      xhr.respond(200, {"Content-Type": "text/html", "ETag": '"v1"'}, 'new');
+    });
+    Refresh._testing.refreshFragment(this.$container, 'etag-list');
+    server.respond();
+    equal(this.$container.html(), 'new');
+    this.$container.html('kept');
+    Refresh._testing.refreshFragment(this.$container, 'etag-list');
+    server.respond();
+    equal(requests, 2);
+    equal(this.$container.html(), 'kept', "304 leaves the fragment alone");
+  });
+})();
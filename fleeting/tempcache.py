@@ -1,44 +1,188 @@
 import time
-from copy import deepcopy
+import json
+from bisect import bisect_left, insort
+from heapq import heappush, heappop, heapify
+from collections import OrderedDict
 from threading import Lock
 
 import redis
 
+from . import metrics
+
+def count_lookup(prefix, results):
+    metrics.inc('fleeting_cache_lookups_total',
+                namespace=prefix.split(':')[0],
+                result='hit' if results else 'miss')
+    return results
+
+class FrozenDict(dict):
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('cached values are immutable')
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+class FrozenList(list):
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('cached values are immutable')
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _immutable
+    __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
 class DictTempCache(object):
-    def __init__(self, ttl):
-        self.__cache = {}
+    """
+    In-process cache whose entries expire after a TTL.
+
+    Values are frozen when stored, so lookups can hand out the stored
+    objects without copying them. Expiry is driven by a heap, and prefix
+    lookups bisect into a sorted list of keys. When max_entries is given,
+    the least recently used entries are evicted to stay within it.
+    """
+
+    def __init__(self, ttl, max_entries=None):
         self.ttl = ttl
+        self.max_entries = max_entries
         self.lock = Lock()
+        self.__entries = OrderedDict()
+        self.__keys = []
+        self.__expiries = []
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __remove(self, key):
+        del self.__entries[key]
+        del self.__keys[bisect_left(self.__keys, key)]
 
-    def __cleanup(self):
+    def __cleanup(self, now):
+        heap = self.__expiries
+        while heap and heap[0][0] <= now:
+            expiry, key = heappop(heap)
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] == expiry:
+                self.__remove(key)
+        # Overwritten entries leave stale heap items behind; don't let
+        # them pile up.
+        if len(heap) > 2 * len(self.__entries) + 64:
+            self.__expiries = [(entry[0], key) for key, entry
+                               in self.__entries.items()]
+            heapify(self.__expiries)
+
+    def __touch(self, key):
+        self.__entries[key] = self.__entries.pop(key)
+
+    def set(self, key, value, ttl=None):
         now = time.time()
-        for key in self.__cache.keys():
-            if now >= self.__cache[key]['expiry']:
-                del self.__cache[key]
+        expiry = now + (self.ttl if ttl is None else ttl)
+        value = freeze(value)
+        with self.lock:
+            self.__cleanup(now)
+            if key in self.__entries:
+                del self.__entries[key]
+            else:
+                insort(self.__keys, key)
+            self.__entries[key] = (expiry, value)
+            heappush(self.__expiries, (expiry, key))
+            if self.max_entries is not None:
+                while len(self.__entries) > self.max_entries:
+                    self.__remove(next(iter(self.__entries)))
 
     def __setitem__(self, key, value):
-        with self.lock:
-            self.__cleanup()
-            self.__cache[key] = dict(value=deepcopy(value),
-                                     expiry=time.time() + self.ttl)
+        self.set(key, value)
 
     def find(self, prefix):
         with self.lock:
-            self.__cleanup()
-            return [deepcopy(self.__cache[key]['value'])
-                    for key in self.__cache
-                    if key.startswith(prefix)]
+            self.__cleanup(time.time())
+            keys = self.__keys
+            results = []
+            i = bisect_left(keys, prefix)
+            while i < len(keys) and keys[i].startswith(prefix):
+                if self.max_entries is not None:
+                    self.__touch(keys[i])
+                results.append(self.__entries[keys[i]][1])
+                i += 1
+        return count_lookup(prefix, results)
+
+# Trims expired members from a prefix index and returns the values of
+# the remaining ones, all in a single round trip.
+FIND_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local keys = redis.call('ZRANGEBYSCORE', KEYS[1], '(' .. ARGV[1], '+inf')
+if #keys == 0 then
+  return {}
+end
+return redis.call('MGET', unpack(keys))
+"""
+
+# Pushes an index's expiry back to cover a new member, but never brings
+# it forward, which would drop longer-lived members with it.
+EXTEND_EXPIRY_SCRIPT = """
+if redis.call('TTL', KEYS[1]) < tonumber(ARGV[1]) then
+  redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+"""
+
+def index_prefixes(key):
+    prefixes = [key[:i + 1] for i, c in enumerate(key) if c == ':']
+    if key not in prefixes:
+        prefixes.append(key)
+    return prefixes
 
 class RedisTempCache(object):
-    def __init__(self, ttl, url='redis://localhost:6379'):
+    """
+    Redis-backed cache whose entries expire after a TTL.
+
+    Values are stored as JSON. Every key is also added to a sorted set,
+    scored by expiry time, for each of its prefixes that ends in a colon,
+    and for the key itself. find() therefore only supports those
+    prefixes, which are the only kind the app uses. Expired members are
+    trimmed from an index whenever it's written to or searched.
+    """
+
+    def __init__(self, ttl, url='redis://localhost:6379',
+                 index_prefix='tempcache-index:'):
         self.ttl = ttl
+        self.index_prefix = index_prefix
         self.redis = redis.from_url(url)
+        self.find_script = None
+        self.extend_expiry_script = None
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        now = time.time()
+        expiry = now + ttl
+        if self.extend_expiry_script is None:
+            self.extend_expiry_script = self.redis.register_script(
+                EXTEND_EXPIRY_SCRIPT
+            )
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(key, json.dumps(value), ex=ttl)
+        for prefix in index_prefixes(key):
+            index_key = self.index_prefix + prefix
+            # Most prefixes are never passed to find(), which is the only
+            # other place expired members get trimmed.
+            pipe.zremrangebyscore(index_key, '-inf', now)
+            pipe.zadd(index_key, key, expiry)
+            self.extend_expiry_script(keys=[index_key], args=[ttl],
+                                      client=pipe)
+        pipe.execute()
 
     def __setitem__(self, key, value):
-        self.redis.hmset(key, value)
-        self.redis.expire(key, self.ttl)
+        self.set(key, value)
 
     def find(self, prefix):
-        items = [self.redis.hgetall(key)
-                 for key in self.redis.keys('%s*' % prefix)]
-        return [item for item in items if item]
+        if self.find_script is None:
+            self.find_script = self.redis.register_script(FIND_SCRIPT)
+        values = self.find_script(keys=[self.index_prefix + prefix],
+                                  args=[time.time()])
+        return count_lookup(prefix, [json.loads(value) for value in values
+                                     if value is not None])
@@ -1,19 +1,36 @@
 #! /bin/bash
 
 export DEBIAN_FRONTEND=noninteractive
+export FLEETING_OUTPUT_DIR=`pwd`/output
 
+mkdir -p output
+: > "$FLEETING_OUTPUT_DIR/{{PHASES_FILE}}"
+
+# Records the start of a bootstrap phase as a "<unix time> <name>" line,
+# which fleeting collects once the instance is ready.
+fleeting_phase() {
+  echo "`date +%s` $1" >> "$FLEETING_OUTPUT_DIR/{{PHASES_FILE}}"
+}
+export -f fleeting_phase
+
+{% if not BAKED %}
+fleeting_phase packages
 apt-get -q -y update
+fleeting_phase pip
 apt-get -q -y install python-pip
 pip install webob==1.2.3
+{% endif %}
 
 cat << "AUTHSERVER_EOF" > authserver.py
+import os
 import sys
 from base64 import b64encode
 from wsgiref.simple_server import make_server
 
 from webob.static import DirectoryApp
+from webob import Response
 from webob.dec import wsgify
-from webob.exc import HTTPUnauthorized
+from webob.exc import HTTPUnauthorized, HTTPConflict, HTTPForbidden
 
 if __name__ == '__main__':
     if len(sys.argv) < 4:
@@ -26,10 +43,42 @@ if __name__ == '__main__':
     b64_creds = b64encode(creds)
 
     dirapp = DirectoryApp(dirname)
+    claim_secret = os.environ.get('FLEETING_CLAIM_SECRET', '')
+
+    # Compares in constant time; hmac.compare_digest is too new to rely on.
+    def is_claim_secret(value):
+        if not claim_secret or len(value) != len(claim_secret):
+            return False
+        result = 0
+        for x, y in zip(value, claim_secret):
+            result |= ord(x) ^ ord(y)
+        return result == 0
+
+    # A warm instance is claimed by uploading its branch-specific steps.
+    # The lock file is never removed, so only the first upload is
+    # accepted, and the steps only appear once they're fully written.
+    def claim(req):
+        filename = os.path.join(dirname, 'branch-steps')
+        try:
+            fd = os.open(filename + '.lock', os.O_WRONLY | os.O_CREAT |
+                         os.O_EXCL)
+        except OSError:
+            return HTTPConflict()
+        os.close(fd)
+        f = open(filename + '.tmp', 'w')
+        f.write(req.body)
+        f.close()
+        os.rename(filename + '.tmp', filename)
+        return Response(status=201)
 
     @wsgify
     def password_protected_app(req):
         if req.authorization == ('Basic', b64_creds):
+            if req.method == 'PUT' and req.path_info == '/branch-steps':
+                if not is_claim_secret(req.headers.get('{{CLAIM_HEADER}}',
+                                                       '')):
+                    return HTTPForbidden()
+                return claim(req)
             return dirapp
 
         response = HTTPUnauthorized()
@@ -40,12 +89,18 @@ if __name__ == '__main__':
     httpd.serve_forever()
 AUTHSERVER_EOF
 
-mkdir output
-python authserver.py {{AUTHSERVER_PORT}} output {{AUTHSERVER_CREDS}} &
+FLEETING_CLAIM_SECRET='{{CLAIM_SECRET}}' \
+  python authserver.py {{AUTHSERVER_PORT}} output {{AUTHSERVER_CREDS}} &
 
 cat << "STARTPROJECT_EOF" > startproject
 {{STARTPROJECT_SCRIPT}}
 STARTPROJECT_EOF
 
 chmod +x startproject
+{{READY_CALLBACK_SCRIPT}}
+fleeting_phase project
 ./startproject > output/{{AUTHSERVER_LOGFILE}} 2>&1
+{% if BAKING %}
+# Tells fleeting the image is ready to be made, or why it isn't.
+echo $? > output/{{BAKE_STATUS_FILE}}
+{% endif %}
@@ -0,0 +1,57 @@
+import math
+
+PHASES_FILE = 'phases.txt'
+RETENTION = 30 * 86400
+PERCENTILES = [50, 90]
+
+def parse_markers(content):
+    markers = []
+    for line in content.splitlines():
+        parts = line.split(None, 1)
+        try:
+            markers.append((int(parts[0]), parts[1].strip()))
+        except (IndexError, ValueError):
+            continue
+    return sorted(markers, key=lambda marker: marker[0])
+
+def get_phases(start, markers, ready, first='boot'):
+    # Each phase lasts until the next one begins, and the last one until
+    # fleeting noticed the instance was ready.
+    starts = [(start, first)] + markers
+    phases = []
+    for i, (begun, name) in enumerate(starts):
+        if i + 1 < len(starts):
+            ended = starts[i + 1][0]
+        else:
+            ended = ready
+        phases.append((name, max(ended - begun, 0)))
+    return phases
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = int(math.ceil(pct / 100.0 * len(values))) - 1
+    return values[max(index, 0)]
+
+def summarize(records):
+    names = []
+    durations = {'total': []}
+    for record in records:
+        totals = {}
+        for name, seconds in record['phases']:
+            if name not in durations:
+                names.append(name)
+                durations[name] = []
+            totals[name] = totals.get(name, 0) + seconds
+        for name, seconds in totals.items():
+            durations[name].append(seconds)
+        durations['total'].append(record['ready'] - record['start'])
+    summary = []
+    for name in names + ['total']:
+        values = durations[name]
+        if not values:
+            continue
+        row = dict(phase=name, count=len(values), max=max(values))
+        for pct in PERCENTILES:
+            row['p%d' % pct] = percentile(values, pct)
+        summary.append(row)
+    return summary
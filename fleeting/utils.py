@@ -1,5 +1,7 @@
 import os
+import logging
 from urllib import quote
+from threading import Thread, Event
 
 ROOT = os.path.dirname(os.path.abspath(__file__))
 
@@ -37,3 +39,35 @@ def force_preferred_url_scheme(app, originating_scheme_header=None):
         return wsgi_app(environ, start_response)
 
     app.wsgi_app = force_preferred_url_scheme_middleware
+
+class PeriodicTask(object):
+    def __init__(self, func, interval, kwargs=None, logger=logging):
+        self.func = func
+        self.interval = interval
+        self.kwargs = kwargs or {}
+        self.logger = logger
+        self.stopped = Event()
+        self.thread = None
+
+    def run_once(self):
+        try:
+            self.func(**self.kwargs)
+        except Exception:
+            self.logger.exception('periodic task %s failed' %
+                                  self.func.__name__)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.run_once()
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 import pkg_resources
 
 ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -26,7 +27,7 @@ import httplib2
 from urlparse import urljoin
 from threading import Thread
 
-from fleeting import app, Project
+from fleeting import app, Project, project, tempcache, timings, profiling
 
 class TestHttpServer(object):
     def __init__(self, port):
@@ -71,6 +72,14 @@ def import_env():
             value = value.strip()
             os.environ[var] = value
 
+def use_redis_cache():
+    # Shares the server's cache, as fleeting.production does, so that
+    # commands see the timings and instance state it has recorded.
+    redis_url = os.environ.get('REDIS_URL', os.environ.get('REDISTOGO_URL'))
+    if redis_url:
+        project.cache = tempcache.RedisTempCache(project.DEFAULT_CACHE_TTL,
+                                                 url=redis_url)
+
 def cmd_shell(args):
     "Run interactive python shell."
 
@@ -83,6 +92,7 @@ def cmd_runserver(args):
         SECRET_KEY='development',
         SERVER_NAME='localhost:5000'
     )
+    project.claim_key = 'development'
     app.run(debug=True)
 
 def cmd_test(args):
@@ -114,6 +124,83 @@ def cmd_test(args):
         print "All tests succeeded with 100% code coverage."
     raise SystemExit(errno)
 
+def cmd_bench(args):
+    "Benchmark fleet operations against a fake AWS backend."
+
+    # Imported here so other commands don't load the benchmark harness.
+    from benchmarks import fleet
+
+    latency = fleet.DEFAULT_LATENCY if args.latency is None else args.latency
+    filename = args.baselines or fleet.BASELINES
+    baselines = None
+    if not args.save:
+        baselines = fleet.load_baselines(filename)
+    results, regressions = fleet.run(sizes=args.sizes or fleet.SIZES,
+                                     latency=latency,
+                                     repeat=args.repeat or fleet.REPEAT,
+                                     baselines=baselines,
+                                     tolerance=args.tolerance,
+                                     out=sys.stdout)
+    if args.save:
+        fleet.save_baselines(results, latency, filename)
+        print "Baselines saved to %s." % filename
+    elif regressions:
+        print "%d regression(s) found." % len(regressions)
+        raise SystemExit(1)
+
+def cmd_profile(parser):
+    "Profile requests and summarize the results."
+
+    def cmd_header(args):
+        "Print a profiling header that is valid for an hour."
+
+        print '%s: %s' % (profiling.HEADER,
+                          profiling.make_header_value(os.environ['SECRET_KEY']))
+
+    def cmd_summary(args):
+        "Summarize profile dumps."
+
+        dumps = profiling.load_dumps(args.dir, args.endpoint)
+        if not dumps:
+            print "No profile dumps found in %s." % args.dir
+            return
+        print "%-32s %6s %10s %10s %10s %10s" % (
+            'endpoint', 'count', 'median ms', 'max ms', 'max cpu', 'max rss'
+        )
+        for row in profiling.summarize(dumps):
+            print "%-32s %6d %10d %10d %10d %8dkB" % (
+                row['endpoint'], row['count'], row['median_wall_ms'],
+                row['max_wall_ms'], row['max_cpu_ms'],
+                row['max_maxrss_growth_kb']
+            )
+        print
+        slowest = max(dumps, key=lambda info: info['wall_ms'])
+        print "Slowest request was %s %s (%dms); its object growth:" % (
+            slowest['method'], slowest['path'], slowest['wall_ms']
+        )
+        for name, count in slowest['object_growth']:
+            print "  %-30s %+d" % (name, count)
+        print
+        stats = profiling.merge_stats(dumps, stream=sys.stdout)
+        stats.sort_stats(args.sort).print_stats(args.limit)
+
+    subparsers = parser.add_subparsers()
+
+    header = subparsers.add_parser('header', help=cmd_header.__doc__)
+    header.set_defaults(func=cmd_header)
+
+    summary = subparsers.add_parser('summary', help=cmd_summary.__doc__)
+    summary.add_argument('--dir', '-d', help='directory of profile dumps',
+                         default=os.environ.get('PROFILE_DIR', 'profiles'))
+    summary.add_argument('--endpoint', '-e',
+                         help='only include this endpoint, e.g. '
+                              'project.project_list')
+    summary.add_argument('--sort', '-s', default='cumulative',
+                         help='pstats sort key (default is cumulative)')
+    summary.add_argument('--limit', '-l', type=int, default=25,
+                         help='number of functions to list')
+    summary.set_defaults(func=cmd_summary)
+
 def cmd_project(parser):
     "Manage EC2 instances."
 
@@ -135,14 +222,47 @@ def cmd_project(parser):
     def cmd_cleanup(args):
         "Cleanup unneeded autoscale groups and launch configs."
 
-        deleted, errors = args.project.cleanup_instances()
-        print "%d object(s) deleted, %d errors." % (deleted, errors)
+        s = args.project.cleanup_instances()
+        print "%d object(s) deleted, %d errors." % (s['deleted'], s['errors'])
+        print "%d api call(s), %.2fs lookup, %.2fs delete." % (
+            s['api_calls'], s['lookup_time'], s['delete_time']
+        )
 
     def cmd_list(args):
         "List EC2 instances."
 
         for inst in args.project.get_instances():
-            print repr(inst)
+            if args.json:
+                print json.dumps(inst, sort_keys=True)
+            else:
+                print repr(inst)
+
+    def cmd_bake(args):
+        "Bake the branch-independent setup into an EC2 image."
+
+        if args.check:
+            print args.project.get_bake_version(),
+            print args.project.get_baked_image_id()
+            return
+        print args.project.bake_image(
+            key_name=args.key_name,
+            security_groups=[args.security_group]
+        )
+
+    def cmd_timings(args):
+        "Show how long each bootstrap phase takes to reach readiness."
+
+        summary = timings.summarize(args.project.get_timings())
+        if args.json:
+            print json.dumps(summary, sort_keys=True)
+            return
+        print "%-16s %6s %8s %8s %8s" % ('phase', 'count', 'p50', 'p90',
+                                         'max')
+        for row in summary:
+            print "%-16s %6d %7ds %7ds %7ds" % (
+                row['phase'], row['count'], row['p50'], row['p90'],
+                row['max']
+            )
 
     def cmd_create(args):
         "Create an EC2 instance."
@@ -174,12 +294,29 @@ def cmd_project(parser):
                                                'default'))
     create.set_defaults(func=cmd_create)
 
+    bake = subparsers.add_parser('bake', help=cmd_bake.__doc__)
+    bake.add_argument('--check', default=False, action='store_true',
+                      help='show the bake version and its image, if any')
+    bake.add_argument('--key-name', '-k', help='aws crypto key to use',
+                      default=os.environ.get('AWS_KEY_NAME'))
+    bake.add_argument('--security-group', '-s', help='security group name',
+                      default=os.environ.get('AWS_SECURITY_GROUP',
+                                             'default'))
+    bake.set_defaults(func=cmd_bake)
+
     cleanup = subparsers.add_parser('cleanup', help=cmd_cleanup.__doc__)
     cleanup.set_defaults(func=cmd_cleanup)
 
     lister = subparsers.add_parser('list', help=cmd_list.__doc__)
+    lister.add_argument('--json', default=False, action='store_true',
+                        help='print one JSON object per instance')
     lister.set_defaults(func=cmd_list)
 
+    timings_cmd = subparsers.add_parser('timings', help=cmd_timings.__doc__)
+    timings_cmd.add_argument('--json', default=False, action='store_true',
+                             help='print the summary as JSON')
+    timings_cmd.set_defaults(func=cmd_timings)
+
     destroy = subparsers.add_parser('destroy', help=cmd_destroy.__doc__)
     destroy.add_argument('slug', help='unique slug id to destroy')
     destroy.set_defaults(func=cmd_destroy)
@@ -209,11 +346,31 @@ def main():
     shell = subparsers.add_parser('shell', help=cmd_shell.__doc__)
     shell.set_defaults(func=cmd_shell)
 
+    bench = subparsers.add_parser('bench', help=cmd_bench.__doc__)
+    bench.add_argument('--sizes', type=int, nargs='+',
+                       help='fleet sizes to benchmark (default 10 100 1000)')
+    bench.add_argument('--latency', type=float,
+                       help='simulated seconds per AWS call (default 0.01)')
+    bench.add_argument('--repeat', type=int,
+                       help='runs per measurement; the fastest is kept '
+                            '(default 3)')
+    bench.add_argument('--tolerance', type=float, default=0.5,
+                       help='allowed wall time increase over the baseline, '
+                            'as a fraction (default 0.5)')
+    bench.add_argument('--baselines',
+                       help='file baselines are compared against (default '
+                            'benchmarks/baselines.json)')
+    bench.add_argument('--save', default=False, action='store_true',
+                       help='save the results as the new baselines')
+    bench.set_defaults(func=cmd_bench)
+
     cmd_project(subparsers.add_parser('project', help=cmd_project.__doc__))
+    cmd_profile(subparsers.add_parser('profile', help=cmd_profile.__doc__))
 
     args = parser.parse_args()
 
     if 'project' in args:
+        use_redis_cache()
         args.project = Project(args.project)
 
     args.func(args)
@@ -1,5 +1,8 @@
 import os
+import sys
+import shutil
 import rfc822
+import tempfile
 import json
 import unittest
 import logging
@@ -10,6 +13,7 @@ import mock
 
 import fleeting
 import fleeting.csrf
+from fleeting import httpclient, events, metrics, profiling
 from .test_project import create_mock_http_response
 
 ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -53,6 +57,7 @@ def load_message(filename):
 class AppTests(unittest.TestCase):
     def setUp(self):
         self.app = fleeting.app.test_client()
+        httpclient.client = httpclient.HttpClient()
  
     def login(self, email):
         self.app.get('/csrf')
@@ -108,27 +113,14 @@ class AppTests(unittest.TestCase):
         rv = self.app.post('/openbadges/destroy', data=postdata())
         self.assertEqual(rv.status, '401 UNAUTHORIZED')
 
-    @mock.patch('fleeting.Thread')
-    def test_update_works_with_termination_notification(self, Thread):
+    @mock.patch('fleeting.jobs.enqueue_later')
+    def test_update_works_with_termination_notification(self, enqueue_later):
         headers, body = load_message(path('termination.txt'))
         rv = self.app.post('/update', headers=headers, data=body)
         self.assertEqual(rv.status, '200 OK')
         self.assertEqual('updated', rv.data)
-        self.assertEqual(Thread.call_count, 1)
-        self.assertEqual(Thread.call_args[1]['kwargs'], {
-            'logger': fleeting.app.logger
-        })
-        Thread.return_value.run.assert_called_once_with()
-        target = Thread.call_args[1]['target']
-        project = target.wrapped.__self__
-        self.assertTrue(isinstance(project, fleeting.Project))
-        self.assertEqual(project.id, 'openbadges')
-        target.wrapped = mock.MagicMock()
-
-        with mock.patch('time.sleep') as sleep:
-            target(logger=fleeting.app.logger)
-            sleep.assert_called_once_with(15)
-            target.wrapped.assert_called_once_with(logger=fleeting.app.logger)
+        enqueue_later.assert_called_once_with('cleanup_instances',
+                                              'openbadges', {}, 15)
 
     @mock.patch('httplib2.Http')
     def test_update_works_with_subscription_confirmation(self, http):
@@ -140,90 +132,142 @@ class AppTests(unittest.TestCase):
         http.assert_called_once_with(disable_ssl_certificate_validation=True,
                                      timeout=3)
         http.return_value.request.assert_called_once_with(
-            json.loads(body)['SubscribeURL']
+            json.loads(body)['SubscribeURL'], method='GET', headers={}
         )
 
-    @mock.patch('fleeting.Project')
-    def test_log_returns_404(self, Project):
-        get = Project.return_value.get_instance
+    @mock.patch('fleeting.get_project')
+    def test_log_returns_404(self, get_project):
+        get = get_project.return_value.get_instance
         get.return_value = None
         self.login('meh@goo.org')
         rv = self.app.get('/openbadges/foo/log')
         get.assert_called_once_with('foo')
         self.assertEqual(rv.status, '404 NOT FOUND')
 
-    @mock.patch('fleeting.Project')
-    def test_log_returns_text(self, Project):
-        Project.return_value.get_instance_log.return_value = "BLARGH"
+    @mock.patch('fleeting.get_project')
+    def test_log_returns_text(self, get_project):
+        get_project.return_value.get_instance_log.return_value = "BLARGH"
         self.login('meh@goo.org')
         rv = self.app.get('/openbadges/foo/log')
-        Project.return_value.get_instance.assert_called_once_with('foo')
+        get_project.return_value.get_instance.assert_called_once_with('foo')
         self.assertEqual(rv.status, '200 OK')
         self.assertEqual(rv.data, 'BLARGH')
-        self.assertEqual(rv.headers['content-type'], 'text/plain')
+        self.assertEqual(rv.headers['content-type'],
+                         'text/plain; charset=utf-8')
 
-    @mock.patch('fleeting.Project')
-    def test_live_log_returns_text(self, Project):
-        Project.return_value.get_instance_authserver_log.return_value = "BL"
+    @mock.patch('fleeting.get_project')
+    def test_live_log_returns_text(self, get_project):
+        get_project.return_value.get_instance_authserver_log.return_value = "BL"
         self.login('meh@goo.org')
         rv = self.app.get('/openbadges/foo/live-log')
-        Project.return_value.get_instance.assert_called_once_with('foo')
+        get_project.return_value.get_instance.assert_called_once_with('foo')
         self.assertEqual(rv.status, '200 OK')
         self.assertEqual(rv.data, 'BL')
         self.assertEqual(rv.headers['content-type'], 'text/plain')
+        self.assertEqual(rv.headers['x-log-offset'], '2')
+        get_log = get_project.return_value.get_instance_authserver_log
+        get_log.assert_called_once_with(
+            get_project.return_value.get_instance.return_value, 0
+        )
+
+    @mock.patch('fleeting.get_project')
+    def test_live_log_returns_bytes_after_offset(self, get_project):
+        get_log = get_project.return_value.get_instance_authserver_log
+        get_log.return_value = "new"
+        self.login('meh@goo.org')
+        rv = self.app.get('/openbadges/foo/live-log?offset=100')
+        get_log.assert_called_once_with(
+            get_project.return_value.get_instance.return_value, 100
+        )
+        self.assertEqual(rv.data, 'new')
+        self.assertEqual(rv.headers['x-log-offset'], '103')
+
+    @mock.patch('fleeting.get_project')
+    def test_live_log_rejects_bad_offsets(self, get_project):
+        self.login('meh@goo.org')
+        rv = self.app.get('/openbadges/foo/live-log?offset=lol')
+        self.assertEqual(rv.status, '400 BAD REQUEST')
 
-    @mock.patch('fleeting.Project')
+    @mock.patch('fleeting.get_project')
     @mock.patch('fleeting.flash')
-    def test_project_destroy_instance_works(self, flash, Project):
-        Project.return_value.id = 'openbadges'
+    def test_project_destroy_instance_works(self, flash, get_project):
+        get_project.return_value.id = 'openbadges'
         self.login('meh@goo.org')
         rv = self.app.post('/openbadges/destroy', data=postdata(slug='bu'))
         self.assertEqual(rv.status, '302 FOUND')
         self.assertEqual(rv.headers['location'], 'http://foo.org/openbadges/')
-        Project.return_value.destroy_instance.assert_called_once_with('bu')
+        get_project.return_value.destroy_instance.assert_called_once_with('bu')
         self.assertTrue('<strong>bu</strong>' in flash.call_args[0][0])
 
-    @mock.patch('fleeting.Project')
+    @mock.patch('fleeting.jobs.enqueue')
     @mock.patch('fleeting.flash')
     @mock.patch('time.time', lambda: 12.3)
     @mock.patch('os.environ', dict(
         AWS_KEY_NAME='keyname',
         AWS_SECURITY_GROUP='secgroup'
     ))
-    def flash_from_project_create_instance(self, rv, flash, Project):
-        Project.return_value.id = 'openbadges'
-        Project.return_value.create_instance.return_value = rv
+    def test_project_create_instance_enqueues_job(self, flash, enqueue):
+        enqueue.return_value = 'jobby'
         self.login('meh@goo.org')
         rv = self.app.post('/openbadges/create', data=postdata(
             user='uzer',
             branch='branchu'
         ))
-        Project.return_value.create_instance.assert_called_once_with(
+        enqueue.assert_called_once_with('create_instance', 'openbadges', dict(
             key_name='keyname',
             git_branch=u'branchu',
             git_user=u'uzer',
             notify_topic=None,
             slug=u'uzer.branchu-12',
-            security_groups=['secgroup']
-        )
+            security_groups=['secgroup'],
+            ready_callback='http://foo.org/openbadges/ready-callback'
+                           '?slug=uzer.branchu-12&signature=%s' %
+                           fleeting.get_ready_signature('openbadges',
+                                                        'uzer.branchu-12')
+        ))
         self.assertEqual(rv.status, '302 FOUND')
         self.assertEqual(rv.headers['location'], 'http://foo.org/openbadges/')
-        return flash.call_args
-
-    def test_project_create_instance_reports_success(self):
-        args, _ = self.flash_from_project_create_instance('DONE')
+        self.assertEqual(rv.headers['x-job-id'], 'jobby')
+        args = flash.call_args[0]
         self.assertTrue('<strong>uzer.branchu-12</strong>' in args[0])
+        self.assertTrue('href="jobs/jobby"' in args[0])
         self.assertEqual(args[1], 'success')
 
-    def test_project_create_instance_reports_invalid_git_info(self):
-        args, _ = self.flash_from_project_create_instance('INVALID_GIT_INFO')
-        self.assertTrue('git' in args[0])
-        self.assertEqual(args[1], 'error')
+    @mock.patch('fleeting.jobs.get_job')
+    def test_view_job_works(self, get_job):
+        get_job.return_value = dict(id='jobby', project='openbadges',
+                                    state='done', params=dict(slug='s'))
+        rv = self.app.get('/openbadges/jobs/jobby')
+        get_job.assert_called_once_with('jobby')
+        self.assertEqual(rv.status, '200 OK')
+        self.assertEqual(rv.headers['content-type'], 'application/json')
+        self.assertEqual(json.loads(rv.data), dict(
+            id='jobby',
+            project='openbadges',
+            state='done',
+            slug='s'
+        ))
 
-    def test_project_create_instance_reports_unknown_error(self):
-        args, _ = self.flash_from_project_create_instance('BLARGLE')
-        self.assertTrue('unknown' in args[0])
-        self.assertEqual(args[1], 'error')
+    @mock.patch('fleeting.jobs.get_job')
+    def test_view_job_works_without_slug(self, get_job):
+        get_job.return_value = dict(id='jobby', project='openbadges',
+                                    kind='cleanup_instances', params={})
+        rv = self.app.get('/openbadges/jobs/jobby')
+        self.assertEqual(rv.status, '200 OK')
+        self.assertEqual(json.loads(rv.data)['slug'], None)
+
+    @mock.patch('fleeting.jobs.get_job')
+    def test_view_job_returns_404(self, get_job):
+        get_job.return_value = None
+        rv = self.app.get('/openbadges/jobs/jobby')
+        self.assertEqual(rv.status, '404 NOT FOUND')
+
+    @mock.patch('fleeting.jobs.get_job')
+    def test_view_job_returns_404_for_other_projects(self, get_job):
+        get_job.return_value = dict(id='jobby', project='butter',
+                                    params=dict(slug='s'))
+        rv = self.app.get('/openbadges/jobs/jobby')
+        self.assertEqual(rv.status, '404 NOT FOUND')
 
     @mock.patch('fleeting.render_project_template')
     def test_project_list_works(self, render_project_template):
@@ -232,20 +276,392 @@ class AppTests(unittest.TestCase):
         render_project_template.assert_called_once_with('project-list.html')
         self.assertEqual(rv.status, '200 OK')
 
-    @mock.patch('fleeting.Project')
-    @mock.patch('fleeting.Thread')
-    def test_project_index_works(self, Thread, Project):
-        Project.return_value.get_instances.return_value = [{
+    @mock.patch('fleeting.get_project')
+    @mock.patch('fleeting.readiness_prober')
+    def test_project_index_works(self, prober, get_project):
+        get_project.return_value.get_instances_version.return_value = None
+        get_project.return_value.get_instances.return_value = [{
             'state': 'running',
             'slug': 'meh'
+        }, {
+            'state': 'running',
+            'slug': 'ready',
+            'url': 'http://ready/'
         }]
         rv = self.app.get('/openbadges/')
-        Thread.assert_called_once_with(
-            target=Project.return_value.get_instance_status,
-            kwargs={'slug': 'meh'}
-        )
-        Thread.return_value.run.assert_called_once_with()
+        prober.track.assert_called_once_with(get_project.return_value, 'meh',
+                                            callback=False)
+        self.assertEqual(rv.status, '200 OK')
+
+    @mock.patch('fleeting.github.prefetch_forks')
+    @mock.patch('fleeting.get_project')
+    def test_project_index_prefetches_forks_when_logged_in(self, get_project,
+                                                            prefetch_forks):
+        get_project.return_value.get_instances.return_value = []
+        get_project.return_value.meta = {'repo': 'mozilla/openbadges'}
+        get_project.return_value.get_instances_version.return_value = None
+        self.app.get('/openbadges/')
+        self.assertEqual(prefetch_forks.call_count, 0)
+        self.login('meh@goo.org')
+        self.app.get('/openbadges/')
+        prefetch_forks.assert_called_once_with('mozilla/openbadges')
+
+    @mock.patch('fleeting.get_project')
+    def test_project_timings_works(self, get_project):
+        get_project.return_value.meta = {'name': 'Open Badges'}
+        get_project.return_value.get_timings.return_value = [
+            dict(slug='old', start=0, ready=600, phases=[('boot', 600)]),
+            dict(slug='new', start=0, ready=95, phases=[('boot', 30),
+                                                        ('install', 65)])
+        ]
+        rv = self.app.get('/openbadges/timings')
+        self.assertEqual(rv.status, '200 OK')
+        self.assertTrue('install 1:05' in rv.data)
+        self.assertTrue(rv.data.index('new') < rv.data.index('old'))
+
+    @mock.patch('fleeting.get_project')
+    def test_project_timings_works_without_timings(self, get_project):
+        get_project.return_value.meta = {'name': 'Open Badges'}
+        get_project.return_value.get_timings.return_value = []
+        rv = self.app.get('/openbadges/timings')
+        self.assertTrue('No instances have been timed yet' in rv.data)
+
+    @mock.patch('fleeting.metrics.store', metrics.LocalMetrics())
+    def test_metrics_works(self):
+        self.app.get('/metrics')
+        rv = self.app.get('/metrics')
+        self.assertEqual(rv.status, '200 OK')
+        self.assertEqual(rv.headers['content-type'], metrics.CONTENT_TYPE)
+        self.assertTrue('# TYPE fleeting_request_seconds histogram\n'
+                        in rv.data)
+        self.assertTrue('fleeting_request_seconds_count{endpoint='
+                        '"view_metrics",method="GET",status="200"} 1\n'
+                        in rv.data)
+
+    @mock.patch('fleeting.metrics.store', metrics.LocalMetrics())
+    def test_unrouted_requests_are_not_measured(self):
+        self.app.get('/nonexistent/path/here/really')
+        self.assertEqual(metrics.store.snapshot(), {})
+
+    @mock.patch('fleeting.profiling.RequestProfile')
+    def test_requests_are_not_profiled_by_default(self, RequestProfile):
+        self.app.get('/metrics')
+        self.assertFalse(RequestProfile.called)
+
+    @mock.patch('fleeting.profiling.directory', '/tmp/profiles')
+    @mock.patch('fleeting.profiling.RequestProfile')
+    def test_requests_with_profile_header_are_profiled(self, RequestProfile):
+        profile = RequestProfile.return_value.start.return_value
+        profile.stop.return_value = '/tmp/profiles/blah'
+        value = profiling.make_header_value(fleeting.app.secret_key)
+        rv = self.app.get('/metrics', headers={profiling.HEADER: value})
+        self.assertEqual(rv.status, '200 OK')
+        profile.stop.assert_called_once_with('view_metrics', 'GET',
+                                             '/metrics', 200)
+
+    # In debug mode the failed request's context, and so its teardown, is
+    # kept around until the next request.
+    @mock.patch.dict(fleeting.app.config,
+                     PRESERVE_CONTEXT_ON_EXCEPTION=False)
+    @mock.patch('fleeting.metrics.render')
+    def test_profiling_stops_when_views_raise(self, render):
+        render.side_effect = Exception('kaboom')
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with mock.patch('fleeting.profiling.directory', tmpdir):
+                value = profiling.make_header_value(fleeting.app.secret_key)
+                self.assertRaises(Exception, self.app.get, '/metrics',
+                                  headers={profiling.HEADER: value})
+                self.assertEqual(sys.getprofile(), None)
+                dumps = profiling.load_dumps(tmpdir)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual([d['status'] for d in dumps], [500])
+
+    @mock.patch('fleeting.profiling.directory', '/tmp/profiles')
+    @mock.patch('fleeting.profiling.RequestProfile')
+    def test_requests_with_bad_profile_header_are_not_profiled(self,
+                                                              RequestProfile):
+        self.app.get('/metrics', headers={profiling.HEADER: '9999999999:x'})
+        self.assertFalse(RequestProfile.called)
+
+    def test_get_ready_signature_depends_on_instance(self):
+        sig = fleeting.get_ready_signature('openbadges', 'a')
+        self.assertEqual(len(sig), 40)
+        self.assertNotEqual(sig, fleeting.get_ready_signature('openbadges',
+                                                              'b'))
+        self.assertNotEqual(sig, fleeting.get_ready_signature('butter', 'a'))
+
+    @mock.patch('fleeting.get_project')
+    def test_ready_callback_marks_instance_ready(self, get_project):
+        proj = get_project.return_value
+        proj.id = 'openbadges'
+        proj.mark_ready.return_value = 'http://a.org:8888/'
+        rv = self.app.post('/openbadges/ready-callback?slug=a&signature=%s' %
+                           fleeting.get_ready_signature('openbadges', 'a'))
+        self.assertEqual(rv.status, '200 OK')
+        self.assertEqual(json.loads(rv.data),
+                         dict(slug='a', url='http://a.org:8888/'))
+        proj.get_instance.assert_called_once_with('a')
+        proj.mark_ready.assert_called_once_with('a',
+                                                proj.get_instance.return_value)
+
+    @mock.patch('fleeting.get_project')
+    def test_ready_callback_rejects_bad_signatures(self, get_project):
+        get_project.return_value.id = 'openbadges'
+        sig = fleeting.get_ready_signature('openbadges', 'a')
+        for query in ['slug=b&signature=%s' % sig, 'slug=a']:
+            rv = self.app.post('/openbadges/ready-callback?' + query)
+            self.assertEqual(rv.status, '403 FORBIDDEN')
+        self.assertEqual(get_project.return_value.get_instance.call_count, 0)
+
+    @mock.patch('fleeting.get_project')
+    def test_ready_callback_returns_404_for_missing_instances(self,
+                                                              get_project):
+        get_project.return_value.id = 'openbadges'
+        get_project.return_value.get_instance.return_value = None
+        rv = self.app.post('/openbadges/ready-callback?slug=a&signature=%s' %
+                           fleeting.get_ready_signature('openbadges', 'a'))
+        self.assertEqual(rv.status, '404 NOT FOUND')
+
+    def test_github_forks_requires_login(self):
+        rv = self.app.get('/openbadges/github/forks')
+        self.assertEqual(rv.status, '401 UNAUTHORIZED')
+
+    @mock.patch('fleeting.github.get_forks')
+    def test_github_forks_works(self, get_forks):
+        get_forks.return_value = ['toolness']
+        self.login('meh@goo.org')
+        rv = self.app.get('/openbadges/github/forks')
+        get_forks.assert_called_once_with('mozilla/openbadges')
+        self.assertEqual(rv.headers['content-type'], 'application/json')
+        self.assertEqual(json.loads(rv.data), dict(names=['toolness']))
+
+    @mock.patch('fleeting.github.get_branches')
+    def test_github_branches_works(self, get_branches):
+        get_branches.return_value = ['master']
+        self.login('meh@goo.org')
+        rv = self.app.get('/openbadges/github/branches/toolness')
+        get_branches.assert_called_once_with('toolness', 'mozilla/openbadges')
+        self.assertEqual(json.loads(rv.data), dict(names=['master']))
+
+    @mock.patch('fleeting.github.get_forks')
+    def test_github_failures_return_502(self, get_forks):
+        get_forks.side_effect = Exception('rate limited')
+        self.login('meh@goo.org')
+        rv = self.app.get('/openbadges/github/forks')
+        self.assertEqual(rv.status, '502 BAD GATEWAY')
+
+    @mock.patch('fleeting.get_project')
+    def test_project_list_returns_304_when_unchanged(self, get_project):
+        proj = get_project.return_value
+        proj.get_instances_version.return_value = 'v1'
+        proj.get_instances.return_value = []
+        rv = self.app.get('/openbadges/list')
         self.assertEqual(rv.status, '200 OK')
+        self.assertEqual(rv.headers['cache-control'], 'private, no-cache')
+        etag = rv.headers['etag']
+
+        rv = self.app.get('/openbadges/list',
+                          headers={'If-None-Match': etag})
+        self.assertEqual(rv.status, '304 NOT MODIFIED')
+        self.assertEqual(rv.headers['etag'], etag)
+        self.assertEqual(proj.get_instances.call_count, 1)
+
+        proj.get_instances_version.return_value = 'v2'
+        rv = self.app.get('/openbadges/list',
+                          headers={'If-None-Match': etag})
+        self.assertEqual(rv.status, '200 OK')
+        self.assertNotEqual(rv.headers['etag'], etag)
+
+    @mock.patch('fleeting.get_project')
+    def test_project_page_etag_depends_on_session(self, get_project):
+        proj = get_project.return_value
+        proj.get_instances_version.return_value = 'v1'
+        proj.get_instances.return_value = []
+        etag = self.app.get('/openbadges/list').headers['etag']
+        self.login('meh@goo.org')
+        rv = self.app.get('/openbadges/list',
+                          headers={'If-None-Match': etag})
+        self.assertEqual(rv.status, '200 OK')
+
+    @mock.patch('fleeting.get_project')
+    def test_project_page_has_no_etag_without_inventory(self, get_project):
+        get_project.return_value.get_instances_version.return_value = None
+        get_project.return_value.get_instances.return_value = []
+        rv = self.app.get('/openbadges/list')
+        self.assertTrue('etag' not in rv.headers)
+
+    @mock.patch('fleeting.get_project')
+    def test_project_page_has_no_etag_with_pending_flashes(self,
+                                                           get_project):
+        get_project.return_value.get_instances_version.return_value = 'v1'
+        get_project.return_value.get_instances.return_value = []
+        with self.app.session_transaction() as sess:
+            sess['_flashes'] = [('info', 'hi')]
+        rv = self.app.get('/openbadges/')
+        self.assertTrue('etag' not in rv.headers)
+        self.assertTrue('hi' in rv.data)
+
+    @mock.patch('fleeting.readiness_prober')
+    @mock.patch('fleeting.get_project')
+    def test_project_events_sends_nothing_when_unchanged(self, get_project,
+                                                         prober):
+        proj = get_project.return_value
+        proj.get_instances.return_value = [dict(slug='a', state='pending')]
+        version = events.get_version(events.get_rows(
+            proj.get_instances.return_value
+        ))
+        rv = self.app.get('/openbadges/events?version=%s' % version)
+        self.assertEqual(rv.status, '200 OK')
+        self.assertEqual(rv.headers['content-type'], 'text/event-stream')
+        self.assertEqual(rv.data, 'retry: 15000\n\n')
+
+    @mock.patch('fleeting.get_project')
+    def test_project_events_answers_up_to_date_clients_cheaply(self,
+                                                               get_project):
+        proj = get_project.return_value
+        proj.tag_name = 'fleeting:openbadges'
+        proj.get_instances_version.return_value = 'iv1'
+        version = events.remember(proj, events.get_rows([]), 'iv1')
+        rv = self.app.get('/openbadges/events',
+                          headers={'Last-Event-ID': version})
+        self.assertEqual(rv.data, 'retry: 15000\n\n')
+        self.assertFalse(proj.get_instances.called)
+
+        proj.get_instances_version.return_value = 'iv2'
+        proj.get_instances.return_value = []
+        rv = self.app.get('/openbadges/events',
+                          headers={'Last-Event-ID': version})
+        self.assertEqual(rv.data, 'retry: 15000\n\n')
+        self.assertTrue(proj.get_instances.called)
+        self.assertEqual(events.lookup_version(proj, 'iv2'), version)
+
+    @mock.patch('fleeting.readiness_prober')
+    @mock.patch('fleeting.get_project')
+    def test_project_events_resets_unknown_versions(self, get_project,
+                                                    prober):
+        proj = get_project.return_value
+        proj.get_instances.return_value = [dict(slug='a', state='running')]
+        rv = self.app.get('/openbadges/events?version=lol')
+        version = events.get_version(events.get_rows(
+            proj.get_instances.return_value
+        ))
+        self.assertEqual(rv.data, 'retry: 15000\n\n' + events.format_event(
+            'reset', {}, version
+        ))
+        prober.track.assert_called_once_with(proj, 'a', callback=False)
+
+    @mock.patch('fleeting.readiness_prober')
+    @mock.patch('fleeting.get_project')
+    def test_project_events_sends_changes(self, get_project, prober):
+        proj = get_project.return_value
+        proj.tag_name = 'fleeting:openbadges'
+        proj.get_instances.return_value = [
+            dict(slug='a', state='running', url='http://a/'),
+            dict(slug='c', state='pending')
+        ]
+        old = events.remember(proj, events.get_rows([
+            dict(slug='a', state='running'),
+            dict(slug='b', state='running')
+        ]))
+        rv = self.app.get('/openbadges/events',
+                          headers={'Last-Event-ID': old})
+        chunks = rv.data.split('\n\n')
+        self.assertEqual(chunks[0], 'retry: 15000')
+        names = [chunk.split('\n')[0] for chunk in chunks[1:4]]
+        self.assertEqual(names, ['event: change', 'event: add',
+                                 'event: remove'])
+        change = json.loads(chunks[1].split('data: ')[1])
+        self.assertEqual(change['slug'], 'a')
+        self.assertTrue('data-slug="a"' in change['html'])
+        self.assertTrue('href="http://a/"' in change['html'])
+        self.assertTrue('id: ' not in chunks[1])
+        self.assertTrue('id: ' not in chunks[2])
+        remove = chunks[3].split('\n')
+        self.assertEqual(remove[1], 'id: %s' % events.get_version(
+            events.get_rows(proj.get_instances.return_value)
+        ))
+        self.assertEqual(json.loads(remove[2][6:]), dict(slug='b'))
+
+    def mock_api_instances(self, get_project, instances):
+        get_project.return_value.tag_name = 'fleeting:openbadges'
+        get_project.return_value.get_instances.return_value = instances
+
+    @mock.patch('fleeting.get_project')
+    def test_api_instances_lists_instances(self, get_project):
+        self.mock_api_instances(get_project, [
+            dict(slug='b', state='pending', git_user='u'),
+            dict(slug='a', state='running', url='http://a/')
+        ])
+        rv = self.app.get('/api/v1/openbadges/instances?fields=state,ready')
+        self.assertEqual(rv.headers['content-type'], 'application/json')
+        result = json.loads(rv.data)
+        self.assertEqual(result['instances'], [
+            dict(slug='a', state='running', ready=True),
+            dict(slug='b', state='pending', ready=False)
+        ])
+        self.assertEqual(len(result['version']), 16)
+
+    @mock.patch('fleeting.get_project')
+    def test_api_instances_sends_deltas(self, get_project):
+        self.mock_api_instances(get_project, [
+            dict(slug='a', state='running'),
+            dict(slug='b', state='running')
+        ])
+        rv = self.app.get('/api/v1/openbadges/instances')
+        version = json.loads(rv.data)['version']
+        self.mock_api_instances(get_project, [
+            dict(slug='a', state='running', url='http://a/'),
+            dict(slug='c', state='pending')
+        ])
+        rv = self.app.get('/api/v1/openbadges/instances?fields=ready&'
+                          'since=%s' % version)
+        result = json.loads(rv.data)
+        self.assertEqual(result['since'], version)
+        self.assertNotEqual(result['version'], version)
+        self.assertEqual(result['changed'], [
+            dict(slug='a', ready=True),
+            dict(slug='c', ready=False)
+        ])
+        self.assertEqual(result['removed'], ['b'])
+        self.assertTrue('instances' not in result)
+
+    @mock.patch('fleeting.get_project')
+    def test_api_instances_lists_all_for_unknown_since(self, get_project):
+        self.mock_api_instances(get_project, [dict(slug='a', state='running')])
+        rv = self.app.get('/api/v1/openbadges/instances?since=lol')
+        self.assertEqual(len(json.loads(rv.data)['instances']), 1)
+
+    @mock.patch('fleeting.get_project')
+    def test_api_rejects_unknown_fields(self, get_project):
+        self.mock_api_instances(get_project, [])
+        rv = self.app.get('/api/v1/openbadges/instances?fields=id')
+        self.assertEqual(rv.status, '400 BAD REQUEST')
+
+    @mock.patch('fleeting.get_project')
+    def test_api_instance_works(self, get_project):
+        self.mock_api_instances(get_project, [dict(slug='a', state='running',
+                                                   launch_time='now')])
+        rv = self.app.get('/api/v1/openbadges/instances/a')
+        self.assertEqual(json.loads(rv.data), dict(
+            slug='a', state='running', ready=False, url=None, git_user=None,
+            git_branch=None, git_branch_url=None, launch_time='now'
+        ))
+        rv = self.app.get('/api/v1/openbadges/instances/z')
+        self.assertEqual(rv.status, '404 NOT FOUND')
+
+    @mock.patch('fleeting.get_project')
+    def test_api_instance_ready_works(self, get_project):
+        self.mock_api_instances(get_project, [dict(slug='a', state='running',
+                                                   url='http://a/')])
+        rv = self.app.get('/api/v1/openbadges/instances/a/ready')
+        self.assertEqual(json.loads(rv.data), dict(slug='a', ready=True,
+                                                   url='http://a/'))
+
+    def test_api_returns_404_for_unknown_projects(self):
+        rv = self.app.get('/api/v1/openbadgesuuu/instances')
+        self.assertEqual(rv.status, '404 NOT FOUND')
 
     def test_invalid_project_index_raises_404(self):
         rv = self.app.get('/openbadgesuuuu/')
@@ -0,0 +1,74 @@
+import unittest
+
+import boto
+
+from benchmarks import fakeaws, fleet
+
+class FakeAWSTests(unittest.TestCase):
+    def setUp(self):
+        self.aws = fakeaws.FakeAWS()
+
+    def test_instances_are_filtered_by_tag_and_state(self):
+        self.aws.add_group('g1', 'lc1', {'a': '1'}, instance_state='running')
+        self.aws.add_group('g2', 'lc2', {'b': '1'})
+        reservations = self.aws.ec2.get_all_instances(filters={
+            'tag-key': ['a', 'b'],
+            'instance-state-name': ['running']
+        })
+        self.assertEqual([res.instances[0].tags for res in reservations],
+                         [{'a': '1'}])
+        self.assertEqual(len(self.aws.ec2.get_all_instances(filters={
+            'tag-key': 'b'
+        })), 1)
+        self.assertEqual(self.aws.calls['get_all_instances'], 2)
+
+    def test_unknown_instance_ids_raise(self):
+        self.assertRaises(boto.exception.EC2ResponseError,
+                          self.aws.ec2.get_all_instances, ['i-nope'])
+
+    def test_groups_are_paged(self):
+        for i in range(fakeaws.PAGE_SIZE + 1):
+            self.aws.add_group('g%03d' % i, 'lc%03d' % i, {}, min_size=0)
+        page = self.aws.autoscale.get_all_groups()
+        self.assertEqual(len(page), fakeaws.PAGE_SIZE)
+        rest = self.aws.autoscale.get_all_groups(next_token=page.next_token)
+        self.assertEqual([group.name for group in rest], ['g050'])
+
+    def test_groups_in_use_cannot_be_deleted(self):
+        group = self.aws.add_group('g', 'lc', {})
+        try:
+            group.delete()
+            self.fail('group was deleted')
+        except boto.exception.BotoServerError, e:
+            self.assertEqual(e.code, 'ResourceInUse')
+        lc = self.aws.autoscale.get_all_launch_configurations(names=['lc'])
+        self.assertRaises(boto.exception.BotoServerError, lc[0].delete)
+        group.shutdown_instances()
+        self.assertEqual(self.aws.instances.values()[0].state, 'terminated')
+        group.delete()
+        lc[0].delete()
+        self.assertEqual(self.aws.groups, {})
+        self.assertEqual(self.aws.launch_configs, {})
+
+class FleetBenchmarkTests(unittest.TestCase):
+    def test_run_works(self):
+        results, regressions = fleet.run(sizes=[3], latency=0, repeat=1)
+        self.assertEqual(regressions, [])
+        self.assertEqual(results['get_instances']['3']['calls'], 1)
+        self.assertEqual(results['cleanup_instances']['3']['methods'], dict(
+            get_all_instances=1,
+            get_all_groups=1,
+            get_all_launch_configurations=1,
+            delete_auto_scaling_group=1,
+            delete_launch_configuration=1
+        ))
+
+    def test_compare_flags_more_calls_and_slowdowns(self):
+        baseline = dict(calls=2, seconds=1.0)
+        self.assertEqual(fleet.compare(dict(calls=2, seconds=1.1), baseline,
+                                       0.5), (False, '+10%'))
+        self.assertEqual(fleet.compare(dict(calls=3, seconds=1.0), baseline,
+                                       0.5, same_latency=False),
+                         (True, 'calls 2 -> 3, REGRESSION'))
+        self.assertTrue(fleet.compare(dict(calls=1, seconds=2.0), baseline,
+                                      0.5)[0])
@@ -0,0 +1,56 @@
+import unittest
+
+from fleeting import events, project
+from fleeting.tempcache import DictTempCache
+
+class FakeProject(object):
+    tag_name = 'fleeting:openbadges'
+
+def row(slug, **kwargs):
+    info = dict((field, None) for field in events.ROW_FIELDS)
+    info.update(slug=slug, **kwargs)
+    return info
+
+class EventsTests(unittest.TestCase):
+    def setUp(self):
+        project.cache = DictTempCache(project.DEFAULT_CACHE_TTL)
+
+    def test_get_rows_keeps_rendered_fields(self):
+        rows = events.get_rows([dict(slug='a', state='running',
+                                     launch_time='now')])
+        self.assertEqual(rows, dict(a=row('a', state='running')))
+
+    def test_get_version_depends_on_content(self):
+        v1 = events.get_version(dict(a=row('a')))
+        self.assertEqual(v1, events.get_version(dict(a=row('a'))))
+        self.assertNotEqual(v1, events.get_version(dict(b=row('b'))))
+
+    def test_remember_and_recall_work(self):
+        rows = dict(a=row('a', state='pending'))
+        version = events.remember(FakeProject(), rows)
+        self.assertEqual(version, events.get_version(rows))
+        self.assertEqual(events.recall(FakeProject(), version), rows)
+        self.assertEqual(events.recall(FakeProject(), version[:4]), None)
+        self.assertEqual(events.recall(FakeProject(), 'nope'), None)
+
+    def test_versions_are_looked_up_by_instances_version(self):
+        rows = dict(a=row('a'))
+        version = events.remember(FakeProject(), rows, 'iv1')
+        self.assertEqual(events.lookup_version(FakeProject(), 'iv1'), version)
+        self.assertEqual(events.lookup_version(FakeProject(), 'iv'), None)
+        self.assertEqual(events.lookup_version(FakeProject(), None), None)
+
+    def test_diff_works(self):
+        old = dict(a=row('a', state='pending'), b=row('b'))
+        new = dict(a=row('a', state='running'), c=row('c'))
+        self.assertEqual(events.diff(old, new), [
+            ('change', row('a', state='running')),
+            ('add', row('c')),
+            ('remove', row('b'))
+        ])
+
+    def test_format_event_works(self):
+        self.assertEqual(events.format_event('add', dict(slug='a')),
+                         'event: add\ndata: {"slug": "a"}\n\n')
+        self.assertEqual(events.format_event('reset', {}, 'v2'),
+                         'event: reset\nid: v2\ndata: {}\n\n')
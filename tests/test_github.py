@@ -0,0 +1,138 @@
+import json
+import unittest
+
+import mock
+
+from fleeting import github, project
+from fleeting.tempcache import DictTempCache
+
+def create_mock_response(status=200, content=None, link=None):
+    res = mock.MagicMock(status=status)
+    res.get.side_effect = {'link': link}.get
+    return res, json.dumps(content or [])
+
+LINK = ('<https://api.github.com/repositories/1/forks?per_page=100&page=2>; '
+        'rel="next", <https://api.github.com/repositories/1/forks?'
+        'per_page=100&page=3>; rel="last"')
+
+class GithubTests(unittest.TestCase):
+    def setUp(self):
+        project.cache = DictTempCache(project.DEFAULT_CACHE_TTL)
+        github.refreshing.clear()
+
+    @mock.patch('os.environ', {})
+    @mock.patch('fleeting.httpclient.request')
+    def test_get_page_works(self, request):
+        request.return_value = create_mock_response(content=[1, 2])
+        res, results = github.get_page('/repos/a/b/forks', 2)
+        self.assertEqual(results, [1, 2])
+        request.assert_called_once_with(
+            'https://api.github.com/repos/a/b/forks?per_page=100&page=2',
+            headers={'Accept': 'application/vnd.github.v3+json'}
+        )
+
+    @mock.patch('os.environ', {'GITHUB_TOKEN': 'tok'})
+    @mock.patch('fleeting.httpclient.request')
+    def test_get_page_sends_token(self, request):
+        request.return_value = create_mock_response()
+        github.get_page('/repos/a/b/forks', 1)
+        headers = request.call_args[1]['headers']
+        self.assertEqual(headers['Authorization'], 'token tok')
+
+    @mock.patch('fleeting.httpclient.request')
+    def test_get_page_treats_404_as_empty(self, request):
+        request.return_value = create_mock_response(status=404)
+        self.assertEqual(github.get_page('/repos/a/b/forks', 1)[1], [])
+
+    @mock.patch('fleeting.httpclient.request')
+    def test_get_page_raises_on_errors(self, request):
+        request.return_value = create_mock_response(status=403)
+        self.assertRaises(github.GithubError, github.get_page,
+                          '/repos/a/b/forks', 1)
+
+    @mock.patch('fleeting.httpclient.request')
+    def test_get_all_pages_fetches_remaining_pages(self, request):
+        def respond(url, headers):
+            page = int(url.split('page=')[-1])
+            return create_mock_response(content=[page],
+                                        link=LINK if page == 1 else None)
+
+        request.side_effect = respond
+        self.assertEqual(github.get_all_pages('/repos/a/b/forks'), [1, 2, 3])
+        self.assertEqual(request.call_count, 3)
+
+    def test_get_pool_is_lazy(self):
+        with mock.patch.object(github, 'pool', None):
+            pool = github.get_pool()
+            self.assertTrue(github.get_pool() is pool)
+
+    @mock.patch('fleeting.github.time')
+    @mock.patch('fleeting.github.schedule_refresh')
+    @mock.patch('fleeting.github.get_all_pages')
+    def test_get_forks_caches_names(self, get_all_pages, schedule_refresh,
+                                    time):
+        time.time.return_value = 1000
+        get_all_pages.return_value = [{'owner': {'login': 'toolness'}}]
+        self.assertEqual(github.get_forks('a/b'), ['toolness'])
+        self.assertEqual(github.get_forks('a/b'), ['toolness'])
+        get_all_pages.assert_called_once_with('/repos/a/b/forks')
+        self.assertEqual(schedule_refresh.call_count, 0)
+
+        time.time.return_value = 1000 + github.FRESH_TTL
+        self.assertEqual(github.get_forks('a/b'), ['toolness'])
+        schedule_refresh.assert_called_once_with('/repos/a/b/forks',
+                                                 github.get_fork_owner)
+
+    @mock.patch('fleeting.github.get_all_pages')
+    def test_get_branches_works(self, get_all_pages):
+        get_all_pages.return_value = [{'name': 'master'}]
+        self.assertEqual(github.get_branches('u', 'a/b'), ['master'])
+        get_all_pages.assert_called_once_with('/repos/u/b/branches')
+
+    @mock.patch('fleeting.github.get_all_pages')
+    def test_get_branches_rejects_bad_users(self, get_all_pages):
+        self.assertEqual(github.get_branches('../x', 'a/b'), [])
+        self.assertEqual(get_all_pages.call_count, 0)
+
+    @mock.patch('fleeting.github.time')
+    @mock.patch('fleeting.github.schedule_refresh')
+    @mock.patch('fleeting.github.get_all_pages')
+    def test_prefetch_forks_only_refreshes_stale_entries(self, get_all_pages,
+                                                         schedule_refresh,
+                                                         time):
+        time.time.return_value = 1000
+        github.prefetch_forks('a/b')
+        self.assertEqual(schedule_refresh.call_count, 1)
+        get_all_pages.return_value = []
+        github.get_forks('a/b')
+        github.prefetch_forks('a/b')
+        self.assertEqual(schedule_refresh.call_count, 1)
+
+    @mock.patch('fleeting.github.Thread')
+    def test_schedule_refresh_collapses_requests(self, thread):
+        github.schedule_refresh('/p', github.get_branch_name)
+        github.schedule_refresh('/p', github.get_branch_name)
+        thread.assert_called_once_with(
+            target=github._refresh_in_background,
+            args=('/p', github.get_branch_name)
+        )
+        self.assertTrue(thread.return_value.daemon)
+        thread.return_value.start.assert_called_once_with()
+        self.assertEqual(github.refreshing, set(['/p']))
+
+    @mock.patch('fleeting.github.get_all_pages')
+    def test_refresh_in_background_works(self, get_all_pages):
+        get_all_pages.return_value = [{'name': 'master'}]
+        github.refreshing.add('/p')
+        github._refresh_in_background('/p', github.get_branch_name)
+        self.assertEqual(github.refreshing, set())
+        self.assertEqual(github._get_cached('/p')['names'], ['master'])
+
+    @mock.patch('fleeting.github.logging')
+    @mock.patch('fleeting.github.get_all_pages')
+    def test_refresh_in_background_logs_errors(self, get_all_pages, logging):
+        get_all_pages.side_effect = github.GithubError('nope')
+        github.refreshing.add('/p')
+        github._refresh_in_background('/p', github.get_branch_name)
+        self.assertEqual(github.refreshing, set())
+        self.assertEqual(logging.exception.call_count, 1)
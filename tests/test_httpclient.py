@@ -0,0 +1,121 @@
+import unittest
+import threading
+
+import mock
+
+from fleeting import httpclient, metrics
+
+class HttpClientTests(unittest.TestCase):
+    def setUp(self):
+        self.client = httpclient.HttpClient()
+
+    @mock.patch('fleeting.metrics.store', metrics.LocalMetrics())
+    @mock.patch('httplib2.Http')
+    def test_connections_are_reused_per_host(self, http):
+        self.client.request('http://foo.org/a')
+        self.client.request('http://foo.org/b', method='HEAD')
+        self.client.request('http://bar.org/')
+        self.assertEqual(http.call_count, 2)
+        http.assert_called_with(timeout=3,
+                                disable_ssl_certificate_validation=False)
+        http.return_value.request.assert_any_call('http://foo.org/b',
+                                                  method='HEAD', headers={})
+        samples = metrics.store.snapshot()
+        self.assertEqual(samples['fleeting_http_pool_checkouts_total'
+                                 '{result="hit"}'], 1)
+        self.assertEqual(samples['fleeting_http_pool_checkouts_total'
+                                 '{result="miss"}'], 2)
+
+    @mock.patch('httplib2.Http')
+    def test_bodies_are_sent(self, http):
+        self.client.request('http://foo.org/', method='PUT', body='hi')
+        http.return_value.request.assert_called_once_with(
+            'http://foo.org/', method='PUT', headers={}, body='hi'
+        )
+
+    @mock.patch('fleeting.metrics.store', metrics.LocalMetrics())
+    @mock.patch('httplib2.Http')
+    def test_requests_are_measured(self, http):
+        self.client.request('http://foo.org/')
+        http.return_value.request.side_effect = Exception('timeout')
+        self.assertRaises(Exception, self.client.request, 'http://foo.org/')
+        samples = metrics.store.snapshot()
+        self.assertEqual(samples['fleeting_http_requests_total'
+                                 '{method="GET",outcome="ok"}'], 1)
+        self.assertEqual(samples['fleeting_http_requests_total'
+                                 '{method="GET",outcome="error"}'], 1)
+        self.assertEqual(samples['fleeting_http_request_seconds_count'
+                                 '{method="GET"}'], 2)
+
+    @mock.patch('httplib2.Http')
+    def test_credentials_timeout_and_validation_get_their_own_pool(self,
+                                                                  http):
+        self.client.request('http://foo.org/')
+        self.client.request('http://foo.org/', credentials=('u', 'p'))
+        self.client.request('http://foo.org/', timeout=5)
+        self.client.request('http://foo.org/', validate_certificates=False)
+        self.assertEqual(http.call_count, 4)
+        http.return_value.add_credentials.assert_called_once_with('u', 'p')
+        self.assertEqual(http.call_args_list[2], mock.call(
+            timeout=5, disable_ssl_certificate_validation=False
+        ))
+        http.assert_called_with(timeout=3,
+                                disable_ssl_certificate_validation=True)
+
+    @mock.patch('httplib2.Http')
+    def test_errors_close_the_connection(self, http):
+        conn = mock.MagicMock()
+        http.return_value.connections = {'http:foo.org': conn}
+        http.return_value.request.side_effect = Exception('socket err')
+        self.assertRaises(Exception, self.client.request, 'http://foo.org/')
+        conn.close.assert_called_once_with()
+        self.assertEqual(self.client.pools, {})
+
+    @mock.patch('fleeting.httpclient.time')
+    @mock.patch('httplib2.Http')
+    def test_idle_connections_are_pruned(self, http, time):
+        conn = mock.MagicMock()
+        http.return_value.connections = {'http:foo.org': conn}
+        time.time.return_value = 100
+        self.client.request('http://foo.org/')
+        self.assertEqual(len(self.client.pools), 1)
+        time.time.return_value = 100 + httpclient.IDLE_TIMEOUT
+        self.client.request('http://bar.org/')
+        conn.close.assert_called_once_with()
+        self.assertEqual(len(self.client.pools), 1)
+
+    @mock.patch('httplib2.Http')
+    def test_requests_per_host_are_capped(self, http):
+        client = httpclient.HttpClient(max_per_host=1)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def request(url, **kwargs):
+            calls.append(url)
+            started.set()
+            release.wait()
+            return 'response'
+
+        http.return_value.request.side_effect = request
+        t = threading.Thread(target=client.request, args=('http://foo.org/',))
+        t.start()
+        started.wait()
+        results = []
+        t2 = threading.Thread(target=lambda: results.append(
+            client.request('http://foo.org/2')))
+        t2.start()
+        t2.join(0.1)
+        self.assertEqual(calls, ['http://foo.org/'])
+        release.set()
+        t.join()
+        t2.join()
+        self.assertEqual(calls, ['http://foo.org/', 'http://foo.org/2'])
+        self.assertEqual(results, ['response'])
+
+    @mock.patch('fleeting.httpclient.client')
+    def test_module_request_uses_shared_client(self, client):
+        self.assertTrue(httpclient.request('http://foo.org/', method='HEAD')
+                        is client.request.return_value)
+        client.request.assert_called_once_with('http://foo.org/',
+                                               method='HEAD')
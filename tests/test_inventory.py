@@ -0,0 +1,87 @@
+import json
+import unittest
+
+import mock
+
+from fleeting import inventory
+from fleeting.tempcache import DictTempCache
+
+def create_mock_instance(id, tags, state='running'):
+    return mock.MagicMock(id=id, state=state, tags=tags,
+                          launch_time='2013-04-29T11:53:42.000Z',
+                          public_dns_name='%s.amazonaws.com' % id)
+
+class InventoryTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = DictTempCache(3600)
+
+    def test_describe_instance_only_keeps_fleeting_tags(self):
+        inst = create_mock_instance('i-1', {
+            'fleeting:foo': '{}',
+            'Name': 'blah'
+        })
+        self.assertEqual(inventory.describe_instance(inst), {
+            'id': 'i-1',
+            'state': 'running',
+            'launch_time': '2013-04-29T11:53:42.000Z',
+            'public_dns_name': 'i-1.amazonaws.com',
+            'tags': {'fleeting:foo': '{}'}
+        })
+
+    def test_sweep_groups_instances_by_tag(self):
+        ec2 = mock.MagicMock()
+        ec2.get_all_instances.return_value = [
+            mock.MagicMock(instances=[
+                create_mock_instance('i-1', {'fleeting:foo': '{}'}),
+                create_mock_instance('i-2', {'fleeting:bar': '{}'})
+            ])
+        ]
+        result = inventory.sweep(ec2, ['fleeting:foo', 'fleeting:bar',
+                                       'fleeting:baz'])
+        self.assertEqual([i['id'] for i in result['fleeting:foo']], ['i-1'])
+        self.assertEqual([i['id'] for i in result['fleeting:bar']], ['i-2'])
+        self.assertEqual(result['fleeting:baz'], [])
+        ec2.get_all_instances.assert_called_once_with(filters={
+            'tag-key': ['fleeting:foo', 'fleeting:bar', 'fleeting:baz'],
+            'instance-state-name': ['pending', 'running']
+        })
+
+    def test_sweep_does_nothing_without_tags(self):
+        ec2 = mock.MagicMock()
+        self.assertEqual(inventory.sweep(ec2, []), {})
+        self.assertEqual(ec2.get_all_instances.call_count, 0)
+
+    def test_read_snapshot_returns_none_when_empty(self):
+        self.assertEqual(inventory.read_snapshot(self.cache), None)
+
+    @mock.patch('time.time')
+    def test_read_snapshot_returns_none_when_stale(self, time):
+        time.return_value = 1000
+        inventory.publish_snapshot(self.cache, {'fleeting:foo': []}, 10)
+        time.return_value = 1029
+        self.assertNotEqual(inventory.read_snapshot(self.cache), None)
+        time.return_value = 1030
+        self.assertEqual(inventory.read_snapshot(self.cache), None)
+
+    @mock.patch('time.time', lambda: 1000)
+    def test_publish_snapshot_works(self):
+        version = inventory.publish_snapshot(self.cache, {'fleeting:foo': []})
+        self.assertEqual(version, 1)
+        self.assertEqual(inventory.read_snapshot(self.cache), {
+            'version': 1,
+            'timestamp': 1000,
+            'expires': 1090,
+            'instances': {'fleeting:foo': []}
+        })
+
+    def test_publish_snapshot_only_bumps_version_on_change(self):
+        publish = inventory.publish_snapshot
+        self.assertEqual(publish(self.cache, {'fleeting:foo': []}), 1)
+        self.assertEqual(publish(self.cache, {'fleeting:foo': []}), 1)
+        self.assertEqual(publish(self.cache, {'fleeting:foo': [{}]}), 2)
+
+    def test_publish_snapshot_serializes_instances(self):
+        inventory.publish_snapshot(self.cache, {'fleeting:foo': [{'a': 1}]})
+        item = self.cache.find(inventory.SNAPSHOT_KEY)[0]
+        self.assertEqual(json.loads(item['instances']),
+                         {'fleeting:foo': [{'a': 1}]})
@@ -0,0 +1,312 @@
+import logging
+import unittest
+
+import mock
+
+from fleeting import jobs
+
+class LocalJobQueueTests(unittest.TestCase):
+    def test_push_and_pop_work(self):
+        q = jobs.LocalJobQueue()
+        job = jobs.new_job('k', 'p', {})
+        q.push(job)
+        self.assertEqual(q.pop(), job)
+        self.assertEqual(q.pop(timeout=0.01), None)
+
+    def test_get_returns_copies(self):
+        q = jobs.LocalJobQueue()
+        job = jobs.new_job('k', 'p', {})
+        q.save(job)
+        q.get(job['id'])['state'] = 'blah'
+        self.assertEqual(q.get(job['id'])['state'], 'queued')
+        self.assertEqual(q.get('nonexistent'), None)
+
+    @mock.patch('time.time')
+    def test_save_expires_old_jobs(self, time):
+        q = jobs.LocalJobQueue(ttl=10)
+        time.return_value = 1000
+        old = jobs.new_job('k', 'p', {})
+        q.save(old)
+        time.return_value = 1010
+        q.save(jobs.new_job('k', 'p', {}))
+        self.assertEqual(q.get(old['id']), None)
+
+class RedisJobQueueTests(unittest.TestCase):
+    @mock.patch('fleeting.jobs.redis')
+    def test_save_works(self, redis):
+        q = jobs.RedisJobQueue(url='redis://foo:6379', ttl=50)
+        redis.from_url.assert_called_once_with('redis://foo:6379')
+        q.save({'id': 'j'})
+        q.redis.set.assert_called_once_with('fleeting-job:j', '{"id": "j"}',
+                                            ex=50)
+
+    @mock.patch('fleeting.jobs.redis')
+    def test_get_works(self, redis):
+        q = jobs.RedisJobQueue()
+        q.redis.get.return_value = '{"id": "j"}'
+        self.assertEqual(q.get('j'), {'id': 'j'})
+        q.redis.get.assert_called_once_with('fleeting-job:j')
+        q.redis.get.return_value = None
+        self.assertEqual(q.get('j'), None)
+
+    @mock.patch('fleeting.jobs.redis')
+    def test_push_works(self, redis):
+        q = jobs.RedisJobQueue()
+        q.push({'id': 'j'})
+        q.redis.lpush.assert_called_once_with('fleeting-job-queue', 'j')
+        self.assertEqual(q.redis.set.call_count, 1)
+
+    @mock.patch('fleeting.jobs.redis')
+    def test_pop_works(self, redis):
+        q = jobs.RedisJobQueue()
+        q.redis.brpop.return_value = ('fleeting-job-queue', 'j')
+        q.redis.get.return_value = '{"id": "j"}'
+        self.assertEqual(q.pop(timeout=3), {'id': 'j'})
+        q.redis.brpop.assert_called_once_with('fleeting-job-queue',
+                                              timeout=3)
+        q.redis.brpop.return_value = None
+        self.assertEqual(q.pop(), None)
+
+class LocalScheduleTests(unittest.TestCase):
+    def test_pop_due_works(self):
+        s = jobs.LocalSchedule()
+        s.add('a', 10)
+        s.add('b', 20)
+        self.assertEqual(s.pop_due(5), [])
+        self.assertEqual(s.pop_due(10), ['a'])
+        self.assertEqual(s.pop_due(10), [])
+        self.assertEqual(s.pop_due(30), ['b'])
+
+    def test_add_keeps_latest_time(self):
+        s = jobs.LocalSchedule()
+        s.add('a', 10)
+        s.add('a', 5)
+        self.assertEqual(s.due, {'a': 10})
+        s.add('a', 20)
+        self.assertEqual(s.due, {'a': 20})
+
+class RedisScheduleTests(unittest.TestCase):
+    @mock.patch('fleeting.jobs.redis')
+    def test_add_works(self, redis):
+        s = jobs.RedisSchedule(url='redis://foo:6379')
+        redis.from_url.assert_called_once_with('redis://foo:6379')
+        s.redis.zscore.return_value = None
+        s.add('a', 10)
+        s.redis.zadd.assert_called_once_with('fleeting-schedule', 'a', 10)
+
+    @mock.patch('fleeting.jobs.redis')
+    def test_add_keeps_latest_time(self, redis):
+        s = jobs.RedisSchedule()
+        s.redis.zscore.return_value = 10.0
+        s.add('a', 5)
+        self.assertEqual(s.redis.zadd.call_count, 0)
+        s.add('a', 20)
+        s.redis.zadd.assert_called_once_with('fleeting-schedule', 'a', 20)
+
+    @mock.patch('fleeting.jobs.redis')
+    def test_pop_due_only_returns_removed_members(self, redis):
+        s = jobs.RedisSchedule()
+        s.redis.zrangebyscore.return_value = ['a', 'b']
+        s.redis.zrem.side_effect = [1, 0]
+        self.assertEqual(s.pop_due(30), ['a'])
+        s.redis.zrangebyscore.assert_called_once_with('fleeting-schedule',
+                                                      '-inf', 30)
+
+class JobTests(unittest.TestCase):
+    def setUp(self):
+        self.queue = jobs.LocalJobQueue()
+
+    def run_job(self, handler):
+        job = jobs.new_job('test', 'openbadges', {'slug': 'foo'})
+        with mock.patch.dict(jobs.HANDLERS, {'test': handler}):
+            return jobs.run_job(job, self.queue, logger=mock.MagicMock())
+
+    def test_run_job_records_steps(self):
+        def handler(job, on_step, logger):
+            on_step('one')
+            on_step('two')
+            return 'DONE'
+
+        job = self.run_job(handler)
+        self.assertEqual(job['state'], 'done')
+        self.assertEqual(job['result'], 'DONE')
+        self.assertEqual([(s['name'], s['status']) for s in job['steps']],
+                         [('one', 'done'), ('two', 'done')])
+        for step in job['steps']:
+            self.assertEqual(step['duration'],
+                             step['finished'] - step['started'])
+        self.assertEqual(self.queue.get(job['id']), job)
+
+    def test_run_job_records_failures(self):
+        def handler(job, on_step, logger):
+            on_step('one')
+            raise Exception('kaboom')
+
+        job = self.run_job(handler)
+        self.assertEqual(job['state'], 'failed')
+        self.assertEqual(job['error'], 'kaboom')
+        self.assertEqual(job['steps'][0]['status'], 'failed')
+        self.assertTrue(job['finished'] is not None)
+
+    def test_run_job_works_without_steps(self):
+        job = self.run_job(lambda job, on_step, logger: 'DONE')
+        self.assertEqual(job['steps'], [])
+
+    @mock.patch('fleeting.project.get_project')
+    def test_create_instance_works(self, get_project):
+        get_project.return_value.warm_pool_size = 0
+        job = jobs.new_job('create_instance', 'openbadges', {'slug': 's'})
+        on_step = mock.MagicMock()
+        result = jobs.create_instance(job, on_step)
+        get_project.assert_called_once_with('openbadges')
+        get_project.return_value.create_instance.assert_called_once_with(
+            on_step=on_step,
+            slug='s'
+        )
+        self.assertTrue(result is
+                        get_project.return_value.create_instance.return_value)
+
+    @mock.patch('fleeting.jobs.enqueue_later')
+    @mock.patch('fleeting.project.get_project')
+    def test_create_instance_refills_warm_pool(self, get_project,
+                                               enqueue_later):
+        get_project.return_value.warm_pool_size = 2
+        get_project.return_value.id = 'openbadges'
+        job = jobs.new_job('create_instance', 'openbadges', dict(
+            slug='s', key_name='k', security_groups=['g']
+        ))
+        jobs.create_instance(job, mock.MagicMock())
+        enqueue_later.assert_called_once_with('fill_warm_pool', 'openbadges',
+                                              dict(key_name='k',
+                                                   security_groups=['g'],
+                                                   notify_topic=None), 0)
+
+    @mock.patch('fleeting.project.get_project')
+    def test_fill_warm_pool_works(self, get_project):
+        job = jobs.new_job('fill_warm_pool', 'openbadges', dict(key_name='k'))
+        result = jobs.fill_warm_pool(job, mock.MagicMock())
+        fill = get_project.return_value.fill_warm_pool
+        fill.assert_called_once_with(key_name='k', logger=logging)
+        self.assertTrue(result is fill.return_value)
+
+    @mock.patch('fleeting.jobs.enqueue_later')
+    @mock.patch('fleeting.project.get_projects')
+    def test_schedule_warm_pool_fills_works(self, get_projects,
+                                            enqueue_later):
+        cold = mock.MagicMock(warm_pool_size=0)
+        warm = mock.MagicMock(warm_pool_size=1, id='openbadges')
+        get_projects.return_value = [cold, warm]
+        jobs.schedule_warm_pool_fills(key_name='k', security_groups=['g'],
+                                      notify_topic='t')
+        enqueue_later.assert_called_once_with('fill_warm_pool', 'openbadges',
+                                              dict(key_name='k',
+                                                   security_groups=['g'],
+                                                   notify_topic='t'), 0)
+
+    @mock.patch('fleeting.project.get_project')
+    def test_cleanup_instances_works(self, get_project):
+        job = jobs.new_job('cleanup_instances', 'openbadges', {})
+        logger = mock.MagicMock()
+        result = jobs.cleanup_instances(job, mock.MagicMock(), logger)
+        cleanup = get_project.return_value.cleanup_instances
+        cleanup.assert_called_once_with(logger=logger)
+        self.assertTrue(result is cleanup.return_value)
+
+    def test_create_instance_raises_on_unknown_project(self):
+        job = jobs.new_job('create_instance', 'nonexistent', {})
+        with self.assertRaisesRegexp(ValueError, 'nonexistent'):
+            jobs.create_instance(job, None)
+
+class WorkerTests(unittest.TestCase):
+    def setUp(self):
+        self.queue = jobs.LocalJobQueue()
+        self.patches = [mock.patch.object(jobs, 'job_queue', self.queue),
+                        mock.patch.object(jobs, 'workers', []),
+                        mock.patch.object(jobs, 'schedule',
+                                          jobs.LocalSchedule()),
+                        mock.patch.object(jobs, 'scheduler', None)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    @mock.patch('fleeting.jobs.start_workers')
+    def test_enqueue_works(self, start_workers):
+        job_id = jobs.enqueue('create_instance', 'openbadges', {'a': 1})
+        job = jobs.get_job(job_id)
+        self.assertEqual(job['state'], 'queued')
+        self.assertEqual(job['params'], {'a': 1})
+        start_workers.assert_called_once_with()
+        jobs.workers.append('fake worker')
+        jobs.enqueue('create_instance', 'openbadges', {'a': 1})
+        self.assertEqual(start_workers.call_count, 1)
+
+    @mock.patch('fleeting.jobs.run_job')
+    def test_work_runs_queued_jobs(self, run_job):
+        job = jobs.new_job('k', 'p', {})
+        self.queue.push(job)
+        logger = mock.MagicMock()
+        jobs.work(logger)
+        run_job.assert_called_once_with(job, self.queue, logger)
+
+    @mock.patch('fleeting.jobs.run_job')
+    def test_work_does_nothing_when_idle(self, run_job):
+        with mock.patch.object(self.queue, 'pop', lambda: None):
+            jobs.work()
+        self.assertEqual(run_job.call_count, 0)
+
+    @mock.patch('fleeting.jobs.PeriodicTask')
+    def test_start_workers_works(self, PeriodicTask):
+        logger = mock.MagicMock()
+        jobs.start_workers(concurrency=2, logger=logger)
+        jobs.start_workers(concurrency=2, logger=logger)
+        self.assertEqual(PeriodicTask.call_count, 2)
+        PeriodicTask.assert_called_with(jobs.work, 0,
+                                        kwargs=dict(logger=logger),
+                                        logger=logger)
+        self.assertEqual(len(jobs.workers), 2)
+
+    @mock.patch('fleeting.jobs.start_scheduler')
+    @mock.patch('fleeting.jobs.enqueue')
+    @mock.patch('time.time', lambda: 1000)
+    def test_enqueue_later_coalesces_jobs(self, enqueue, start_scheduler):
+        jobs.enqueue_later('cleanup_instances', 'openbadges', {}, 15)
+        jobs.enqueue_later('cleanup_instances', 'openbadges', {}, 15)
+        jobs.enqueue_later('cleanup_instances', 'butter', {}, 30)
+        start_scheduler.assert_called_with()
+        self.assertEqual(jobs.enqueue_due_jobs(now=1014), 0)
+        self.assertEqual(jobs.enqueue_due_jobs(now=1015), 1)
+        enqueue.assert_called_once_with('cleanup_instances', 'openbadges',
+                                        {})
+        self.assertEqual(jobs.enqueue_due_jobs(now=1030), 1)
+        self.assertEqual(jobs.enqueue_due_jobs(now=1030), 0)
+
+    @mock.patch('fleeting.jobs.start_scheduler')
+    @mock.patch('fleeting.jobs.enqueue')
+    def test_enqueue_later_waits_for_the_last_request(self, enqueue,
+                                                      start_scheduler):
+        with mock.patch('time.time', lambda: 1000):
+            jobs.enqueue_later('cleanup_instances', 'openbadges', {}, 15)
+        with mock.patch('time.time', lambda: 1010):
+            jobs.enqueue_later('cleanup_instances', 'openbadges', {}, 15)
+        self.assertEqual(jobs.enqueue_due_jobs(now=1015), 0)
+        self.assertEqual(jobs.enqueue_due_jobs(now=1025), 1)
+
+    @mock.patch('fleeting.jobs.start_scheduler')
+    def test_enqueue_later_only_starts_scheduler_once(self,
+                                                      start_scheduler):
+        jobs.scheduler = 'fake scheduler'
+        jobs.enqueue_later('cleanup_instances', 'openbadges', {}, 15)
+        self.assertEqual(start_scheduler.call_count, 0)
+
+    @mock.patch('fleeting.jobs.PeriodicTask')
+    def test_start_scheduler_works(self, PeriodicTask):
+        logger = mock.MagicMock()
+        jobs.start_scheduler(logger=logger)
+        jobs.start_scheduler(logger=logger)
+        PeriodicTask.assert_called_once_with(jobs.enqueue_due_jobs, 1,
+                                             logger=logger)
+        self.assertTrue(jobs.scheduler is
+                        PeriodicTask.return_value.start.return_value)
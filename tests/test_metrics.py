@@ -0,0 +1,114 @@
+import unittest
+
+import mock
+from boto.exception import BotoServerError
+from boto.ec2.autoscale import AutoScaleConnection
+from boto.ec2.autoscale.group import AutoScalingGroup
+
+from fleeting import metrics
+
+DELETE_GROUP_RESPONSE = ('<DeleteAutoScalingGroupResponse><ResponseMetadata>'
+                         '<RequestId>r</RequestId></ResponseMetadata>'
+                         '</DeleteAutoScalingGroupResponse>')
+ERROR_RESPONSE = ('<ErrorResponse><Error><Code>ResourceInUse</Code>'
+                  '<Message>busy</Message></Error></ErrorResponse>')
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        metrics.store = metrics.LocalMetrics()
+
+    def test_inc_works(self):
+        metrics.inc('fleeting_aws_calls_total', method='a')
+        metrics.inc('fleeting_aws_calls_total', 2, method='a')
+        metrics.inc('other_total')
+        self.assertEqual(metrics.store.snapshot(), {
+            'fleeting_aws_calls_total{method="a"}': 3,
+            'other_total': 1
+        })
+
+    def test_labels_are_escaped(self):
+        metrics.inc('x', endpoint='a"b\\c\nd')
+        self.assertEqual(metrics.store.snapshot().keys(),
+                         ['x{endpoint="a\\"b\\\\c\\nd"}'])
+
+    @mock.patch('fleeting.metrics.BUCKETS', [0.1, 1])
+    def test_observe_fills_cumulative_buckets(self):
+        metrics.observe('fleeting_request_seconds', 0.5, endpoint='e')
+        metrics.observe('fleeting_request_seconds', 0.05, endpoint='e')
+        self.assertEqual(metrics.render(), '\n'.join([
+            '# HELP fleeting_request_seconds Time taken to handle requests, '
+            'by endpoint.',
+            '# TYPE fleeting_request_seconds histogram',
+            'fleeting_request_seconds_bucket{endpoint="e",le="0.1"} 1',
+            'fleeting_request_seconds_bucket{endpoint="e",le="1"} 2',
+            'fleeting_request_seconds_bucket{endpoint="e",le="+Inf"} 2',
+            'fleeting_request_seconds_count{endpoint="e"} 2',
+            'fleeting_request_seconds_sum{endpoint="e"} 0.55',
+        ]) + '\n')
+
+    def test_render_works_without_descriptions(self):
+        self.assertEqual(metrics.render({'a': 1.0, 'b': 2.5}),
+                         'a 1\nb 2.5\n')
+
+    def test_drain_empties_samples(self):
+        metrics.inc('a')
+        self.assertEqual(metrics.store.drain(), {'a': 1})
+        self.assertEqual(metrics.store.snapshot(), {})
+
+    @mock.patch('fleeting.metrics.redis')
+    def test_redis_metrics_flush_buffered_samples(self, redis):
+        store = metrics.RedisMetrics(url='redis://foo:6379')
+        redis.from_url.assert_called_once_with('redis://foo:6379')
+        store.flush()
+        self.assertEqual(store.redis.pipeline.call_count, 0)
+        store.inc('a', 2)
+        store.redis.hgetall.return_value = {'a': '5', 'b': '0.5'}
+        self.assertEqual(store.snapshot(), {'a': 5.0, 'b': 0.5})
+        pipe = store.redis.pipeline.return_value
+        pipe.hincrbyfloat.assert_called_once_with('fleeting-metrics', 'a', 2)
+        pipe.execute.assert_called_once_with()
+        self.assertEqual(store.drain(), {})
+
+    def test_instrument_connection_counts_requests(self):
+        conn = AutoScaleConnection('key', 'secret')
+        self.assertTrue(metrics.instrument_connection(conn, 'autoscaling')
+                        is conn)
+        conn._mexe = mock.MagicMock()
+        responses = [
+            mock.MagicMock(status=200, **{'read.return_value':
+                                          DELETE_GROUP_RESPONSE}),
+            mock.MagicMock(status=400, reason='Bad Request', **{
+                'read.return_value': ERROR_RESPONSE
+            }),
+            Exception('socket err')
+        ]
+
+        def mexe(request):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        conn._mexe.side_effect = mexe
+        # Objects boto hands out make their calls through the connection.
+        group = AutoScalingGroup(connection=conn, name='g')
+        group.delete()
+        self.assertRaises(BotoServerError, group.delete)
+        self.assertRaises(Exception, conn.get_all_groups)
+        samples = metrics.store.snapshot()
+        self.assertEqual(samples[
+            'fleeting_aws_calls_total{action="DeleteAutoScalingGroup",'
+            'outcome="ok",service="autoscaling"}'
+        ], 1)
+        self.assertEqual(samples[
+            'fleeting_aws_calls_total{action="DeleteAutoScalingGroup",'
+            'outcome="error",service="autoscaling"}'
+        ], 1)
+        self.assertEqual(samples[
+            'fleeting_aws_calls_total{action="DescribeAutoScalingGroups",'
+            'outcome="error",service="autoscaling"}'
+        ], 1)
+        self.assertEqual(samples[
+            'fleeting_aws_call_seconds_count{action="DeleteAutoScalingGroup",'
+            'service="autoscaling"}'
+        ], 2)
@@ -0,0 +1,191 @@
+import json
+import unittest
+
+import mock
+
+from fleeting import project, inventory
+from fleeting.prober import ReadinessProber, MIN_DELAY, MAX_DELAY, \
+                            MAX_TRACKING_TIME
+from fleeting.tempcache import DictTempCache
+
+class FakePool(object):
+    def map(self, func, items):
+        return map(func, items)
+
+def create_prober():
+    prober = ReadinessProber(logger=mock.MagicMock())
+    prober.task = mock.MagicMock()
+    prober.pool = FakePool()
+    return prober
+
+def create_mock_project(instance=None):
+    proj = mock.MagicMock(id='proj', ready_tag_name='fleeting:proj:ready',
+                          tag_name='fleeting:proj')
+    proj.get_instance.return_value = instance
+    return proj
+
+class ReadinessProberTests(unittest.TestCase):
+    def setUp(self):
+        project.cache = DictTempCache(project.DEFAULT_CACHE_TTL)
+
+    @mock.patch('fleeting.prober.PeriodicTask')
+    @mock.patch('fleeting.prober.ThreadPool')
+    def test_start_only_starts_once(self, ThreadPool, PeriodicTask):
+        prober = ReadinessProber(concurrency=3)
+        prober.start()
+        prober.start()
+        ThreadPool.assert_called_once_with(3)
+        PeriodicTask.return_value.start.assert_called_once_with()
+        self.assertEqual(PeriodicTask.call_args[0][0], prober.tick)
+
+    def test_track_is_idempotent(self):
+        prober = create_prober()
+        proj = create_mock_project()
+        prober.track(proj, 'foo')
+        entry = prober.tracked[('proj', 'foo')]
+        prober.track(proj, 'foo')
+        self.assertTrue(prober.tracked[('proj', 'foo')] is entry)
+        self.assertEqual(entry['delay'], MIN_DELAY)
+
+    def test_track_holds_off_on_instances_with_callbacks(self):
+        prober = create_prober()
+        prober.track(create_mock_project(), 'foo', callback=True)
+        entry = prober.tracked[('proj', 'foo')]
+        self.assertEqual(entry['delay'], MAX_DELAY)
+        self.assertEqual(entry['next_probe'], entry['since'] + MAX_DELAY)
+
+    def test_probe_returns_not_found(self):
+        prober = create_prober()
+        entry = dict(project=create_mock_project(), slug='foo')
+        self.assertEqual(prober.probe(entry), 'NOT_FOUND')
+
+    def test_probe_uses_existing_ready_tag(self):
+        prober = create_prober()
+        inst = mock.MagicMock(tags={'fleeting:proj:ready': 'http://u/'})
+        proj = create_mock_project(inst)
+        self.assertEqual(prober.probe(dict(project=proj, slug='foo')),
+                         'READY')
+        proj.set_ready_url.assert_called_once_with('foo', 'http://u/')
+        self.assertEqual(proj.check_ready_url.call_count, 0)
+        self.assertEqual(prober.ready_tags, {})
+
+    def test_probe_queues_ready_tags(self):
+        prober = create_prober()
+        inst = mock.MagicMock(id='i-1', tags={})
+        proj = create_mock_project(inst)
+        proj.check_ready_url.return_value = ('READY', 'http://u/')
+        self.assertEqual(prober.probe(dict(project=proj, slug='foo')),
+                         'READY')
+        proj.set_ready_url.assert_called_once_with('foo', 'http://u/')
+        proj.record_timings.assert_called_once_with(inst)
+        self.assertEqual(prober.ready_tags, {
+            'i-1': ('fleeting:proj:ready', 'http://u/')
+        })
+
+    def test_probe_returns_instance_state(self):
+        prober = create_prober()
+        proj = create_mock_project(mock.MagicMock(tags={}))
+        proj.check_ready_url.return_value = ('INSTANCE:running', 'status 500')
+        self.assertEqual(prober.probe(dict(project=proj, slug='foo')),
+                         'INSTANCE:running')
+        self.assertEqual(proj.set_ready_url.call_count, 0)
+
+    def test_probe_logs_exceptions(self):
+        prober = create_prober()
+        proj = create_mock_project()
+        proj.get_instance.side_effect = Exception()
+        self.assertEqual(prober.probe(dict(project=proj, slug='foo')),
+                         'ERROR')
+        prober.logger.exception.assert_called_once_with(
+            'probing proj/foo failed'
+        )
+
+    @mock.patch('boto.connect_ec2')
+    def test_flush_ready_tags_works(self, ec2):
+        project._ec2_conn = None
+        prober = create_prober()
+        prober.ready_tags = {'i-1': ('t', 'u1'), 'i-2': ('t', 'u2')}
+        ec2.return_value.create_tags.side_effect = [None, Exception()]
+        prober.flush_ready_tags()
+        self.assertEqual(ec2.return_value.create_tags.call_count, 2)
+        self.assertEqual(prober.logger.exception.call_count, 1)
+        self.assertEqual(prober.ready_tags, {})
+
+    @mock.patch('boto.connect_ec2')
+    def test_flush_ready_tags_does_nothing_when_empty(self, ec2):
+        create_prober().flush_ready_tags()
+        self.assertEqual(ec2.call_count, 0)
+
+    @mock.patch('time.time', lambda: 1000)
+    def test_tick_backs_off_unready_instances(self):
+        prober = create_prober()
+        proj = create_mock_project(mock.MagicMock(tags={}))
+        proj.check_ready_url.return_value = ('INSTANCE:running', None)
+        prober.track(proj, 'foo')
+        prober.tick()
+        entry = prober.tracked[('proj', 'foo')]
+        self.assertEqual(entry['delay'], MIN_DELAY * 2)
+        self.assertEqual(entry['next_probe'], 1000 + MIN_DELAY * 2)
+        prober.tick()
+        self.assertEqual(proj.get_instance.call_count, 1)
+        entry['next_probe'] = 0
+        entry['delay'] = MAX_DELAY
+        prober.tick()
+        self.assertEqual(entry['delay'], MAX_DELAY)
+
+    def test_tick_stops_tracking_ready_instances(self):
+        prober = create_prober()
+        proj = create_mock_project(mock.MagicMock(tags={}))
+        proj.check_ready_url.return_value = ('READY', 'http://u/')
+        prober.track(proj, 'foo')
+        with mock.patch.object(prober, 'flush_ready_tags') as flush:
+            prober.tick()
+            flush.assert_called_once_with()
+        self.assertEqual(prober.tracked, {})
+
+    def test_tick_gives_up_eventually(self):
+        prober = create_prober()
+        proj = create_mock_project(mock.MagicMock(tags={}))
+        proj.check_ready_url.return_value = ('INSTANCE:running', None)
+        prober.track(proj, 'foo')
+        prober.tracked[('proj', 'foo')]['since'] -= MAX_TRACKING_TIME + 1
+        prober.tick()
+        self.assertEqual(prober.tracked, {})
+
+    def test_discover_tracks_configuring_instances(self):
+        def desc(slug, warm=False, **tags):
+            info = dict(slug=slug)
+            if warm:
+                info['warm'] = True
+            tags['fleeting:openbadges'] = json.dumps(info)
+            return dict(state='running', tags=tags)
+
+        inventory.publish_snapshot(project.cache, {'fleeting:openbadges': [
+            desc('configuring'),
+            desc('warm-1-0', warm=True),
+            desc('ready', **{'fleeting:openbadges:ready': 'http://u/'}),
+            dict(desc('pending'), state='pending')
+        ]})
+        prober = create_prober()
+        prober.discover()
+        self.assertEqual(prober.tracked.keys(),
+                         [('openbadges', 'configuring')])
+        prober.tracked.clear()
+        prober.discover()
+        self.assertEqual(prober.tracked, {})
+
+    def test_discover_notes_ready_callbacks(self):
+        inventory.publish_snapshot(project.cache, {'fleeting:openbadges': [
+            dict(state='running', tags={'fleeting:openbadges': json.dumps(
+                dict(slug='a', ready_callback=True)
+            )})
+        ]})
+        prober = create_prober()
+        prober.discover()
+        self.assertEqual(prober.tracked[('openbadges', 'a')]['delay'],
+                         MAX_DELAY)
+
+    def test_discover_does_nothing_without_snapshot(self):
+        prober = create_prober()
+        prober.discover()
+        self.assertEqual(prober.tracked, {})
@@ -6,6 +6,18 @@ import mock
 from fleeting import project
 
 class ProductionTests(unittest.TestCase):
+    @mock.patch('fleeting.metrics.store')
+    @mock.patch('fleeting.metrics.RedisMetrics')
+    @mock.patch('fleeting.httpclient.client')
+    @mock.patch('fleeting.httpclient.HttpClient')
+    @mock.patch('fleeting.jobs.schedule')
+    @mock.patch('fleeting.jobs.start_scheduler')
+    @mock.patch('fleeting.jobs.RedisSchedule')
+    @mock.patch('fleeting.jobs.job_queue')
+    @mock.patch('fleeting.jobs.start_workers')
+    @mock.patch('fleeting.jobs.RedisJobQueue')
+    @mock.patch('fleeting.prober.readiness_prober')
+    @mock.patch('fleeting.utils.PeriodicTask')
     @mock.patch('fleeting.tempcache.RedisTempCache')
     @mock.patch('os.environ', {
         'SECRET_KEY': 'bleh secret',
@@ -14,10 +26,20 @@ class ProductionTests(unittest.TestCase):
         'AWS_SECURITY_GROUP': 'blah',
         'AWS_ACCESS_KEY_ID': 'apoeg',
         'AWS_SECRET_ACCESS_KEY': 'awegaeg',
-        'REDISTOGO_URL': 'redis://redis.me:6379'
+        'REDISTOGO_URL': 'redis://redis.me:6379',
+        'INVENTORY_POLL_INTERVAL': '45',
+        'JOB_WORKERS': '3',
+        'HTTP_MAX_PER_HOST': '8',
+        'PROFILE_DIR': '/tmp/profiles',
+        'PROFILE_SAMPLE_RATE': '0.01'
     })
     @mock.patch('fleeting.app')
-    def test_production_works(self, app, RedisTempCache):
+    def test_production_works(self, app, RedisTempCache, PeriodicTask,
+                              prober, RedisJobQueue, start_workers,
+                              job_queue, RedisSchedule, start_scheduler,
+                              schedule, HttpClient, client, RedisMetrics,
+                              store):
+        from fleeting import jobs, httpclient, metrics, profiling
         from fleeting import production
 
         app.config.update.assert_called_once_with(
@@ -33,3 +55,34 @@ class ProductionTests(unittest.TestCase):
             url='redis://redis.me:6379'
         )
         self.assertTrue(project.cache is RedisTempCache.return_value)
+        RedisJobQueue.assert_called_once_with(url='redis://redis.me:6379')
+        self.assertTrue(jobs.job_queue is RedisJobQueue.return_value)
+        HttpClient.assert_called_once_with(max_per_host=8)
+        self.assertTrue(httpclient.client is HttpClient.return_value)
+        start_workers.assert_called_once_with(concurrency=3,
+                                              logger=app.logger)
+        RedisSchedule.assert_called_once_with(url='redis://redis.me:6379')
+        self.assertTrue(jobs.schedule is RedisSchedule.return_value)
+        start_scheduler.assert_called_once_with(logger=app.logger)
+        RedisMetrics.assert_called_once_with(url='redis://redis.me:6379')
+        self.assertTrue(metrics.store is RedisMetrics.return_value)
+        self.assertEqual(PeriodicTask.call_args_list, [
+            mock.call(RedisMetrics.return_value.flush, metrics.FLUSH_INTERVAL,
+                      logger=app.logger),
+            mock.call(project.sweep_inventory, 45,
+                      kwargs=dict(interval=45), logger=app.logger),
+            mock.call(jobs.schedule_warm_pool_fills, jobs.WARM_POOL_INTERVAL,
+                      kwargs=dict(key_name='ergerg',
+                                  security_groups=['blah'],
+                                  notify_topic=None),
+                      logger=app.logger)
+        ])
+        self.assertEqual(PeriodicTask.return_value.start.call_count, 3)
+        self.assertEqual(profiling.directory, '/tmp/profiles')
+        self.assertEqual(profiling.sample_rate, 0.01)
+        profiling.directory = None
+        profiling.sample_rate = 0.0
+        self.assertEqual(project.claim_key, 'bleh secret')
+        project.claim_key = None
+        prober.start.assert_called_once_with()
+        self.assertTrue(prober.logger is app.logger)
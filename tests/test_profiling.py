@@ -0,0 +1,113 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import mock
+
+from fleeting import profiling
+
+def write_dump(directory, stem, **info):
+    defaults = dict(endpoint='view_metrics', method='GET', path='/metrics',
+                    status=200, started=0, wall_ms=10, cpu_ms=5,
+                    maxrss_growth_kb=0, object_growth=[])
+    defaults.update(info)
+    with open(os.path.join(directory, stem + '.json'), 'w') as f:
+        json.dump(defaults, f)
+
+class ProfilingTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        profiling.directory = self.dir
+        profiling.sample_rate = 0.0
+
+    def tearDown(self):
+        profiling.directory = None
+        shutil.rmtree(self.dir)
+
+    def test_header_value_is_authorized_until_it_expires(self):
+        value = profiling.make_header_value('s', now=1000)
+        self.assertTrue(value.startswith('4600:'))
+        self.assertTrue(profiling.is_authorized(value, 's', now=4600))
+        self.assertFalse(profiling.is_authorized(value, 's', now=4601))
+
+    def test_header_value_must_match_secret(self):
+        value = profiling.make_header_value('s', now=1000)
+        self.assertFalse(profiling.is_authorized(value, 'u', now=1000))
+        self.assertFalse(profiling.is_authorized('9999:' + value[5:], 's',
+                                                 now=1000))
+
+    def test_malformed_header_values_are_unauthorized(self):
+        for value in ['', 'blah', 'x:y', None]:
+            self.assertFalse(profiling.is_authorized(value, 's'))
+
+    def test_nothing_is_profiled_without_directory(self):
+        profiling.directory = None
+        profiling.sample_rate = 1.0
+        value = profiling.make_header_value('s')
+        self.assertFalse(profiling.should_profile(value, 's'))
+        self.assertFalse(profiling.should_profile(None, 's'))
+
+    def test_header_overrides_sampling(self):
+        profiling.sample_rate = 1.0
+        self.assertTrue(profiling.should_profile(
+            profiling.make_header_value('s'), 's'
+        ))
+        self.assertFalse(profiling.should_profile('bad', 's'))
+
+    @mock.patch('fleeting.profiling.random.random')
+    def test_requests_are_sampled(self, random):
+        random.return_value = 0.25
+        self.assertFalse(profiling.should_profile(None, 's'))
+        profiling.sample_rate = 0.5
+        self.assertTrue(profiling.should_profile(None, 's'))
+
+    def test_request_profile_writes_dumps(self):
+        profile = profiling.RequestProfile().start()
+        stem = profile.stop('project.list', 'GET', '/foo/list', 200)
+        self.assertEqual(os.path.dirname(stem), self.dir)
+        self.assertTrue('-project.list-' in os.path.basename(stem))
+        self.assertTrue(os.path.exists(stem + '.prof'))
+        with open(stem + '.json') as f:
+            info = json.load(f)
+        self.assertEqual(info['path'], '/foo/list')
+        self.assertEqual(info['status'], 200)
+        for key in ['wall_ms', 'cpu_ms', 'maxrss_growth_kb']:
+            self.assertTrue(isinstance(info[key], int))
+        self.assertTrue(len(info['object_growth']) <= profiling.TOP_TYPES)
+
+        dumps = profiling.load_dumps(self.dir)
+        self.assertEqual(len(dumps), 1)
+        self.assertEqual(dumps[0]['profile'], stem + '.prof')
+        stats = profiling.merge_stats(dumps + dumps, stream=StringIO())
+        self.assertTrue(stats.total_calls > 0)
+
+    def test_unsafe_endpoint_names_are_replaced(self):
+        stem = profiling.RequestProfile().start().stop(None, 'GET', '/', 404)
+        self.assertTrue('-unknown-' in stem)
+        stem = profiling.RequestProfile().start().stop('a/../b', 'GET', '/',
+                                                      200)
+        self.assertTrue('-a_.._b-' in stem)
+
+    def test_load_dumps_filters_by_endpoint(self):
+        write_dump(self.dir, 'a', endpoint='x')
+        write_dump(self.dir, 'b', endpoint='y')
+        open(os.path.join(self.dir, 'a.prof'), 'w').close()
+        self.assertEqual([info['endpoint'] for info in
+                          profiling.load_dumps(self.dir, 'y')], ['y'])
+        self.assertEqual(len(profiling.load_dumps(self.dir)), 2)
+
+    def test_summarize_works(self):
+        write_dump(self.dir, 'a', endpoint='x', wall_ms=30, cpu_ms=3)
+        write_dump(self.dir, 'b', endpoint='x', wall_ms=10, cpu_ms=9,
+                   maxrss_growth_kb=12)
+        write_dump(self.dir, 'c', endpoint='x', wall_ms=20)
+        write_dump(self.dir, 'd', endpoint='w', wall_ms=5)
+        summary = profiling.summarize(profiling.load_dumps(self.dir))
+        self.assertEqual([row['endpoint'] for row in summary], ['w', 'x'])
+        self.assertEqual(summary[1], dict(
+            endpoint='x', count=3, median_wall_ms=20, max_wall_ms=30,
+            max_cpu_ms=9, max_maxrss_growth_kb=12
+        ))
@@ -1,12 +1,16 @@
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 import json
 from StringIO import StringIO
 
 import mock
-from boto.exception import BotoServerError
+from boto.exception import BotoServerError, EC2ResponseError
 
-from fleeting import project
-from fleeting.tempcache import DictTempCache
+from fleeting import project, inventory, httpclient
+from fleeting.tempcache import DictTempCache, RedisTempCache
 
 def create_mock_instance(ec2, ready_tag=True):
     tags = {
@@ -27,6 +31,26 @@ def create_mock_instance(ec2, ready_tag=True):
     ec2.return_value.get_all_instances.return_value = [res]
     return instance
 
+def publish_mock_snapshot(ready_tag=True):
+    tags = {
+        'fleeting:openbadges': json.dumps(dict(
+            git_user='toolness',
+            git_branch='experimentz',
+            slug='sluggy'
+        ))
+    }
+    if ready_tag:
+        tags['fleeting:openbadges:ready'] = 'http://foo/'
+    inventory.publish_snapshot(project.cache, {
+        'fleeting:openbadges': [dict(
+            id='i-123',
+            state='running',
+            launch_time='2013-04-29T11:53:42.000Z',
+            public_dns_name='foo',
+            tags=tags
+        )]
+    })
+
 def create_mock_autoscale_group(asc, instance_id=None, **kwargs):
     if not kwargs:
         ag = []
@@ -43,8 +67,9 @@ def create_mock_launch_config(asc):
     asc.return_value.get_all_launch_configurations.return_value = [lc]
     return lc
 
-def create_mock_http_response(http, status, content=''):
+def create_mock_http_response(http, status, content='', headers=None):
     res = mock.MagicMock(status=status)
+    res.get.side_effect = (headers or {}).get
     http.return_value.request.return_value = (res, content)
     return res
 
@@ -53,16 +78,76 @@ def create_server_error(code):
     err.error_code = code
     return err
 
+class ProjectRegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.registry = project.ProjectRegistry(self.dir)
+        self.write_script('foo', 'blah', mtime=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_script(self, name, title, mtime):
+        filename = os.path.join(self.dir, '%s.sh' % name)
+        with open(filename, 'w') as f:
+            f.write('# fleeting-meta:name = %s\n' % title)
+        os.utime(filename, (mtime, mtime))
+
+    def test_get_returns_none_for_unknown_projects(self):
+        self.assertEqual(self.registry.get('nope'), None)
+
+    def test_get_returns_none_for_vanished_scripts(self):
+        self.registry.get_project_map()
+        os.unlink(os.path.join(self.dir, 'foo.sh'))
+        with mock.patch.object(project, '_list_project_scripts') as ls:
+            ls.return_value = {'foo': os.path.join(self.dir, 'foo.sh')}
+            self.assertEqual(self.registry.get('foo'), None)
+
+    def test_get_reuses_parsed_projects(self):
+        proj = self.registry.get('foo')
+        self.assertEqual(proj.meta['name'], 'blah')
+        self.assertTrue(self.registry.get('foo') is proj)
+
+    def test_get_reparses_changed_scripts(self):
+        proj = self.registry.get('foo')
+        self.write_script('foo', 'new blah', mtime=2000)
+        self.assertFalse(self.registry.get('foo') is proj)
+        self.assertEqual(self.registry.get('foo').meta['name'], 'new blah')
+
+    def test_get_project_map_only_lists_changed_dirs(self):
+        with mock.patch.object(project, '_list_project_scripts') as ls:
+            ls.return_value = {}
+            self.registry.get_project_map()
+            self.registry.get_project_map()
+            self.assertEqual(ls.call_count, 1)
+
+    def test_get_all_works(self):
+        self.write_script('bar', 'barry', mtime=1000)
+        with open(os.path.join(self.dir, '.hidden'), 'w') as f:
+            f.write('')
+        self.assertEqual([proj.id for proj in self.registry.get_all()],
+                         ['bar', 'foo'])
+
 class ProjectTests(unittest.TestCase):
     def setUp(self):
         project._ec2_conn = None
         project._ec2_autoscale_conn = None
         project.cache = DictTempCache(project.DEFAULT_CACHE_TTL)
+        httpclient.client = httpclient.HttpClient()
 
     def test_get_project_map_works(self):
         pmap = project.get_project_map()
         self.assertTrue('openbadges' in pmap)
 
+    def test_get_project_works(self):
+        proj = project.get_project('openbadges')
+        self.assertEqual(proj.id, 'openbadges')
+        self.assertTrue(project.get_project('openbadges') is proj)
+
+    def test_get_projects_works(self):
+        ids = [proj.id for proj in project.get_projects()]
+        self.assertTrue('openbadges' in ids)
+
     def test_project_reads_meta_info(self):
         proj = project.Project('openbadges')
         self.assertEqual(proj.meta['name'], 'Open Badges Backpack')
@@ -73,16 +158,118 @@ class ProjectTests(unittest.TestCase):
         url = proj._get_instance_ready_url('boop.org')
         self.assertEqual(url, 'http://boop.org:8888/')
 
+    def test_render_user_data_works(self):
+        proj = project.Project('openbadges')
+        user_data = proj.render_user_data(GIT_USER='uzer',
+                                          GIT_BRANCH='branchu')
+        self.assertTrue('-b branchu' in user_data)
+        self.assertTrue('github.com/uzer/openbadges.git' in user_data)
+        self.assertTrue('authserver.py 9312 output fleeting:fleeting'
+                        in user_data)
+
+    def test_render_user_data_is_memoized(self):
+        proj = project.Project('openbadges')
+        with mock.patch.object(proj, 'compiled_script_template') as t:
+            t.render.return_value = 'SCRIPT'
+            a = proj.render_user_data(GIT_USER='u', GIT_BRANCH='b')
+            b = proj.render_user_data(GIT_USER='u', GIT_BRANCH='b')
+            self.assertEqual(a, b)
+            self.assertEqual(t.render.call_count, 1)
+            proj.render_user_data(GIT_USER='u', GIT_BRANCH='c')
+            self.assertEqual(t.render.call_count, 2)
+
+    def test_render_user_data_memo_ignores_ready_callback(self):
+        proj = project.Project('openbadges')
+        with mock.patch.object(proj, 'compiled_script_template') as t:
+            t.render.return_value = 'SCRIPT'
+            a = proj.render_user_data(GIT_USER='u', GIT_BRANCH='b',
+                                      READY_CALLBACK_URL='http://f/a')
+            b = proj.render_user_data(GIT_USER='u', GIT_BRANCH='b',
+                                      READY_CALLBACK_URL='http://f/b')
+            self.assertEqual(t.render.call_count, 1)
+        self.assertTrue("-X POST 'http://f/a'" in a)
+        self.assertTrue("-X POST 'http://f/b'" in b)
+        self.assertFalse('http://f/a' in b)
+        self.assertFalse(project.READY_CALLBACK_PLACEHOLDER in a)
+
+    @mock.patch('fleeting.project.MAX_CACHED_USER_DATA', 2)
+    def test_render_user_data_evicts_least_recently_used_entries(self):
+        proj = project.Project('openbadges')
+        for branch in ['a', 'b', 'a', 'c']:
+            proj.render_user_data(GIT_USER='u', GIT_BRANCH=branch)
+        self.assertEqual(proj._user_data.keys(), [
+            (('GIT_BRANCH', 'a'), ('GIT_USER', 'u')),
+            (('GIT_BRANCH', 'c'), ('GIT_USER', 'u'))
+        ])
+
     @mock.patch('httplib2.Http')
     def test_does_url_404_returns_true(self, http):
         create_mock_http_response(http, status=404)
         self.assertEqual(project.does_url_404('http://foo.org/'), True)
+        http.assert_called_once_with(timeout=3,
+                                     disable_ssl_certificate_validation=True)
 
     @mock.patch('httplib2.Http')
     def test_does_url_404_returns_false(self, http):
         create_mock_http_response(http, status=200)
         self.assertEqual(project.does_url_404('http://foo.org/'), False)
 
+    @mock.patch('httplib2.Http')
+    def test_does_url_404_accepts_non_ascii_urls(self, http):
+        create_mock_http_response(http, status=404)
+        url = u'https://github.com/j\xf6rg/openbadges/tree/f\xfc'
+        self.assertEqual(project.does_url_404(url), True)
+        self.assertEqual(project.does_url_404(url), True)
+        self.assertEqual(http.return_value.request.call_count, 1)
+
+    @mock.patch('fleeting.project.time')
+    @mock.patch('httplib2.Http')
+    def test_does_url_404_caches_results(self, http, time):
+        time.time.return_value = 1000
+        create_mock_http_response(http, status=404)
+        self.assertEqual(project.does_url_404('http://foo.org/'), True)
+        create_mock_http_response(http, status=200)
+        self.assertEqual(project.does_url_404('http://foo.org/'), True)
+        self.assertEqual(project.does_url_404('http://foo.org/b'), False)
+        self.assertEqual(project.does_url_404('http://foo.org/b'), False)
+        self.assertEqual(http.return_value.request.call_count, 2)
+
+        time.time.return_value = 1000 + project.MISSING_URL_TTL
+        self.assertEqual(project.does_url_404('http://foo.org/'), False)
+        self.assertEqual(project.does_url_404('http://foo.org/b'), False)
+        self.assertEqual(http.return_value.request.call_count, 3)
+
+    @mock.patch('fleeting.project.time')
+    @mock.patch('httplib2.Http')
+    def test_does_url_404_revalidates_with_etag(self, http, time):
+        time.time.return_value = 1000
+        create_mock_http_response(http, status=200, headers={'etag': '"e1"'})
+        self.assertEqual(project.does_url_404('http://foo.org/'), False)
+        http.return_value.request.assert_called_with(
+            'http://foo.org/', method='HEAD', headers={}
+        )
+
+        time.time.return_value = 1000 + project.VALID_URL_TTL
+        create_mock_http_response(http, status=304)
+        self.assertEqual(project.does_url_404('http://foo.org/'), False)
+        http.return_value.request.assert_called_with(
+            'http://foo.org/', method='HEAD', headers={'If-None-Match': '"e1"'}
+        )
+
+        time.time.return_value = 1000 + 2 * project.VALID_URL_TTL
+        create_mock_http_response(http, status=404)
+        self.assertEqual(project.does_url_404('http://foo.org/'), True)
+        http.return_value.request.assert_called_with(
+            'http://foo.org/', method='HEAD', headers={'If-None-Match': '"e1"'}
+        )
+
+    @mock.patch('httplib2.Http')
+    def test_does_url_404_does_not_cache_server_errors(self, http):
+        create_mock_http_response(http, status=503)
+        self.assertEqual(project.does_url_404('http://foo.org/'), False)
+        self.assertEqual(project.does_url_404('http://foo.org/'), False)
+        self.assertEqual(http.return_value.request.call_count, 2)
+
     @mock.patch('fleeting.project.does_url_404')
     def test_create_instance_returns_on_bad_github_info(self, does_url_404):
         does_url_404.return_value = True
@@ -93,30 +280,34 @@ class ProjectTests(unittest.TestCase):
             'https://github.com/uzer/openbadges/tree/branchu'
         )
 
+    @mock.patch('boto.connect_ec2')
     @mock.patch('fleeting.project.AutoScaleConnection')
-    def test_destroy_instance_shuts_down_instances(self, asc):
+    def test_destroy_instance_shuts_down_instances(self, asc, ec2):
         proj = project.Project('openbadges')
         ag = create_mock_autoscale_group(asc, instance_id='k', min_size=1)
         ag.delete.side_effect = create_server_error('ResourceInUse')
         self.assertEqual(proj.destroy_instance('ded'), 'SHUTDOWN_IN_PROGRESS')
 
+    @mock.patch('boto.connect_ec2')
     @mock.patch('fleeting.project.AutoScaleConnection')
-    def test_destroy_instance_catches_misc_autoscale_errors(self, asc):
+    def test_destroy_instance_catches_misc_autoscale_errors(self, asc, ec2):
         proj = project.Project('openbadges')
         ag = create_mock_autoscale_group(asc, instance_id='k', min_size=1)
         ag.delete.side_effect = create_server_error('Oopsie')
         self.assertEqual(proj.destroy_instance('ded'), 'ERROR:Oopsie')
 
+    @mock.patch('boto.connect_ec2')
     @mock.patch('fleeting.project.AutoScaleConnection')
-    def test_destroy_instance_catches_misc_launch_config_errors(self, asc):
+    def test_destroy_instance_catches_misc_launch_config_errors(self, asc, ec2):
         proj = project.Project('openbadges')
         ag = create_mock_autoscale_group(asc, instance_id='k', min_size=1)
         lc = create_mock_launch_config(asc)
         lc.delete.side_effect = create_server_error('Ack')
         self.assertEqual(proj.destroy_instance('ded'), 'ERROR:Ack')
 
+    @mock.patch('boto.connect_ec2')
     @mock.patch('fleeting.project.AutoScaleConnection')
-    def test_destroy_instance_returns_not_found(self, asc):
+    def test_destroy_instance_returns_not_found(self, asc, ec2):
         proj = project.Project('openbadges')
         ascrv = asc.return_value
 
@@ -125,8 +316,9 @@ class ProjectTests(unittest.TestCase):
 
         self.assertEqual(proj.destroy_instance('ded'), 'NOT_FOUND')
 
+    @mock.patch('boto.connect_ec2')
     @mock.patch('fleeting.project.AutoScaleConnection')
-    def test_destroy_instance_adds_cache_entry(self, asc):
+    def test_destroy_instance_adds_cache_entry(self, asc, ec2):
         proj = project.Project('openbadges')
         ag = create_mock_autoscale_group(asc, instance_id='k', min_size=1)
         lc = create_mock_launch_config(asc)
@@ -136,8 +328,9 @@ class ProjectTests(unittest.TestCase):
             'state': 'terminated'
         }])
 
+    @mock.patch('boto.connect_ec2')
     @mock.patch('fleeting.project.AutoScaleConnection')
-    def test_destroy_instance_returns_done(self, asc):
+    def test_destroy_instance_returns_done(self, asc, ec2):
         proj = project.Project('openbadges')
         ag = create_mock_autoscale_group(asc, instance_id='k', min_size=1)
         lc = create_mock_launch_config(asc)
@@ -213,7 +406,29 @@ class ProjectTests(unittest.TestCase):
             # TODO: Ensure conn.put_notification_configuration() is ok
 
     @mock.patch('fleeting.project.AutoScaleConnection')
-    def test_get_instance_status_returns_not_found(self, asc):
+    @mock.patch('fleeting.project.does_url_404', lambda x: False)
+    def test_create_instance_reports_steps(self, asc):
+        proj = project.Project('openbadges')
+        ag = create_mock_autoscale_group(asc, instances=[], min_size=0)
+        on_step = mock.MagicMock()
+        with mock.patch.object(proj, 'cleanup_instances') as ci:
+            proj.create_instance('z', 'uzer', 'branchu', 'key',
+                                 security_groups=['defaultr'],
+                                 notify_topic='notifytopik',
+                                 on_step=on_step)
+        self.assertEqual([c[0][0] for c in on_step.call_args_list], [
+            'validate_git_info',
+            'check_existing_instance',
+            'cleanup_instances',
+            'create_launch_configuration',
+            'create_auto_scaling_group',
+            'create_scheduled_group_action',
+            'put_notification_configuration'
+        ])
+
+    @mock.patch('boto.connect_ec2')
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_get_instance_status_returns_not_found(self, asc, ec2):
         proj = project.Project('openbadges')
         ag = create_mock_autoscale_group(asc)
         self.assertEqual(proj.get_instance_status('zzz'),
@@ -222,15 +437,17 @@ class ProjectTests(unittest.TestCase):
             names=['fleeting_autoscale_openbadges_zzz']
         )
 
+    @mock.patch('boto.connect_ec2')
     @mock.patch('fleeting.project.AutoScaleConnection')
-    def test_get_instance_status_returns_instance_not_yet_exists(self, asc):
+    def test_get_instance_status_returns_instance_not_yet_exists(self, asc, ec2):
         proj = project.Project('openbadges')
         ag = create_mock_autoscale_group(asc, instances=[], min_size=1)
         self.assertEqual(proj.get_instance_status('zzz'),
                          ('INSTANCE_DOES_NOT_YET_EXIST', None))
 
+    @mock.patch('boto.connect_ec2')
     @mock.patch('fleeting.project.AutoScaleConnection')
-    def test_get_instance_status_returns_instance_does_not_exist(self, asc):
+    def test_get_instance_status_returns_instance_does_not_exist(self, asc, ec2):
         proj = project.Project('openbadges')
         ag = create_mock_autoscale_group(asc, instances=[], min_size=0)
         self.assertEqual(proj.get_instance_status('zzz'),
@@ -251,7 +468,8 @@ class ProjectTests(unittest.TestCase):
 
         h = http.return_value
         h.add_credentials.assert_called_once_with('fleeting', 'fleeting')
-        h.request.assert_called_once_with('http://foo.org:9312/log.txt')
+        h.request.assert_called_once_with('http://foo.org:9312/log.txt',
+                                          method='GET', headers={})
 
     @mock.patch('httplib2.Http')
     def test_get_instance_authserver_log_returns_empty_str(self, http):
@@ -260,6 +478,32 @@ class ProjectTests(unittest.TestCase):
         inst = mock.MagicMock(state='running', public_dns_name='foo.org')
         self.assertEqual(proj.get_instance_authserver_log(inst), '')
 
+    @mock.patch('httplib2.Http')
+    def test_get_instance_authserver_log_requests_range(self, http):
+        proj = project.Project('openbadges')
+        create_mock_http_response(http, status=206, content='new')
+        inst = mock.MagicMock(state='running', public_dns_name='foo.org')
+        self.assertEqual(proj.get_instance_authserver_log(inst, 10), 'new')
+        http.return_value.request.assert_called_once_with(
+            'http://foo.org:9312/log.txt', method='GET',
+            headers={'Range': 'bytes=10-'}
+        )
+
+    @mock.patch('httplib2.Http')
+    def test_get_instance_authserver_log_slices_full_responses(self, http):
+        proj = project.Project('openbadges')
+        create_mock_http_response(http, status=200, content='oldnew')
+        inst = mock.MagicMock(state='running', public_dns_name='foo.org')
+        self.assertEqual(proj.get_instance_authserver_log(inst, 3), 'new')
+
+    @mock.patch('httplib2.Http')
+    def test_get_instance_authserver_log_handles_unsatisfiable_range(self,
+                                                                     http):
+        proj = project.Project('openbadges')
+        create_mock_http_response(http, status=416, content='bad range')
+        inst = mock.MagicMock(state='running', public_dns_name='foo.org')
+        self.assertEqual(proj.get_instance_authserver_log(inst, 3), '')
+
     def test_get_instance_log_returns_nonempty_str(self):
         proj = project.Project('openbadges')
         inst = mock.MagicMock()
@@ -272,6 +516,84 @@ class ProjectTests(unittest.TestCase):
         inst.get_console_output.return_value.output = None
         self.assertEqual(proj.get_instance_log(inst), "")
 
+    @mock.patch('fleeting.tempcache.redis')
+    def test_get_instance_log_replaces_invalid_utf8(self, redis):
+        project.cache = RedisTempCache(project.DEFAULT_CACHE_TTL)
+        proj = project.Project('openbadges')
+        inst = mock.MagicMock(id='i-1')
+        console = inst.get_console_output.return_value
+        console.output = 'ok \xff\xfe \xc3\xa9'
+        console.timestamp = None
+        self.assertEqual(proj.get_instance_log(inst),
+                         u'ok \ufffd\ufffd \xe9')
+        pipe = project.cache.redis.pipeline.return_value
+        self.assertEqual(json.loads(pipe.set.call_args[0][1])['output'],
+                         u'ok \ufffd\ufffd \xe9')
+
+    def test_parse_ec2_timestamp_works(self):
+        self.assertEqual(project.parse_ec2_timestamp('1970-01-01T00:01:40.000Z'),
+                         100)
+        self.assertEqual(project.parse_ec2_timestamp(None), None)
+
+    @mock.patch('time.time')
+    def test_get_instance_log_caches_until_update_is_plausible(self, t):
+        proj = project.Project('openbadges')
+        inst = mock.MagicMock(id='i-1')
+        console = inst.get_console_output.return_value
+        console.output = 'LOL'
+        console.timestamp = '1970-01-01T00:01:40.000Z'
+        t.return_value = 110
+        self.assertEqual(proj.get_instance_log(inst), 'LOL')
+        console.output = 'NEW'
+        t.return_value = 100 + project.CONSOLE_UPDATE_INTERVAL - 1
+        self.assertEqual(proj.get_instance_log(inst), 'LOL')
+        self.assertEqual(inst.get_console_output.call_count, 1)
+        t.return_value = 100 + project.CONSOLE_UPDATE_INTERVAL
+        self.assertEqual(proj.get_instance_log(inst), 'NEW')
+        self.assertEqual(inst.get_console_output.call_count, 2)
+
+    @mock.patch('time.time')
+    def test_get_instance_log_rechecks_stale_timestamps(self, t):
+        proj = project.Project('openbadges')
+        inst = mock.MagicMock(id='i-1')
+        console = inst.get_console_output.return_value
+        console.output = 'LOL'
+        console.timestamp = '1970-01-01T00:00:00.000Z'
+        t.return_value = 1000
+        proj.get_instance_log(inst)
+        t.return_value = 1000 + project.CONSOLE_RECHECK_INTERVAL - 1
+        proj.get_instance_log(inst)
+        self.assertEqual(inst.get_console_output.call_count, 1)
+        t.return_value = 1000 + project.CONSOLE_RECHECK_INTERVAL
+        proj.get_instance_log(inst)
+        self.assertEqual(inst.get_console_output.call_count, 2)
+
+    def test_get_instance_log_collapses_concurrent_fetches(self):
+        proj = project.Project('openbadges')
+        inst = mock.MagicMock(id='i-1')
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def get_console_output():
+            started.set()
+            release.wait()
+            return mock.MagicMock(output='LOL', timestamp=None)
+
+        inst.get_console_output.side_effect = get_console_output
+        viewers = [threading.Thread(
+            target=lambda: results.append(proj.get_instance_log(inst))
+        ) for i in range(3)]
+        viewers[0].start()
+        started.wait()
+        for viewer in viewers[1:]:
+            viewer.start()
+        release.set()
+        for viewer in viewers:
+            viewer.join()
+        self.assertEqual(results, ['LOL'] * 3)
+        self.assertEqual(inst.get_console_output.call_count, 1)
+
     @mock.patch('boto.connect_ec2')
     def test_get_instance_returns_none(self, ec2):
         proj = project.Project('openbadges')
@@ -286,7 +608,7 @@ class ProjectTests(unittest.TestCase):
         inst = create_mock_instance(ec2)
         self.assertEqual(proj.get_instance_status('zzz'),
                          ('READY', 'http://foo/'))
-        ec2.return_value.get_all_instances.assert_called_once_with(['z'])
+        ec2.return_value.get_all_instances.assert_called_with(['z'])
 
     @mock.patch('boto.connect_ec2')
     @mock.patch('fleeting.project.AutoScaleConnection')
@@ -329,6 +651,15 @@ class ProjectTests(unittest.TestCase):
         inst.add_tag.assert_called_once_with('fleeting:openbadges:ready',
                                              'http://u.org:8888/')
 
+    @mock.patch('httplib2.Http')
+    def test_ping_ready_url_records_timings(self, http):
+        inst = mock.MagicMock(state='running', public_dns_name='u.org')
+        create_mock_http_response(http, status=200)
+        proj = project.Project('openbadges')
+        with mock.patch.object(proj, 'record_timings') as record_timings:
+            proj._ping_ready_url(inst)
+        record_timings.assert_called_once_with(inst)
+
     @mock.patch('boto.connect_ec2')
     @mock.patch('fleeting.project.AutoScaleConnection')
     def test_project_cleanup_instances_works(self, asc, ec2):
@@ -339,9 +670,12 @@ class ProjectTests(unittest.TestCase):
         lc = create_mock_launch_config(asc)
         lc.delete.side_effect = Exception()
 
-        deleted, errors = proj.cleanup_instances()
-        self.assertEqual(deleted, 1)
-        self.assertEqual(errors, 1)
+        summary = proj.cleanup_instances()
+        self.assertEqual(summary['deleted'], 1)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['api_calls'], 5)
+        self.assertTrue(summary['lookup_time'] >= 0)
+        self.assertTrue(summary['delete_time'] >= 0)
 
         ec2.assert_called_once_with()
         ec2.return_value.get_all_instances.assert_called_once_with(
@@ -357,6 +691,49 @@ class ProjectTests(unittest.TestCase):
         ag.delete.assert_called_once_with()
         lc.delete.assert_called_once_with()
 
+    @mock.patch('boto.connect_ec2')
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_project_cleanup_instances_batches_lookups(self, asc, ec2):
+        proj = project.Project('openbadges')
+        ec2.return_value.get_all_instances.return_value = [
+            mock.MagicMock(instances=[mock.MagicMock(tags={
+                'fleeting:openbadges': json.dumps(dict(slug='s%d' % i))
+            })]) for i in range(3)
+        ]
+        busy = mock.MagicMock(min_size=1, instances=[])
+        idle = mock.MagicMock(min_size=0, instances=[])
+        idle2 = mock.MagicMock(min_size=0, instances=[])
+        asc.return_value.get_all_groups.side_effect = [[busy, idle], [idle2]]
+        asc.return_value.get_all_launch_configurations.return_value = []
+
+        with mock.patch.object(project, 'AUTOSCALE_NAMES_PER_CALL', 2):
+            summary = proj.cleanup_instances()
+
+        self.assertEqual(asc.return_value.get_all_groups.call_args_list, [
+            mock.call(names=['fleeting_autoscale_openbadges_s0',
+                             'fleeting_autoscale_openbadges_s1']),
+            mock.call(names=['fleeting_autoscale_openbadges_s2'])
+        ])
+        self.assertEqual(busy.delete.call_count, 0)
+        idle.delete.assert_called_once_with()
+        idle2.delete.assert_called_once_with()
+        self.assertEqual(summary['deleted'], 2)
+        self.assertEqual(summary['api_calls'], 7)
+
+    def test_get_all_autoscale_pages_follows_next_token(self):
+        class Page(list):
+            next_token = None
+
+        first, second = Page(['a']), Page(['b'])
+        first.next_token = 'tok'
+        method = mock.MagicMock(side_effect=[first, second])
+        self.assertEqual(project.get_all_autoscale_pages(method, ['x']),
+                         (['a', 'b'], 2))
+        self.assertEqual(method.call_args_list, [
+            mock.call(names=['x']),
+            mock.call(names=['x'], next_token='tok')
+        ])
+
     @mock.patch('boto.connect_ec2')
     def test_project_get_instances_works(self, connect_ec2):
         create_mock_instance(connect_ec2)
@@ -399,3 +776,773 @@ class ProjectTests(unittest.TestCase):
             state='terminated'
         )
         self.assertEqual(proj.get_instances(), [])
+
+    @mock.patch('boto.connect_ec2')
+    def test_project_get_instances_uses_snapshot(self, connect_ec2):
+        publish_mock_snapshot()
+        proj = project.Project('openbadges')
+        self.assertEqual(proj.get_instances(), [{
+            'url': 'http://foo/',
+            'state': 'running',
+            'git_user': 'toolness',
+            'git_branch': 'experimentz',
+            'slug': 'sluggy',
+            'git_branch_url': 'https://github.com/toolness/openbadges/tree/experimentz',
+            'launch_time': '2013-04-29T11:53:42.000Z'
+        }])
+        self.assertEqual(connect_ec2.return_value.get_all_instances.call_count,
+                         0)
+
+    @mock.patch('boto.connect_ec2')
+    def test_project_get_instances_ignores_snapshot_without_project(self,
+                                                                    ec2):
+        inventory.publish_snapshot(project.cache, {'fleeting:other': []})
+        create_mock_instance(ec2)
+        proj = project.Project('openbadges')
+        self.assertEqual(len(proj.get_instances()), 1)
+        self.assertEqual(ec2.return_value.get_all_instances.call_count, 1)
+
+    def test_get_instances_version_needs_snapshot(self):
+        proj = project.Project('openbadges')
+        self.assertEqual(proj.get_instances_version(), None)
+
+    def test_get_instances_version_tracks_inventory_and_cache(self):
+        proj = project.Project('openbadges')
+        publish_mock_snapshot(ready_tag=False)
+        v1 = proj.get_instances_version()
+        self.assertEqual(v1, proj.get_instances_version())
+        proj.set_ready_url('sluggy', 'http://foo/')
+        v2 = proj.get_instances_version()
+        self.assertNotEqual(v1, v2)
+        publish_mock_snapshot(ready_tag=True)
+        self.assertNotEqual(v2, proj.get_instances_version())
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_uses_snapshot(self, ec2):
+        publish_mock_snapshot()
+        inst = create_mock_instance(ec2)
+        proj = project.Project('openbadges')
+        self.assertEqual(proj.get_instance('sluggy'), inst)
+        ec2.return_value.get_all_instances.assert_called_once_with(
+            instance_ids=['i-123']
+        )
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_handles_vanished_snapshot_instance(self, ec2):
+        publish_mock_snapshot()
+        ec2.return_value.get_all_instances.return_value = []
+        proj = project.Project('openbadges')
+        self.assertEqual(proj.get_instance('sluggy'), None)
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_returns_none_when_not_in_snapshot(self, ec2):
+        publish_mock_snapshot()
+        proj = project.Project('openbadges')
+        self.assertEqual(proj.get_instance('blop'), None)
+        self.assertEqual(ec2.return_value.get_all_instances.call_count, 0)
+
+    @mock.patch('boto.connect_ec2')
+    def test_sweep_inventory_publishes_snapshot(self, ec2):
+        inst = create_mock_instance(ec2)
+        inst.id = 'i-123'
+        inst.public_dns_name = 'foo'
+        self.assertEqual(project.sweep_inventory(), 1)
+        snapshot = inventory.read_snapshot(project.cache)
+        self.assertEqual(len(snapshot['instances']['fleeting:openbadges']),
+                         1)
+        filters = ec2.return_value.get_all_instances.call_args[1]['filters']
+        self.assertTrue('fleeting:openbadges' in filters['tag-key'])
+
+    @mock.patch('boto.connect_ec2')
+    def test_sweep_inventory_skips_fresh_snapshots(self, ec2):
+        publish_mock_snapshot()
+        self.assertEqual(project.sweep_inventory(), 1)
+        self.assertEqual(ec2.return_value.get_all_instances.call_count, 0)
+
+    @mock.patch('boto.connect_ec2')
+    def test_project_get_instances_merges_ready_urls(self, connect_ec2):
+        create_mock_instance(connect_ec2, ready_tag=False)
+        proj = project.Project('openbadges')
+        proj.set_ready_url('sluggy', 'http://probed/')
+        proj.set_ready_url('gone', 'http://gone/')
+        instances = proj.get_instances()
+        self.assertEqual(len(instances), 1)
+        self.assertEqual(instances[0]['url'], 'http://probed/')
+
+    @mock.patch('httplib2.Http')
+    def test_check_ready_url_does_not_add_tag(self, http):
+        inst = mock.MagicMock(state='running', public_dns_name='u.org')
+        create_mock_http_response(http, status=200)
+        self.assertEqual(project.Project('openbadges').check_ready_url(inst),
+                         ('READY', 'http://u.org:8888/'))
+        self.assertEqual(inst.add_tag.call_count, 0)
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_uses_index(self, ec2):
+        proj = project.Project('openbadges')
+        proj._index_instance('sluggy', 'i-456')
+        inst = create_mock_instance(ec2)
+        self.assertEqual(proj.get_instance('sluggy'), inst)
+        ec2.return_value.get_all_instances.assert_called_once_with(
+            instance_ids=['i-456']
+        )
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_indexes_rebuilt_instances(self, ec2):
+        proj = project.Project('openbadges')
+        inst = create_mock_instance(ec2)
+        inst.id = 'i-789'
+        self.assertEqual(proj.get_instance('sluggy'), inst)
+        self.assertEqual(proj._lookup_instance_id('sluggy'), 'i-789')
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_ignores_index_prefix_matches(self, ec2):
+        proj = project.Project('openbadges')
+        proj._index_instance('sluggy2', 'i-2')
+        self.assertEqual(proj._lookup_instance_id('sluggy'), None)
+
+    @mock.patch('boto.connect_ec2')
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_get_instance_returns_none_after_destroy(self, asc, ec2):
+        proj = project.Project('openbadges')
+        create_mock_autoscale_group(asc, instance_id='k', min_size=1)
+        proj._index_instance('sluggy', 'i-456')
+        proj.destroy_instance('sluggy')
+        self.assertEqual(proj.get_instance('sluggy'), None)
+        self.assertEqual(ec2.return_value.get_all_instances.call_count, 0)
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_forgets_missing_instances(self, ec2):
+        proj = project.Project('openbadges')
+        proj._index_instance('sluggy', 'i-456')
+        ec2.return_value.get_all_instances.side_effect = [
+            EC2ResponseError(400, 'Bad Request'),
+            []
+        ]
+        self.assertEqual(proj.get_instance('sluggy'), None)
+        self.assertEqual(proj._lookup_instance_id('sluggy'), '')
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_forgets_terminated_instances(self, ec2):
+        proj = project.Project('openbadges')
+        proj._index_instance('sluggy', 'i-456')
+        inst = create_mock_instance(ec2)
+        inst.state = 'terminated'
+        ec2.return_value.get_all_instances.side_effect = [
+            ec2.return_value.get_all_instances.return_value,
+            []
+        ]
+        self.assertEqual(proj.get_instance('sluggy'), None)
+        self.assertEqual(proj._lookup_instance_id('sluggy'), '')
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_rechecks_missing_instances_in_new_snapshots(self,
+                                                                      ec2):
+        inventory.publish_snapshot(project.cache, {'fleeting:openbadges': []})
+        proj = project.Project('openbadges')
+        self.assertEqual(proj.get_instance('sluggy'), None)
+        self.assertEqual(proj._lookup_instance_id('sluggy'), '')
+        # Lookups before the inventory changes don't extend the tombstone.
+        with mock.patch.object(project.cache, 'set') as cache_set:
+            self.assertEqual(proj.get_instance('sluggy'), None)
+            self.assertEqual(cache_set.call_count, 0)
+
+        publish_mock_snapshot()
+        inst = create_mock_instance(ec2)
+        self.assertEqual(proj.get_instance('sluggy'), inst)
+        ec2.return_value.get_all_instances.assert_called_once_with(
+            instance_ids=['i-123']
+        )
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_tombstones_expire(self, ec2):
+        proj = project.Project('openbadges')
+        with mock.patch.object(project.cache, 'set') as cache_set:
+            self.assertEqual(proj.get_instance('sluggy'), None)
+        self.assertEqual(cache_set.call_args[1]['ttl'],
+                         project.INDEX_TOMBSTONE_TTL)
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_finds_replaced_instances(self, ec2):
+        proj = project.Project('openbadges')
+        proj._index_instance('sluggy', 'i-old')
+        inst = create_mock_instance(ec2)
+        inst.id = 'i-new'
+        ec2.return_value.get_all_instances.side_effect = [
+            EC2ResponseError(400, 'Bad Request'),
+            ec2.return_value.get_all_instances.return_value
+        ]
+        self.assertEqual(proj.get_instance('sluggy'), inst)
+        self.assertEqual(proj._lookup_instance_id('sluggy'), 'i-new')
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_instance_finds_replaced_snapshot_instances(self, ec2):
+        publish_mock_snapshot()
+        proj = project.Project('openbadges')
+        proj._index_instance('sluggy', 'i-old')
+        inst = create_mock_instance(ec2)
+        ec2.return_value.get_all_instances.side_effect = [
+            [], ec2.return_value.get_all_instances.return_value
+        ]
+        self.assertEqual(proj.get_instance('sluggy'), inst)
+        self.assertEqual(ec2.return_value.get_all_instances.call_args_list, [
+            mock.call(instance_ids=['i-old']),
+            mock.call(instance_ids=['i-123'])
+        ])
+
+WARM_SCRIPT = """\
+# fleeting-meta:name          = Warm
+# fleeting-meta:repo          = mozilla/warm
+# fleeting-meta:image-id      = ami-1
+# fleeting-meta:instance-type = t1.micro
+# fleeting-meta:ready-url     = http://localhost:8888/
+# fleeting-meta:warm-pool     = 2
+apt-get install generic-stuff
+
+# fleeting-branch-steps
+git clone -b {{GIT_BRANCH}} git://github.com/{{GIT_USER}}/warm.git
+"""
+
+def warm_desc(slug, instance_id='i-w', state='running', **info):
+    info.setdefault('warm', True)
+    return dict(
+        id=instance_id,
+        state=state,
+        launch_time='2013-04-29T11:53:42.000Z',
+        public_dns_name='%s.org' % slug,
+        tags={'fleeting:warm': json.dumps(dict(info, slug=slug))}
+    )
+
+class WarmPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.script_path = os.path.join(self.dir, 'warm.sh')
+        with open(self.script_path, 'w') as f:
+            f.write(WARM_SCRIPT)
+        self.proj = project.Project('warm', self.script_path)
+        project._ec2_conn = None
+        project._ec2_autoscale_conn = None
+        project.cache = DictTempCache(project.DEFAULT_CACHE_TTL)
+        httpclient.client = httpclient.HttpClient()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def publish(self, *descs):
+        inventory.publish_snapshot(project.cache, {'fleeting:warm': descs})
+
+    @mock.patch('fleeting.project.claim_key', 'k')
+    def test_claim_secrets_survive_restarts(self):
+        secret = self.proj._get_claim_secret('warm-1-0')
+        self.assertEqual(project.Project('warm', self.script_path)
+                         ._get_claim_secret('warm-1-0'), secret)
+        self.assertNotEqual(self.proj._get_claim_secret('warm-1-1'), secret)
+        with mock.patch('fleeting.project.claim_key', 'other'):
+            self.assertNotEqual(self.proj._get_claim_secret('warm-1-0'),
+                                secret)
+
+    def test_warm_pool_size_requires_branch_steps_marker(self):
+        self.assertEqual(self.proj.warm_pool_size, 2)
+        with open(self.script_path, 'w') as f:
+            f.write(WARM_SCRIPT.replace('# fleeting-branch-steps', ''))
+        self.assertEqual(project.Project('warm', self.script_path)
+                         .warm_pool_size, 0)
+        self.assertEqual(project.Project('openbadges').warm_pool_size, 0)
+
+    def test_script_is_split_at_branch_steps(self):
+        user_data = self.proj.render_warm_user_data('s3cret')
+        self.assertTrue('generic-stuff' in user_data)
+        self.assertTrue("FLEETING_CLAIM_SECRET='s3cret'" in user_data)
+        self.assertTrue('git clone' not in user_data)
+        self.assertTrue(project.WARM_WAIT_SCRIPT in user_data)
+        steps = self.proj.render_branch_steps('uzer', 'branchu')
+        self.assertTrue('generic-stuff' not in steps)
+        self.assertTrue('-b branchu git://github.com/uzer/warm.git' in steps)
+
+    def test_get_instances_hides_warm_instances(self):
+        self.publish(warm_desc('warm-1-0'),
+                     warm_desc('z', 'i-z', warm=False, git_user='u',
+                               git_branch='b'))
+        self.proj._set_cache_entry('warm-1-1', dict(
+            slug='warm-1-1', warm=True, state='pending'
+        ))
+        self.assertEqual([i['slug'] for i in self.proj.get_instances()],
+                         ['z'])
+
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_fill_warm_pool_creates_missing_instances(self, asc):
+        self.publish(warm_desc('warm-1-0'))
+        self.assertEqual(self.proj.fill_warm_pool('key', ['g'], 'topic'), 1)
+        conn = asc.return_value
+        ag = conn.create_auto_scaling_group.call_args[0][0]
+        self.assertTrue(ag.name.startswith('fleeting_autoscale_warm_warm-'))
+        info = json.loads(ag.tags[0].value)
+        self.assertEqual(info['warm'], True)
+        lc = conn.create_launch_configuration.call_args[0][0]
+        self.assertTrue(project.WARM_WAIT_SCRIPT in lc.user_data)
+        self.assertEqual(conn.put_notification_configuration.call_count, 1)
+        secret = self.proj._get_claim_secret(info['slug'])
+        self.assertTrue("FLEETING_CLAIM_SECRET='%s'" % secret in lc.user_data)
+
+        self.assertEqual(self.proj.fill_warm_pool('key', ['g']), 0)
+        self.assertEqual(conn.create_auto_scaling_group.call_count, 1)
+
+    @mock.patch('fleeting.project.does_url_404', lambda x: False)
+    @mock.patch('httplib2.Http')
+    @mock.patch('boto.connect_ec2')
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_create_instance_claims_warm_instance(self, asc, ec2, http):
+        self.publish(warm_desc('warm-2-0', 'i-new'),
+                     warm_desc('warm-1-0', 'i-old', state='pending'))
+        create_mock_autoscale_group(asc)
+        create_mock_http_response(http, status=201)
+        on_step = mock.MagicMock()
+        with mock.patch.object(self.proj, 'cleanup_instances'):
+            r = self.proj.create_instance('z', 'uzer', 'branchu', 'key',
+                                          ['g'], on_step=on_step,
+                                          ready_callback='http://f/cb')
+        self.assertEqual(r, 'DONE')
+        self.assertEqual(on_step.call_args_list[-1],
+                         mock.call('claim_warm_instance'))
+        url, kwargs = http.return_value.request.call_args
+        self.assertEqual(url, ('http://warm-2-0.org:9312/branch-steps',))
+        self.assertEqual(kwargs['method'], 'PUT')
+        self.assertEqual(kwargs['headers']['X-Fleeting-Claim'],
+                         self.proj._get_claim_secret('warm-2-0'))
+        self.assertTrue('git://github.com/uzer/warm.git' in kwargs['body'])
+        self.assertTrue("-X POST 'http://f/cb'" in kwargs['body'])
+
+        conn = asc.return_value
+        self.assertEqual(conn.create_launch_configuration.call_count, 0)
+        ids, tags = ec2.return_value.create_tags.call_args[0]
+        self.assertEqual(ids, ['i-new'])
+        info = json.loads(tags['fleeting:warm'])
+        self.assertEqual(info['group'], 'warm-2-0')
+        self.assertEqual(info['slug'], 'z')
+        tag = conn.create_or_update_tags.call_args[0][0][0]
+        self.assertEqual(tag.resource_id, 'fleeting_autoscale_warm_warm-2-0')
+        self.assertEqual(conn.create_scheduled_group_action.call_args[0][:2],
+                         ('fleeting_autoscale_warm_warm-2-0',
+                          'fleeting_autoscale_warm_warm-2-0_shutdown-action'))
+        self.assertEqual(self.proj._lookup_instance_id('z'), 'i-new')
+        self.assertEqual(self.proj._get_group_slug('z'), 'warm-2-0')
+        listed = self.proj.get_instances()
+        self.assertEqual([(i['slug'], i['state'], i['group'])
+                          for i in listed], [('z', 'pending', 'warm-2-0')])
+
+    @mock.patch('fleeting.project.does_url_404', lambda x: False)
+    @mock.patch('httplib2.Http')
+    @mock.patch('boto.connect_ec2')
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_fill_warm_pool_replaces_claimed_instances(self, asc, ec2, http):
+        self.publish(warm_desc('warm-1-0', 'i-1'), warm_desc('warm-2-0', 'i-2'))
+        create_mock_autoscale_group(asc)
+        create_mock_http_response(http, status=201)
+        with mock.patch.object(self.proj, 'cleanup_instances'):
+            self.proj.create_instance('z', 'uzer', 'branchu', 'key', ['g'])
+        self.assertEqual(self.proj.get_instances()[0]['group'], 'warm-1-0')
+        # The snapshot still lists warm-1-0 as warm until the next sweep.
+        self.assertEqual(self.proj._get_warm_slugs(), set(['warm-2-0']))
+        self.assertEqual(self.proj.fill_warm_pool('key', ['g']), 1)
+
+    @mock.patch('fleeting.project.does_url_404', lambda x: False)
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_create_instance_falls_back_when_claims_fail(self, asc):
+        self.publish(warm_desc('warm-1-0', 'i-1'), warm_desc('warm-2-0', 'i-2'))
+        create_mock_autoscale_group(asc)
+        responses = [Exception('socket err'),
+                     (mock.MagicMock(status=409), '')]
+        with mock.patch('fleeting.httpclient.request') as request:
+            request.side_effect = lambda *a, **kw: (
+                responses.pop(0) if isinstance(responses[0], tuple)
+                else (_ for _ in ()).throw(responses.pop(0))
+            )
+            with mock.patch.object(self.proj, 'cleanup_instances'):
+                self.proj.create_instance('z', 'uzer', 'branchu', 'key', ['g'])
+            self.assertEqual(request.call_count, 2)
+        ag = asc.return_value.create_auto_scaling_group.call_args[0][0]
+        self.assertEqual(ag.name, 'fleeting_autoscale_warm_z')
+
+    @mock.patch('fleeting.project.does_url_404', lambda x: False)
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_create_instance_goes_cold_without_warm_instances(self, asc):
+        self.publish()
+        create_mock_autoscale_group(asc)
+        with mock.patch.object(self.proj, 'cleanup_instances'):
+            self.proj.create_instance('z', 'uzer', 'branchu', 'key', ['g'])
+        lc = asc.return_value.create_launch_configuration.call_args[0][0]
+        self.assertTrue('generic-stuff' in lc.user_data)
+        self.assertTrue('git://github.com/uzer/warm.git' in lc.user_data)
+
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_destroy_instance_uses_claimed_group(self, asc):
+        self.publish(warm_desc('z', warm=False, group='warm-1-0',
+                               git_user='u', git_branch='b'))
+        create_mock_autoscale_group(asc)
+        asc.return_value.get_all_launch_configurations.return_value = []
+        self.assertEqual(self.proj.destroy_instance('z'), 'NOT_FOUND')
+        asc.return_value.get_all_groups.assert_called_once_with(
+            names=['fleeting_autoscale_warm_warm-1-0']
+        )
+        asc.return_value.get_all_launch_configurations.assert_called_once_with(
+            names=['fleeting_launchconfig_warm_warm-1-0']
+        )
+        self.assertEqual(self.proj._get_group_slug('other'), 'other')
+        # Destroying the instance doesn't forget where it was launched.
+        self.publish()
+        self.assertEqual(self.proj._get_group_slug('z'), 'warm-1-0')
+
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_get_instance_status_uses_claimed_group_without_pool(self, asc):
+        self.proj.warm_pool_size = 0
+        self.proj._index_instance('z', 'i-w', 'warm-1-0')
+        create_mock_autoscale_group(asc)
+        self.assertEqual(self.proj.get_instance_status('z'),
+                         ('NOT_FOUND', None))
+        asc.return_value.get_all_groups.assert_called_once_with(
+            names=['fleeting_autoscale_warm_warm-1-0']
+        )
+
+    @mock.patch('boto.connect_ec2')
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_cleanup_instances_uses_claimed_group(self, asc, ec2):
+        inst = mock.MagicMock(tags={'fleeting:warm': json.dumps(dict(
+            slug='z', group='warm-1-0'
+        ))})
+        ec2.return_value.get_all_instances.return_value = [
+            mock.MagicMock(instances=[inst])
+        ]
+        asc.return_value.get_all_groups.return_value = []
+        asc.return_value.get_all_launch_configurations.return_value = []
+        self.proj.cleanup_instances()
+        asc.return_value.get_all_groups.assert_called_once_with(
+            names=['fleeting_autoscale_warm_warm-1-0']
+        )
+
+class BakeTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.script_path = os.path.join(self.dir, 'warm.sh')
+        self.write_script(WARM_SCRIPT + '# fleeting-meta:bake = yes\n')
+        project._ec2_conn = None
+        project._ec2_autoscale_conn = None
+        project.cache = DictTempCache(project.DEFAULT_CACHE_TTL)
+        httpclient.client = httpclient.HttpClient()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_script(self, script):
+        with open(self.script_path, 'w') as f:
+            f.write(script)
+        self.proj = project.Project('warm', self.script_path)
+
+    def create_mock_bake(self, ec2, status='0', images=()):
+        conn = ec2.return_value
+        inst = mock.MagicMock(id='i-bake', state='running',
+                              public_dns_name='bake.org')
+        conn.run_instances.return_value.instances = [inst]
+        conn.create_image.return_value = 'ami-new'
+        conn.get_image.return_value.state = 'available'
+        conn.get_all_images.return_value = list(images)
+        return inst
+
+    def test_bakeable_requires_meta_and_branch_steps(self):
+        self.assertTrue(self.proj.bakeable)
+        self.write_script(WARM_SCRIPT)
+        self.assertFalse(self.proj.bakeable)
+        self.assertEqual(self.proj.get_baked_image_id(), None)
+        self.write_script(WARM_SCRIPT.replace('# fleeting-branch-steps', '') +
+                          '# fleeting-meta:bake = yes\n')
+        self.assertFalse(self.proj.bakeable)
+
+    def test_baked_user_data_skips_baked_steps(self):
+        user_data = self.proj.render_user_data(GIT_USER='uzer',
+                                               GIT_BRANCH='branchu',
+                                               BAKED=True)
+        self.assertTrue('git://github.com/uzer/warm.git' in user_data)
+        self.assertTrue('generic-stuff' not in user_data)
+        self.assertTrue('python-pip' not in user_data)
+        self.assertTrue('output/baked' not in user_data)
+
+        bake = self.proj.render_bake_user_data()
+        self.assertTrue('generic-stuff' in bake)
+        self.assertTrue('python-pip' in bake)
+        self.assertTrue('git clone' not in bake)
+        self.assertTrue('echo $? > output/baked' in bake)
+
+    def test_bake_version_only_tracks_bakeable_steps(self):
+        version = self.proj.get_bake_version()
+        self.write_script(self.proj.script_template.replace(
+            'git clone', 'git clone -q'
+        ))
+        self.assertEqual(self.proj.get_bake_version(), version)
+        self.write_script(self.proj.script_template.replace(
+            'generic-stuff', 'other-stuff'
+        ))
+        self.assertNotEqual(self.proj.get_bake_version(), version)
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_baked_image_id_caches_lookups(self, ec2):
+        ec2.return_value.get_all_images.return_value = [
+            mock.MagicMock(id='ami-b')
+        ]
+        self.assertEqual(self.proj.get_baked_image_id(), 'ami-b')
+        self.assertEqual(self.proj.get_baked_image_id(), 'ami-b')
+        ec2.return_value.get_all_images.assert_called_once_with(
+            owners=['self'],
+            filters={'tag:fleeting:warm:bake': self.proj.get_bake_version(),
+                     'state': 'available'}
+        )
+
+    @mock.patch('boto.connect_ec2')
+    def test_get_baked_image_id_caches_missing_images(self, ec2):
+        ec2.return_value.get_all_images.return_value = []
+        self.assertEqual(self.proj.get_baked_image_id(), None)
+        self.assertEqual(self.proj.get_baked_image_id(), None)
+        self.assertEqual(ec2.return_value.get_all_images.call_count, 1)
+
+    @mock.patch('fleeting.project.does_url_404', lambda x: False)
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_create_instance_launches_from_baked_image(self, asc):
+        self.write_script(self.proj.script_template.replace(
+            'warm-pool     = 2', 'warm-pool     = 0'
+        ))
+        create_mock_autoscale_group(asc)
+        on_step = mock.MagicMock()
+        with mock.patch.object(self.proj, 'get_baked_image_id') as get_id:
+            get_id.return_value = 'ami-b'
+            with mock.patch.object(self.proj, 'cleanup_instances'):
+                self.proj.create_instance('z', 'uzer', 'branchu', 'key',
+                                          ['g'], on_step=on_step)
+        self.assertTrue(mock.call('find_baked_image') in
+                        on_step.call_args_list)
+        lc = asc.return_value.create_launch_configuration.call_args[0][0]
+        self.assertEqual(lc.image_id, 'ami-b')
+        self.assertTrue('generic-stuff' not in lc.user_data)
+        self.assertTrue('git://github.com/uzer/warm.git' in lc.user_data)
+
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_fill_warm_pool_uses_baked_image(self, asc):
+        inventory.publish_snapshot(project.cache, {'fleeting:warm': []})
+        with mock.patch.object(self.proj, 'get_baked_image_id') as get_id:
+            get_id.return_value = 'ami-b'
+            self.proj.fill_warm_pool('key', ['g'])
+        lc = asc.return_value.create_launch_configuration.call_args[0][0]
+        self.assertEqual(lc.image_id, 'ami-b')
+        self.assertTrue('generic-stuff' not in lc.user_data)
+        self.assertTrue(project.WARM_WAIT_SCRIPT in lc.user_data)
+
+    def test_bake_image_requires_bakeable_project(self):
+        self.write_script(WARM_SCRIPT)
+        self.assertEqual(self.proj.bake_image('key', ['g']),
+                         ('NOT_BAKEABLE', None))
+
+    @mock.patch('httplib2.Http')
+    @mock.patch('boto.connect_ec2')
+    def test_bake_image_works(self, ec2, http):
+        version = self.proj.get_bake_version()
+        stale = mock.MagicMock(tags={'fleeting:warm:bake': 'old'})
+        current = mock.MagicMock(tags={'fleeting:warm:bake': version})
+        inst = self.create_mock_bake(ec2, images=[stale, current])
+        create_mock_http_response(http, 200, '0\n')
+        self.assertEqual(self.proj.bake_image('key', ['g']),
+                         ('DONE', 'ami-new'))
+        conn = ec2.return_value
+        args, kwargs = conn.run_instances.call_args
+        self.assertEqual(args, ('ami-1',))
+        self.assertEqual(kwargs['instance_type'], 't1.micro')
+        self.assertEqual(kwargs['user_data'],
+                         self.proj.render_bake_user_data())
+        self.assertEqual(http.return_value.request.call_args[0][0],
+                         'http://bake.org:9312/baked')
+        self.assertEqual(conn.create_image.call_args[0],
+                         ('i-bake', 'fleeting_warm_%s' % version))
+        conn.create_tags.assert_called_once_with(
+            ['ami-new'], {'fleeting:warm:bake': version}
+        )
+        inst.terminate.assert_called_once_with()
+        stale.deregister.assert_called_once_with()
+        self.assertEqual(current.deregister.call_count, 0)
+        self.assertEqual(self.proj.get_baked_image_id(), 'ami-new')
+
+    @mock.patch('httplib2.Http')
+    @mock.patch('boto.connect_ec2')
+    def test_bake_image_reports_failed_scripts(self, ec2, http):
+        inst = self.create_mock_bake(ec2)
+        create_mock_http_response(http, 200, '127\n')
+        self.assertEqual(self.proj.bake_image('key', ['g']),
+                         ('BAKE_FAILED', '127'))
+        self.assertEqual(ec2.return_value.create_image.call_count, 0)
+        inst.terminate.assert_called_once_with()
+
+    @mock.patch('fleeting.project.BAKE_TIMEOUT', 0)
+    @mock.patch('boto.connect_ec2')
+    def test_bake_image_times_out_waiting_for_instance(self, ec2):
+        inst = self.create_mock_bake(ec2)
+        inst.state = 'pending'
+        self.assertEqual(self.proj.bake_image('key', ['g']),
+                         ('TIMEOUT', None))
+        inst.terminate.assert_called_once_with()
+
+    @mock.patch('fleeting.project.BAKE_TIMEOUT', 0)
+    @mock.patch('httplib2.Http')
+    @mock.patch('boto.connect_ec2')
+    def test_bake_image_times_out_waiting_for_image(self, ec2, http):
+        inst = self.create_mock_bake(ec2)
+        ec2.return_value.get_image.return_value.state = 'pending'
+        create_mock_http_response(http, 200, '0')
+        self.assertEqual(self.proj.bake_image('key', ['g']),
+                         ('TIMEOUT', 'ami-new'))
+        inst.terminate.assert_called_once_with()
+
+    @mock.patch('httplib2.Http')
+    def test_get_bake_status_waits_for_status_file(self, http):
+        inst = mock.MagicMock(state='running', public_dns_name='bake.org')
+        create_mock_http_response(http, 404)
+        self.assertEqual(self.proj._get_bake_status(inst), None)
+        http.return_value.request.side_effect = Exception('timeout')
+        self.assertEqual(self.proj._get_bake_status(inst), None)
+        inst.public_dns_name = ''
+        self.assertEqual(self.proj._get_bake_status(inst), None)
+
+    @mock.patch('fleeting.project.time')
+    def test_wait_for_polls_until_deadline(self, time):
+        time.time.return_value = 0
+        results = [None, 'x']
+        self.assertEqual(self.proj._wait_for(lambda: results.pop(0), 10),
+                         'x')
+        time.sleep.assert_called_once_with(project.BAKE_POLL_INTERVAL)
+
+class TimingTests(unittest.TestCase):
+    def setUp(self):
+        project.cache = DictTempCache(project.DEFAULT_CACHE_TTL)
+        httpclient.client = httpclient.HttpClient()
+        self.proj = project.Project('openbadges')
+
+    def create_instance(self, instance_id='i-1', **info):
+        info.setdefault('slug', 'z')
+        return mock.MagicMock(
+            id=instance_id,
+            public_dns_name='z.org',
+            launch_time='1970-01-01T00:01:40.000Z',
+            tags={'fleeting:openbadges': json.dumps(info)}
+        )
+
+    def test_user_data_marks_phases(self):
+        user_data = self.proj.render_user_data(GIT_USER='u', GIT_BRANCH='b')
+        self.assertTrue('fleeting_phase packages\n' in user_data)
+        self.assertTrue('fleeting_phase project\n./startproject' in user_data)
+        self.assertTrue('# fleeting-branch-steps\nfleeting_phase branch\n'
+                        in user_data)
+        steps = self.proj.render_branch_steps('u', 'b')
+        self.assertTrue(steps.startswith('\nfleeting_phase branch\n'))
+
+    @mock.patch('httplib2.Http')
+    def test_record_timings_works(self, http):
+        create_mock_http_response(http, 200, '110 packages\n150 project\n')
+        record = self.proj.record_timings(self.create_instance(), ready=200)
+        self.assertEqual(http.return_value.request.call_args[0][0],
+                         'http://z.org:9312/phases.txt')
+        self.assertEqual(record, dict(
+            slug='z',
+            instance_id='i-1',
+            start=100,
+            ready=200,
+            phases=[('boot', 10), ('packages', 40), ('project', 50)]
+        ))
+        self.assertEqual(self.proj.get_timings(), [record])
+
+    @mock.patch('httplib2.Http')
+    def test_record_timings_only_records_once(self, http):
+        create_mock_http_response(http, 200, '')
+        self.proj.record_timings(self.create_instance('i-1'), ready=200)
+        self.proj.record_timings(self.create_instance('i-1'), ready=300)
+        self.proj.record_timings(self.create_instance('i-12'), ready=300)
+        self.assertEqual(http.return_value.request.call_count, 2)
+        self.assertEqual([r['ready'] for r in self.proj.get_timings()],
+                         [200, 300])
+
+    @mock.patch('time.time')
+    @mock.patch('httplib2.Http')
+    def test_record_timings_survives_missing_markers(self, http, now):
+        now.return_value = 250.5
+        create_mock_http_response(http, 404)
+        record = self.proj.record_timings(self.create_instance())
+        self.assertEqual(record['phases'], [('boot', 150)])
+        self.assertEqual(record['ready'], 250)
+
+    def test_record_timings_needs_launch_time(self):
+        inst = self.create_instance()
+        inst.launch_time = 'unknown'
+        self.assertEqual(self.proj.record_timings(inst), None)
+
+    @mock.patch('httplib2.Http')
+    def test_record_timings_times_claimed_instances_from_claim(self, http):
+        create_mock_http_response(http, 200, '110 project\n150 branch\n'
+                                             '170 install\n')
+        inst = self.create_instance(group='warm-1-0')
+        record = self.proj.record_timings(inst, ready=200)
+        self.assertEqual(record['start'], 150)
+        self.assertEqual(record['phases'], [('branch', 20), ('install', 30)])
+
+        create_mock_http_response(http, 200, '110 project\n')
+        inst = self.create_instance('i-2', group='warm-1-0')
+        self.assertEqual(self.proj.record_timings(inst, ready=200), None)
+
+class ReadyCallbackTests(unittest.TestCase):
+    CALLBACK = 'http://f.org/openbadges/ready-callback?slug=z&signature=s'
+
+    def setUp(self):
+        project.cache = DictTempCache(project.DEFAULT_CACHE_TTL)
+        self.proj = project.Project('openbadges')
+
+    def test_user_data_reports_readiness(self):
+        user_data = self.proj.render_user_data(
+            GIT_USER='u',
+            GIT_BRANCH='b',
+            READY_CALLBACK_URL=self.CALLBACK
+        )
+        self.assertTrue("'http://localhost:8888/'`\" = 200" in user_data)
+        self.assertTrue("curl -s -f -X POST '%s'" % self.CALLBACK
+                        in user_data)
+        plain = self.proj.render_user_data(GIT_USER='u', GIT_BRANCH='b')
+        self.assertTrue('curl' not in plain)
+
+    def test_branch_steps_report_readiness(self):
+        steps = self.proj.render_branch_steps('u', 'b', self.CALLBACK)
+        self.assertTrue(self.CALLBACK in steps)
+        self.assertTrue('git clone' in steps)
+
+    @mock.patch('fleeting.project.does_url_404', lambda x: False)
+    @mock.patch('fleeting.project.AutoScaleConnection')
+    def test_create_instance_passes_ready_callback(self, asc):
+        create_mock_autoscale_group(asc)
+        with mock.patch.object(self.proj, 'cleanup_instances'):
+            self.proj.create_instance('z', 'u', 'b', 'key', ['g'],
+                                      ready_callback=self.CALLBACK)
+        lc = asc.return_value.create_launch_configuration.call_args[0][0]
+        self.assertTrue(self.CALLBACK in lc.user_data)
+        ag = asc.return_value.create_auto_scaling_group.call_args[0][0]
+        self.assertEqual(json.loads(ag.tags[0].value)['ready_callback'], True)
+
+    def test_mark_ready_works(self):
+        inst = mock.MagicMock(public_dns_name='z.org', tags={})
+        with mock.patch.object(self.proj, 'record_timings') as record:
+            self.assertEqual(self.proj.mark_ready('z', inst),
+                             'http://z.org:8888/')
+            record.assert_called_once_with(inst)
+        inst.add_tag.assert_called_once_with('fleeting:openbadges:ready',
+                                             'http://z.org:8888/')
+        self.assertEqual(
+            project.cache.find('fleeting-ready:fleeting:openbadges:z'),
+            [dict(slug='z', url='http://z.org:8888/')]
+        )
+
+    def test_mark_ready_keeps_existing_tag(self):
+        inst = mock.MagicMock(public_dns_name='z.org', tags={
+            'fleeting:openbadges:ready': 'http://z.org:8888/'
+        })
+        with mock.patch.object(self.proj, 'record_timings'):
+            self.proj.mark_ready('z', inst)
+        self.assertEqual(inst.add_tag.call_count, 0)
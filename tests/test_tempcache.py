@@ -2,9 +2,28 @@ import unittest
 
 import mock
 
-from fleeting.tempcache import DictTempCache, RedisTempCache
+from fleeting import metrics
+from fleeting.tempcache import DictTempCache, RedisTempCache, freeze, \
+                               index_prefixes, FIND_SCRIPT, \
+                               EXTEND_EXPIRY_SCRIPT
 
 class DictTempCacheTests(unittest.TestCase):
+    @mock.patch('fleeting.metrics.store', metrics.LocalMetrics())
+    def test_lookups_are_counted(self):
+        c = DictTempCache(5)
+        c['fleeting-console:i-1'] = dict(hi=1)
+        c.find('fleeting-console:i-1')
+        c.find('fleeting-console:i-2')
+        c.find('fleeting-urlcheck:')
+        self.assertEqual(metrics.store.snapshot(), {
+            'fleeting_cache_lookups_total'
+            '{namespace="fleeting-console",result="hit"}': 1,
+            'fleeting_cache_lookups_total'
+            '{namespace="fleeting-console",result="miss"}': 1,
+            'fleeting_cache_lookups_total'
+            '{namespace="fleeting-urlcheck",result="miss"}': 1
+        })
+
     @mock.patch('time.time')
     def test_cache_expires_items(self, time):
         c = DictTempCache(5)
@@ -16,29 +35,150 @@ class DictTempCacheTests(unittest.TestCase):
         time.return_value = 1006
         self.assertEqual(c.find('foo'), [])
 
+    @mock.patch('time.time')
+    def test_set_supports_per_entry_ttls(self, time):
+        c = DictTempCache(5)
+
+        time.return_value = 1000
+        c.set('foo:a', dict(hi=1), ttl=60)
+        c['foo:b'] = dict(hi=2)
+
+        time.return_value = 1006
+        self.assertEqual(c.find('foo:'), [{'hi': 1}])
+
+        time.return_value = 1060
+        self.assertEqual(c.find('foo:'), [])
+        self.assertEqual(len(c), 0)
+
+    @mock.patch('time.time')
+    def test_overwriting_extends_expiry(self, time):
+        c = DictTempCache(5)
+
+        time.return_value = 1000
+        c['foo'] = dict(hi=1)
+        time.return_value = 1003
+        c['foo'] = dict(hi=2)
+        time.return_value = 1006
+        self.assertEqual(c.find('foo'), [{'hi': 2}])
+        time.return_value = 1008
+        self.assertEqual(c.find('foo'), [])
+
+    @mock.patch('time.time', lambda: 1000)
+    def test_stale_expiries_are_compacted(self):
+        c = DictTempCache(5)
+        for i in range(100):
+            c['foo'] = dict(hi=i)
+        self.assertTrue(len(c._DictTempCache__expiries) < 100)
+        self.assertEqual(c.find('foo'), [{'hi': 99}])
+
+    def test_find_only_returns_prefix_matches(self):
+        c = DictTempCache(5)
+        for key in ['a', 'b:1', 'b:2', 'b', 'bb:1', 'c:1']:
+            c[key] = dict(key=key)
+        self.assertEqual([item['key'] for item in c.find('b:')],
+                         ['b:1', 'b:2'])
+        self.assertEqual([item['key'] for item in c.find('b')],
+                         ['b', 'b:1', 'b:2', 'bb:1'])
+        self.assertEqual(c.find('z'), [])
+
+    def test_find_returns_frozen_values(self):
+        c = DictTempCache(5)
+        value = dict(hi=1, items=[dict(a=1)])
+        c['foo'] = value
+        value['hi'] = 2
+        item = c.find('foo')[0]
+        self.assertEqual(item, {'hi': 1, 'items': [{'a': 1}]})
+        self.assertTrue(c.find('foo')[0] is item)
+        self.assertRaises(TypeError, item.__setitem__, 'hi', 3)
+        self.assertRaises(TypeError, item['items'].append, 3)
+        self.assertRaises(TypeError, item['items'][0].update, b=2)
+
+    def test_freeze_leaves_scalars_alone(self):
+        self.assertEqual(freeze('hi'), 'hi')
+        self.assertEqual(freeze(5), 5)
+
+    def test_max_entries_evicts_least_recently_used(self):
+        c = DictTempCache(5, max_entries=2)
+        c['a'] = dict(v=1)
+        c['b'] = dict(v=2)
+        c.find('a')
+        c['c'] = dict(v=3)
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.find('b'), [])
+        self.assertEqual(c.find('a'), [{'v': 1}])
+        self.assertEqual(c.find('c'), [{'v': 3}])
+
 class RedisTempCacheTests(unittest.TestCase):
+    def test_index_prefixes_works(self):
+        self.assertEqual(index_prefixes('a:b:c'), ['a:', 'a:b:', 'a:b:c'])
+        self.assertEqual(index_prefixes('a:b:'), ['a:', 'a:b:'])
+        self.assertEqual(index_prefixes('abc'), ['abc'])
+
+    @mock.patch('time.time', lambda: 1000)
     @mock.patch('fleeting.tempcache.redis')
     def test_setitem_works(self, redis):
         r = RedisTempCache(ttl=50, url='redis://foo:6379')
-        r['lulz'] = {'hi': 1}
-        r.redis.hmset.assert_called_once_with('lulz', {'hi': 1})
-        r.redis.expire.assert_called_once_with('lulz', 50)
+        r['lulz:a'] = {'hi': 1}
+        r.redis.pipeline.assert_called_once_with(transaction=False)
+        pipe = r.redis.pipeline.return_value
+        pipe.set.assert_called_once_with('lulz:a', '{"hi": 1}', ex=50)
+        self.assertEqual(pipe.zadd.call_args_list, [
+            mock.call('tempcache-index:lulz:', 'lulz:a', 1050),
+            mock.call('tempcache-index:lulz:a', 'lulz:a', 1050)
+        ])
+        r.redis.register_script.assert_called_once_with(EXTEND_EXPIRY_SCRIPT)
+        script = r.redis.register_script.return_value
+        self.assertEqual(script.call_args_list, [
+            mock.call(keys=['tempcache-index:lulz:'], args=[50], client=pipe),
+            mock.call(keys=['tempcache-index:lulz:a'], args=[50], client=pipe)
+        ])
+        self.assertEqual(pipe.zremrangebyscore.call_args_list, [
+            mock.call('tempcache-index:lulz:', '-inf', 1000),
+            mock.call('tempcache-index:lulz:a', '-inf', 1000)
+        ])
+        pipe.execute.assert_called_once_with()
+
+    @mock.patch('time.time', lambda: 1000)
+    @mock.patch('fleeting.tempcache.redis')
+    def test_set_supports_per_entry_ttls(self, redis):
+        r = RedisTempCache(ttl=50, url='redis://foo:6379')
+        r.set('lulz', {'hi': 1}, ttl=500)
+        pipe = r.redis.pipeline.return_value
+        pipe.set.assert_called_once_with('lulz', '{"hi": 1}', ex=500)
+        pipe.zadd.assert_called_once_with('tempcache-index:lulz', 'lulz',
+                                          1500)
+        script = r.redis.register_script.return_value
+        script.assert_called_once_with(keys=['tempcache-index:lulz'],
+                                       args=[500], client=pipe)
+        self.assertEqual(pipe.expire.call_count, 0)
+        r.set('lulz', {'hi': 1}, ttl=5)
+        self.assertEqual(r.redis.register_script.call_count, 1)
 
+    @mock.patch('time.time', lambda: 1000)
     @mock.patch('fleeting.tempcache.redis')
     def test_find_works(self, redis):
         r = RedisTempCache(ttl=50, url='redis://foo:6379')
-        r.redis.keys.return_value = ['lol']
-        r.redis.hgetall.return_value = {'hi': 1}
-        self.assertEqual(r.find('lo'), [{'hi': 1}])
-        r.redis.keys.assert_called_once_with('lo*')
-        r.redis.hgetall.assert_called_once_with('lol')
+        script = r.redis.register_script.return_value
+        script.return_value = ['{"hi": 1, "lifetime": 86400.0}']
+        self.assertEqual(r.find('lo:'), [{'hi': 1, 'lifetime': 86400.0}])
+        r.redis.register_script.assert_called_once_with(FIND_SCRIPT)
+        script.assert_called_once_with(keys=['tempcache-index:lo:'],
+                                       args=[1000])
+        self.assertEqual(r.redis.keys.call_count, 0)
+
+    @mock.patch('fleeting.tempcache.redis')
+    def test_find_only_registers_script_once(self, redis):
+        r = RedisTempCache(ttl=50, url='redis://foo:6379')
+        r.redis.register_script.return_value.return_value = []
+        r.find('lo:')
+        r.find('lo:')
+        self.assertEqual(r.redis.register_script.call_count, 1)
 
     @mock.patch('fleeting.tempcache.redis')
-    def test_find_removes_empty_dicts(self, redis):
+    def test_find_removes_missing_values(self, redis):
         r = RedisTempCache(ttl=50, url='redis://foo:6379')
-        r.redis.keys.return_value = ['lol']
-        r.redis.hgetall.return_value = {}
-        self.assertEqual(r.find('lo'), [])
+        r.redis.register_script.return_value.return_value = [None]
+        self.assertEqual(r.find('lo:'), [])
 
     @mock.patch('fleeting.tempcache.redis')
     def test_constructor_works(self, redis):
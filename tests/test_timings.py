@@ -0,0 +1,43 @@
+import unittest
+
+from fleeting import timings
+
+class TimingsTests(unittest.TestCase):
+    def test_parse_markers_skips_garbage(self):
+        self.assertEqual(timings.parse_markers(
+            '20 pip\n10 packages\nnope\n30\n\n40 install deps\n'
+        ), [(10, 'packages'), (20, 'pip'), (40, 'install deps')])
+
+    def test_get_phases_ends_last_phase_when_ready(self):
+        self.assertEqual(timings.get_phases(0, [(5, 'a'), (12, 'b')], 20), [
+            ('boot', 5),
+            ('a', 7),
+            ('b', 8)
+        ])
+
+    def test_get_phases_ignores_clock_skew(self):
+        self.assertEqual(timings.get_phases(10, [(5, 'a')], 20, 'branch'), [
+            ('branch', 0),
+            ('a', 15)
+        ])
+
+    def test_percentile_works(self):
+        self.assertEqual(timings.percentile([5, 1, 3, 2, 4], 50), 3)
+        self.assertEqual(timings.percentile(range(1, 11), 90), 9)
+        self.assertEqual(timings.percentile([7], 90), 7)
+
+    def test_summarize_works(self):
+        summary = timings.summarize([
+            dict(start=0, ready=30, phases=[('boot', 10), ('a', 5),
+                                            ('a', 15)]),
+            dict(start=0, ready=10, phases=[('boot', 4), ('b', 6)])
+        ])
+        self.assertEqual(summary, [
+            dict(phase='boot', count=2, p50=4, p90=10, max=10),
+            dict(phase='a', count=1, p50=20, p90=20, max=20),
+            dict(phase='b', count=1, p50=6, p90=6, max=6),
+            dict(phase='total', count=2, p50=10, p90=30, max=30)
+        ])
+
+    def test_summarize_handles_no_records(self):
+        self.assertEqual(timings.summarize([]), [])
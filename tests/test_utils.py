@@ -1,4 +1,5 @@
 import unittest
+from threading import Event
 
 import mock
 
@@ -42,3 +43,39 @@ class UtilsTests(unittest.TestCase):
         msg = 'environment variable QWOP is not defined'
         with self.assertRaisesRegexp(KeyError, msg):
             utils.ensure_env_vars(['QWOP'])
+
+class PeriodicTaskTests(unittest.TestCase):
+    def test_run_once_passes_kwargs(self):
+        func = mock.MagicMock()
+        utils.PeriodicTask(func, 5, kwargs=dict(a=1)).run_once()
+        func.assert_called_once_with(a=1)
+
+    def test_run_once_logs_exceptions(self):
+        logger = mock.MagicMock()
+        func = mock.MagicMock(__name__='blarg', side_effect=Exception())
+        utils.PeriodicTask(func, 5, logger=logger).run_once()
+        logger.exception.assert_called_once_with(
+            'periodic task blarg failed'
+        )
+
+    def test_run_loops_until_stopped(self):
+        task = utils.PeriodicTask(mock.MagicMock(), 5)
+        task.stopped.wait = mock.MagicMock(side_effect=lambda t: (
+            task.func.call_count == 3 and task.stopped.set()
+        ))
+        task.run()
+        self.assertEqual(task.func.call_count, 3)
+        task.stopped.wait.assert_called_with(5)
+
+    def test_start_and_stop_work(self):
+        called = Event()
+        task = utils.PeriodicTask(called.set, 60).start()
+        called.wait(5)
+        task.stop()
+        self.assertTrue(called.is_set())
+        self.assertFalse(task.thread.is_alive())
+
+    def test_stop_works_without_start(self):
+        task = utils.PeriodicTask(mock.MagicMock(), 60)
+        task.stop()
+        self.assertTrue(task.stopped.is_set())